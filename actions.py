@@ -1,5 +1,5 @@
 import numpy as np
-from deck import init_truco_deck
+from card import card_names
 
 truco_actions = np.array([ 
     'truco', 
@@ -24,8 +24,13 @@ other_actions = np.array([
 playable_actions = np.concatenate((truco_actions, envido_actions, response_actions, other_actions))
 
 
-playable_cards = np.array([str(c) for c in init_truco_deck()])
+playable_cards = np.array(card_names)
 
 game_actions = np.concatenate((playable_actions, playable_cards))
 
-game_actions_list = game_actions.tolist()
\ No newline at end of file
+game_actions_list = game_actions.tolist()
+
+game_actions_index = {action: i for i, action in enumerate(game_actions_list)}
+
+# Cards are the last actions, in card id order
+card_action_offset = len(playable_actions)
@@ -2,18 +2,95 @@ import torch as T
 from torch import nn
 from collections import deque
 import itertools
+import copy
 import numpy as np
-from actions import game_actions_list
+from card_utils import encode_legal_actions
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from numpy_network import NumpyDQNetwork
+from profiler import profiler
 import random
 from player import Player
 
-def load_model(name, path=None):
-    return T.load(f"./agent_saves/{name}/model.pt")
+choose_action_phase = profiler.phase('agent.choose_action')
+choose_actions_phase = profiler.phase('agent.choose_actions')
+save_transition_phase = profiler.phase('agent.save_transition')
+learn_phase = profiler.phase('learn')
+sample_phase = profiler.phase('learn.sample')
+forward_phase = profiler.phase('learn.forward')
+backward_phase = profiler.phase('learn.backward')
+target_sync_phase = profiler.phase('learn.target_sync')
 
-def load_agent(name, device):
+def get_legal_actions_mask(legal_actions):
+    ''' Accepts the legal actions as a list of names or as a bool mask aligned with game_actions.
+    '''
+    if isinstance(legal_actions, np.ndarray) and legal_actions.dtype == bool:
+        return legal_actions
+    return encode_legal_actions(legal_actions)
+
+def sample_legal_action(legal_mask):
+    # pick legal action given uniform distribution
+    legal_ids = np.flatnonzero(legal_mask)
+    return int(legal_ids[np.random.randint(len(legal_ids))])
+
+def get_epsilon(step, epsilon_start, epsilon_end, epsilon_decay):
+    return np.interp(step, [0, epsilon_decay], [epsilon_start, epsilon_end])
+
+def epsilon_greedy_action(online_net, device, legal_actions, game_state, epsilon):
+    legal_mask = get_legal_actions_mask(legal_actions)
+    
+    if random.random() <= epsilon:
+        return sample_legal_action(legal_mask)
+    
+    if isinstance(online_net, NumpyDQNetwork):
+        q_values = online_net.act(game_state)
+    else:
+        # Copy game state so we dont have to send it back to cpu after compute
+        game_state_copy = game_state.copy()
+        game_state_copy = T.as_tensor(game_state_copy).to(device)
+        q_values = online_net.act(game_state_copy).cpu().numpy()
+    # Get index of best legal action
+    return int(np.argmax(np.where(legal_mask, q_values, -np.inf)))
+
+def epsilon_greedy_actions(online_net, device, legal_masks, game_states, epsilon):
+    ''' Batched epsilon_greedy_action: one forward pass for all states.
+    Args:
+        legal_masks: bool array (n, action_space_dim)
+        game_states: float32 array (n, state_space_dim)
+    '''
+    legal_masks = np.asarray(legal_masks, dtype=bool)
+    
+    # Uniform legal action for every row: the legal action with the largest random key
+    actions = np.argmax(np.random.random(legal_masks.shape) * legal_masks, axis=1)
+    
+    greedy = np.random.random(len(legal_masks)) > epsilon
+    if greedy.any():
+        if isinstance(online_net, NumpyDQNetwork):
+            q_values = online_net(np.asarray(game_states)[greedy])
+        else:
+            with T.no_grad():
+                q_values = online_net(T.as_tensor(np.asarray(game_states)[greedy]).to(device)).cpu().numpy()
+        actions[greedy] = np.argmax(np.where(legal_masks[greedy], q_values, -np.inf), axis=1)
+    
+    return actions
+
+def build_network(model_type, state_space_dim, action_space_dim):
+    if model_type == 'deep':
+        return VeryDQNetwork(state_space_dim, action_space_dim)
+    return LessDQNetwork(state_space_dim, action_space_dim)
+
+def load_model(name, path=None, device=None):
+    path = f"./agent_saves/{name}/model.pt" if path is None else path
+    return T.load(path, map_location=device)
+
+def load_agent(name, device, numpy_inference=False, quantize=False):
+    '''
+    Load a saved agent. With numpy_inference it chooses actions with a NumPy copy of its online network,
+    which is faster for evaluation and play but does not follow further training. quantize emulates int8
+    weights and activations on it, to measure their accuracy; it is slower than float32.
+    '''
     player = Player(name)
-    loaded = load_model(name)
-    return Agent(player,
+    loaded = load_model(name, device=device)
+    agent = Agent(player,
                  state_space_dim=loaded['state_space_dim'], 
                  action_space_dim=loaded['action_space_dim'], 
                  model_type=loaded['model_type'], 
@@ -31,7 +108,16 @@ def load_agent(name, device):
                  epsilon_decay=loaded['epsilon_decay'],
                  gamma=loaded['gamma'],
                  step=loaded['step'],
+                 compress_replay=loaded.get('compress_replay', False),
+                 replay_next_capacity=loaded.get('replay_next_capacity'),
+                 prioritized_replay=loaded.get('prioritized_replay', False),
+                 priority_alpha=loaded.get('priority_alpha', 0.6),
+                 priority_beta_start=loaded.get('priority_beta_start', 0.4),
+                 priority_beta_steps=loaded.get('priority_beta_steps', 1000000),
                  device=device)
+    if numpy_inference:
+        agent.inference_net = NumpyDQNetwork.from_torch(agent.online_net, quantize=quantize)
+    return agent
 
 def save_agent(agent, name=None):
     name = agent.get_name() if name is None else name
@@ -57,7 +143,13 @@ def save_agent(agent, name=None):
         "epsilon_end": agent.epsilon_end,
         "epsilon_decay": agent.epsilon_decay,
         "gamma": agent.gamma,
-        "step": agent.step
+        "step": agent.step,
+        "compress_replay": agent.replay_buffer.compress,
+        "replay_next_capacity": agent.replay_buffer.next_capacity,
+        "prioritized_replay": agent.prioritized_replay,
+        "priority_alpha": agent.priority_alpha,
+        "priority_beta_start": agent.priority_beta_start,
+        "priority_beta_steps": agent.priority_beta_steps
     }
     T.save(model, f"./agent_saves/{name}/model.pt")
     print(f"Agent {name} saved. \r")
@@ -114,11 +206,11 @@ class RandomAgent:
         self.reward_buffer = deque([0.0], maxlen=100)
         
     def choose_action(self, legal_actions, game_state):
-         # pick legal action given uniform distribution
-        action = np.random.choice(legal_actions, 1, [1/len(legal_actions) for i in legal_actions])
-        action = game_actions_list.index(action)
-        
-        return action
+        return sample_legal_action(get_legal_actions_mask(legal_actions))
+    
+    def choose_actions(self, legal_masks, game_states):
+        legal_masks = np.asarray(legal_masks, dtype=bool)
+        return np.argmax(np.random.random(legal_masks.shape) * legal_masks, axis=1)
     
     def learn(self):
         pass
@@ -133,6 +225,49 @@ class RandomAgent:
         return self.player.get_id()
     
     
+class ActorAgent:
+    '''
+    Acting-only copy of an Agent: its online network and exploration schedule, without optimizer or replay memory.
+    Used by self-play actors, which receive fresh weights and step counts from the learner.
+    '''
+    def __init__(self, player, config, model_state_dict, device='cpu'):
+        self.player = player
+        self.device = device
+        self.epsilon_start = config['epsilon_start']
+        self.epsilon_end = config['epsilon_end']
+        self.epsilon_decay = config['epsilon_decay']
+        self.step = config['step']
+        
+        self.online_net = build_network(config['model_type'], config['state_space_dim'], config['action_space_dim'])
+        self.online_net.load_state_dict(model_state_dict)
+        self.online_net = self.online_net.to(device)
+        
+    def choose_actions(self, legal_masks, game_states):
+        epsilon = get_epsilon(self.step, self.epsilon_start, self.epsilon_end, self.epsilon_decay)
+        with choose_actions_phase:
+            actions = epsilon_greedy_actions(self.online_net, self.device, legal_masks, game_states, epsilon)
+        
+        self.step += len(actions)
+        
+        return actions
+        
+    def load_weights(self, model_state_dict, step):
+        self.online_net.load_state_dict(model_state_dict)
+        self.step = step
+        
+    def choose_action(self, legal_actions, game_state):
+        epsilon = get_epsilon(self.step, self.epsilon_start, self.epsilon_end, self.epsilon_decay)
+        with choose_action_phase:
+            action = epsilon_greedy_action(self.online_net, self.device, legal_actions, game_state, epsilon)
+        
+        self.step += 1
+        
+        return action
+
+    def get_name(self):
+        return self.player.get_id()
+    
+    
 class Agent:
     def __init__(self, player,
                  device, 
@@ -154,10 +289,19 @@ class Agent:
                  epsilon_end=0.02, 
                  epsilon_decay=10000,
                  step=0,
-                 gamma=0.99):
+                 gamma=0.99,
+                 compress_replay=False,
+                 replay_next_capacity=None,
+                 prioritized_replay=False,
+                 priority_alpha=0.6,
+                 priority_beta_start=0.4,
+                 priority_beta_steps=1000000):
         
         self.player = player
         self.loss = loss
+        # Same loss per sample, to apply importance sampling weights
+        self.elementwise_loss = copy.copy(loss)
+        self.elementwise_loss.reduction = 'none'
         self.device = device
         self.model_type = model_type
         self.state_space_dim = state_space_dim
@@ -223,7 +367,23 @@ class Agent:
             self.optimizer.load_state_dict(optimizer_state_dict)
             
         
-        self.replay_buffer = deque(maxlen=replay_buffer_size)
+        self.prioritized_replay = prioritized_replay
+        self.priority_alpha = priority_alpha
+        self.priority_beta_start = priority_beta_start
+        self.priority_beta_steps = priority_beta_steps
+        if prioritized_replay:
+            self.replay_buffer = PrioritizedReplayBuffer(
+                replay_buffer_size, 
+                state_space_dim, 
+                action_space_dim, 
+                compress=compress_replay,
+                next_capacity=replay_next_capacity,
+                alpha=priority_alpha,
+                beta_start=priority_beta_start,
+                beta_steps=priority_beta_steps
+            )
+        else:
+            self.replay_buffer = ReplayBuffer(replay_buffer_size, state_space_dim, action_space_dim, compress=compress_replay, next_capacity=replay_next_capacity)
         self.min_replay_size = min_replay_size
         
         self.reward_buffer = deque([0.0], maxlen=reward_buffer_size)
@@ -236,72 +396,91 @@ class Agent:
         self.gamma = gamma
         self.step = step
         
+        # Network used to choose actions, when it is not online_net
+        self.inference_net = None
+        
+    def get_inference_net(self):
+        return self.online_net if self.inference_net is None else self.inference_net
+        
     def choose_action(self, legal_actions, game_state):
-        epsilon = np.interp(self.step, [0, self.epsilon_decay], [self.epsilon_start, self.epsilon_end])
-        use_random = random.random() <= epsilon
-
-        action = None
-        if use_random:
-            # pick legal action given uniform distribution
-            action = np.random.choice(legal_actions, 1, [1/len(legal_actions) for i in legal_actions])
-            action = game_actions_list.index(action)
-        else: 
-            # Copy game state so we dont have to send it back to cpu after compute
-            game_state_copy = game_state.copy()
-            game_state_copy = T.as_tensor(game_state_copy).to(self.device)
-            q_values = self.online_net.act(game_state_copy)
-            # Get index of best action
-            action = T.argmax(q_values, axis=0)
-            # Send game_state and action to cpu so we can save it into replay memory
-            action = action.cpu().data.numpy()
-            
+        epsilon = get_epsilon(self.step, self.epsilon_start, self.epsilon_end, self.epsilon_decay)
+        with choose_action_phase:
+            action = epsilon_greedy_action(self.get_inference_net(), self.device, legal_actions, game_state, epsilon)
+        
         self.step += 1
         
         return action
     
+    def choose_actions(self, legal_masks, game_states):
+        ''' Choose actions for a batch of states with one forward pass. Each state counts as a step.
+        '''
+        epsilon = get_epsilon(self.step, self.epsilon_start, self.epsilon_end, self.epsilon_decay)
+        with choose_actions_phase:
+            actions = epsilon_greedy_actions(self.get_inference_net(), self.device, legal_masks, game_states, epsilon)
+        
+        self.step += len(actions)
+        
+        return actions
+    
     def learn(self):
-        # Start Gradient Step
-        transitions = random.sample(self.replay_buffer, self.batch_size)
-
-        all_obs = np.vstack([t[0] for t in transitions])
-        all_actions = np.asarray([t[1] for t in transitions], dtype=np.int64)
-        all_rews = np.asarray([t[2] for t in transitions], dtype=np.float32)
-        all_dones = np.asarray([t[3] for t in transitions], dtype=np.float32)
-        all_new_obs = np.vstack([t[4] for t in transitions])
+        with learn_phase:
+            self._learn()
 
+    def _learn(self):
+        # Start Gradient Step
+        with sample_phase:
+            weights = None
+            if self.prioritized_replay:
+                indices, weights = self.replay_buffer.sample_prioritized(self.batch_size)
+            else:
+                indices = self.replay_buffer.sample_indices(self.batch_size)
+            all_obs, all_actions, all_rews, all_dones, all_new_obs, all_new_masks = self.replay_buffer.gather(indices)
 
-        obs_t = T.as_tensor(all_obs).to(self.device)
-        actions_t = T.as_tensor(all_actions).unsqueeze(-1).to(self.device)
-        rews_t = T.as_tensor(all_rews).to(self.device)
-        new_obs_t = T.as_tensor(all_new_obs).to(self.device)
-        dones_t = T.as_tensor(all_dones).to(self.device)
-        
-        # Zero our gradients before training
-        self.optimizer.zero_grad() 
+            obs_t = T.as_tensor(all_obs).to(self.device)
+            actions_t = T.as_tensor(all_actions).unsqueeze(-1).to(self.device)
+            rews_t = T.as_tensor(all_rews).to(self.device)
+            new_obs_t = T.as_tensor(all_new_obs).to(self.device)
+            dones_t = T.as_tensor(all_dones).to(self.device)
+            new_masks_t = T.as_tensor(all_new_masks).to(self.device)
+        
+        with forward_phase:
+            # Zero our gradients before training
+            self.optimizer.zero_grad() 
 
-        # Compute Targets
-        target_q_values = self.target_net(new_obs_t)
-        max_target_q_values = target_q_values.max(dim=1, keepdim=True)[0].squeeze()
-       
-        targets = rews_t + self.gamma * (1 - dones_t) * max_target_q_values
+            # Compute Targets
+            target_q_values = self.target_net(new_obs_t)
+            # Only legal actions of the new state count towards the target
+            target_q_values = target_q_values.masked_fill(~new_masks_t, -np.inf)
+            max_target_q_values = target_q_values.max(dim=1, keepdim=True)[0].squeeze()
+            max_target_q_values = T.where(new_masks_t.any(dim=1), max_target_q_values, T.zeros_like(max_target_q_values))
+           
+            targets = rews_t + self.gamma * (1 - dones_t) * max_target_q_values
 
-        # Compute Loss
-        q_values = self.online_net(obs_t)
-        action_q_values = T.gather(input=q_values, dim=1, index=actions_t).squeeze()
+            # Compute Loss
+            q_values = self.online_net(obs_t)
+            action_q_values = T.gather(input=q_values, dim=1, index=actions_t).squeeze()
 
-        # Calculate loss
-        loss = self.loss(action_q_values, targets).to(self.device)
+            # Calculate loss
+            if weights is None:
+                loss = self.loss(action_q_values, targets).to(self.device)
+            else:
+                weights_t = T.as_tensor(weights).to(self.device)
+                loss = (weights_t * self.elementwise_loss(action_q_values, targets)).mean()
+                self.replay_buffer.update_priorities(indices, (action_q_values - targets).detach().cpu().numpy())
 
         # Gradient Descent
-        loss.backward()
-        self.optimizer.step()
+        with backward_phase:
+            loss.backward()
+            self.optimizer.step()
         
         # Update Target Network
         if self.step % self.target_update_freq == 0:
-            self.target_net.load_state_dict(self.online_net.state_dict())
+            with target_sync_phase:
+                self.target_net.load_state_dict(self.online_net.state_dict())
     
     def save_transition(self, transition):
-        self.replay_buffer.append(transition)
+        with save_transition_phase:
+            self.replay_buffer.append(transition)
         
     def save_reward(self, episode_reward):
         self.reward_buffer.append(episode_reward)
@@ -325,5 +504,11 @@ class Agent:
         "epsilon_end": self.epsilon_end,
         "epsilon_decay": self.epsilon_decay,
         "gamma": self.gamma,
-        "step": self.step
+        "step": self.step,
+        "compress_replay": self.replay_buffer.compress,
+        "replay_next_capacity": self.replay_buffer.next_capacity,
+        "prioritized_replay": self.prioritized_replay,
+        "priority_alpha": self.priority_alpha,
+        "priority_beta_start": self.priority_beta_start,
+        "priority_beta_steps": self.priority_beta_steps
         }
\ No newline at end of file
@@ -0,0 +1,536 @@
+'''
+Array-native Truco engine for many hands at once.
+
+TrucoBatch keeps K hands as parallel arrays (cards in hand, cards played, wager calls and DFA states,
+scores) and plays one decision of every hand per step with vectorized NumPy operations, without any
+TrucoGame, Player or Card objects. It follows the rules of TrucoGame and produces the same legal action
+masks, rewards and encoded game states as TrucoEnvironment with legal_actions_mask, so it can stand in for
+VecTrucoEnvironment when generating data or evaluating random and batched policies.
+
+Illegal actions are ignored, as TrucoGame does, without the warnings.
+
+    python batch_kernel.py --games 8192 --steps 500
+    python batch_kernel.py --check 2000
+
+times random-policy hands, and plays seeded random hands through both engines and compares every step.
+'''
+from timeit import default_timer as timer
+import numpy as np
+import argparse
+import logging
+import random
+
+from actions import game_actions, game_actions_index, card_action_offset
+from card import card_tier
+from card_game import first_won, second_won, tied, get_card_game_winner
+from encoder import (game_offset, score_offset, player_cards_offset, cards_played_offset, envido_calls_offset,
+                     envidos_offset, truco_calls_offset, state_space_dim, card_row_size, envido_row_size,
+                     truco_row_size)
+from envido import envido_machine, envido_table, max_envido_calls
+from truco import truco_machine, max_truco_calls
+
+action_space_dim = len(game_actions)
+fold_action = game_actions_index['fold']
+
+# Index in the wager machine of every game action, -1 for actions that are not calls of that wager
+envido_call_index = np.array([envido_machine.action_index.get(a, -1) for a in game_actions.tolist()], dtype=np.int8)
+truco_call_index = np.array([truco_machine.action_index.get(a, -1) for a in game_actions.tolist()], dtype=np.int8)
+envido_action_ids = np.array([game_actions_index[a] for a in envido_machine.actions])
+truco_action_ids = np.array([game_actions_index[a] for a in truco_machine.actions])
+
+envido_quiero = envido_machine.action_index['quiero']
+envido_no_quiero = envido_machine.action_index['no quiero']
+truco_quiero = truco_machine.action_index['quiero']
+truco_no_quiero = truco_machine.action_index['no quiero']
+vale_cuatro = truco_machine.action_index['vale cuatro']
+
+is_envido_call = np.isin(game_actions, ['envido', 'real envido'])
+is_truco_call = np.isin(game_actions, ['truco', 're-truco', 'vale cuatro'])
+is_response = np.isin(game_actions, ['quiero', 'no quiero'])
+is_card = np.arange(action_space_dim) >= card_action_offset
+
+# Card game winner by round results, coded first_won, second_won, tied or 3 for a round not played:
+# first_won, second_won, or -1 while undecided
+unplayed = 3
+card_game_winners = np.full((4, 4, 4), -1, dtype=np.int8)
+for code in np.ndindex(4, 4, 4):
+    results = tuple(code[:code.index(unplayed)] if unplayed in code else code)
+    winner = get_card_game_winner(results)
+    card_game_winners[code] = -1 if winner is None else winner
+
+
+class TrucoBatch:
+
+    def __init__(self, num_games, rng=None, encode=True):
+        '''
+        Args:
+            rng: numpy Generator that deals the cards and picks who goes first, seeded from random when not given
+            encode: return encoded game states from reset and step. Without them a step is several times
+                    faster, for random or scripted play
+        '''
+        self.num_games = num_games
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rng is None else rng
+        self.encode_states = encode
+        self.index = np.arange(num_games)
+
+        # Cards in hand by seat, -1 once played
+        self.hands = np.full((num_games, 2, 3), -1, dtype=np.int8)
+        self.envido_values = np.zeros((num_games, 2), dtype=np.int8)
+        self.scores = np.zeros((num_games, 2), dtype=np.int16)
+        self.finished = np.zeros(num_games, dtype=bool)
+        self.round = np.zeros(num_games, dtype=np.int8)
+        self.first_seat = np.zeros(num_games, dtype=np.int8)
+
+        self.card_next = np.zeros(num_games, dtype=np.int8)
+        self.played = np.zeros(num_games, dtype=np.int8)
+        self.played_ids = np.full((num_games, 6), -1, dtype=np.int8)
+        self.played_by = np.full((num_games, 6), -1, dtype=np.int8)
+
+        # Calls as seats and wager machine indices, the DFA state and the seat expected to answer (-1 for none)
+        self.envido_seats = np.full((num_games, max_envido_calls), -1, dtype=np.int8)
+        self.envido_calls = np.full((num_games, max_envido_calls), -1, dtype=np.int8)
+        self.envido_count = np.zeros(num_games, dtype=np.int8)
+        self.envido_state = np.zeros(num_games, dtype=np.int8)
+        self.envido_next = np.full(num_games, -1, dtype=np.int8)
+
+        self.truco_seats = np.full((num_games, max_truco_calls), -1, dtype=np.int8)
+        self.truco_calls = np.full((num_games, max_truco_calls), -1, dtype=np.int8)
+        self.truco_count = np.zeros(num_games, dtype=np.int8)
+        self.truco_state = np.zeros(num_games, dtype=np.int8)
+        self.truco_next = np.full(num_games, -1, dtype=np.int8)
+        self.has_retruco = np.full(num_games, -1, dtype=np.int8)
+
+        self.next_seats = np.zeros(num_games, dtype=np.int8)
+        self.legal_masks = np.zeros((num_games, action_space_dim), dtype=bool)
+        self.observations = np.zeros((num_games, state_space_dim), dtype=np.float32)
+
+    def reset(self, games=None, hands=None, first_seats=None):
+        '''
+        Deal new hands, see deal.
+        Returns:
+            next_seats (int8, num_games), legal_masks (bool, num_games x actions), observations (float32,
+            num_games x 339, None without encode)
+        '''
+        self.deal(games, hands, first_seats)
+        return self.get_outputs()
+
+    def deal(self, games=None, hands=None, first_seats=None):
+        '''
+        Args:
+            games: indices or bool mask of the hands to reset, every hand when None
+            hands: card ids (len(games), 2, 3) to deal instead of random ones
+            first_seats: seat that goes first in each hand instead of a random one
+        '''
+        games = self.index if games is None else np.asarray(games)
+        if games.dtype == bool:
+            games = np.flatnonzero(games)
+        count = len(games)
+
+        if hands is None:
+            hands = np.argsort(self.rng.random((count, 40), dtype=np.float32), axis=1)[:, :6].reshape(count, 2, 3)
+        if first_seats is None:
+            first_seats = self.rng.integers(2, size=count)
+
+        self.hands[games] = hands
+        self.envido_values[games] = envido_table[self.hands[games, :, 0], self.hands[games, :, 1], self.hands[games, :, 2]]
+        self.scores[games] = 0
+        self.finished[games] = False
+        self.round[games] = 0
+        self.first_seat[games] = first_seats
+        self.card_next[games] = first_seats
+        self.played[games] = 0
+        self.played_ids[games] = -1
+        self.played_by[games] = -1
+
+        self.envido_seats[games] = -1
+        self.envido_calls[games] = -1
+        self.envido_count[games] = 0
+        self.envido_state[games] = 0
+        self.envido_next[games] = -1
+        self.truco_seats[games] = -1
+        self.truco_calls[games] = -1
+        self.truco_count[games] = 0
+        self.truco_state[games] = 0
+        self.truco_next[games] = -1
+        self.has_retruco[games] = -1
+
+        self.update(games)
+
+    def get_outputs(self):
+        observations = self.observations.copy() if self.encode_states else None
+        return self.next_seats.copy(), self.legal_masks.copy(), observations
+
+    def get_last_calls(self, calls, count, games):
+        return np.where(count[games] > 0, calls[games, np.maximum(count[games] - 1, 0)], -1)
+
+    def is_envido_active(self, games):
+        last = self.get_last_calls(self.envido_calls, self.envido_count, games)
+        return (last >= 0) & (last != envido_quiero) & (last != envido_no_quiero)
+
+    def is_envido_finished(self, games):
+        last = self.get_last_calls(self.envido_calls, self.envido_count, games)
+        return (last == envido_quiero) | (last == envido_no_quiero)
+
+    def is_truco_active(self, games):
+        last = self.get_last_calls(self.truco_calls, self.truco_count, games)
+        return (last >= 0) & (last != truco_quiero) & (last != truco_no_quiero)
+
+    def get_leads(self, seats):
+        return self.scores[self.index, seats].astype(np.int32) - self.scores[self.index, 1 - seats]
+
+    def add_envido_calls(self, games, seats, calls):
+        count = self.envido_count[games]
+        self.envido_seats[games, count] = seats
+        self.envido_calls[games, count] = calls
+        self.envido_count[games] += 1
+        self.envido_state[games] = envido_machine.transitions[self.envido_state[games], calls]
+
+    def add_truco_calls(self, games, seats, calls):
+        count = self.truco_count[games]
+        self.truco_seats[games, count] = seats
+        self.truco_calls[games, count] = calls
+        self.truco_count[games] += 1
+        self.truco_state[games] = truco_machine.transitions[self.truco_state[games], calls]
+
+    def step(self, actions, auto_reset=True):
+        '''
+        Play actions[i], an index in game_actions, for the next seat of hand i.
+        Args:
+            auto_reset: deal a new hand wherever one finished, and return its first state as
+                        VecTrucoEnvironment does. Otherwise finished hands stay as they are until reset
+        Returns:
+            rewards (float32), dones (int8), next_seats (int8), legal_masks (bool), observations (float32)
+        '''
+        actions = np.asarray(actions, dtype=np.intp)
+        seats = self.next_seats.astype(np.intp)
+        opponents = 1 - seats
+        legal = self.legal_masks[self.index, actions] & ~self.finished
+        leads = self.get_leads(seats)
+
+        # Envido and real envido
+        games = np.flatnonzero(legal & is_envido_call[actions])
+        if len(games):
+            self.add_envido_calls(games, seats[games], envido_call_index[actions[games]])
+            self.envido_next[games] = opponents[games]
+
+        # Truco and its raises. An accepted truco can only be raised by the seat that accepted it
+        games = np.flatnonzero(legal & is_truco_call[actions])
+        if len(games):
+            self.add_truco_calls(games, seats[games], truco_call_index[actions[games]])
+            self.truco_next[games] = opponents[games]
+            self.has_retruco[games] = -1
+
+        responses = legal & is_response[actions]
+        if responses.any():
+            envido_active = self.is_envido_active(self.index)
+            games = np.flatnonzero(responses & envido_active)
+            if len(games):
+                self.answer_envido(games, seats[games], envido_call_index[actions[games]])
+            games = np.flatnonzero(responses & ~envido_active)
+            if len(games):
+                self.answer_truco(games, seats[games], truco_call_index[actions[games]])
+
+        games = np.flatnonzero(legal & (actions == fold_action))
+        if len(games):
+            self.fold(games, seats[games])
+
+        games = np.flatnonzero(legal & is_card[actions])
+        if len(games):
+            self.play_cards(games, seats[games], actions[games] - card_action_offset)
+
+        rewards = (self.get_leads(seats) - leads).astype(np.float32)
+        dones = self.finished.astype(np.int8)
+
+        if auto_reset and dones.any():
+            self.update(np.flatnonzero(dones == 0))
+            self.deal(np.flatnonzero(dones))
+        else:
+            self.update(self.index)
+        return (rewards, dones, *self.get_outputs())
+
+    def answer_envido(self, games, seats, calls):
+        self.add_envido_calls(games, seats, calls)
+        rewards = envido_machine.rewards[self.envido_state[games]]
+        first = self.first_seat[games]
+        values = self.envido_values[games]
+        # Envido goes to the seat that started the hand on a tie
+        winners = np.where(values[np.arange(len(games)), first] >= values[np.arange(len(games)), 1 - first], first, 1 - first)
+        winners = np.where(calls == envido_no_quiero, 1 - seats, winners)
+        self.scores[games, winners] += rewards
+        self.envido_next[games] = -1
+
+    def answer_truco(self, games, seats, calls):
+        self.add_truco_calls(games, seats, calls)
+        declined = calls == truco_no_quiero
+        rejected = games[declined]
+        self.scores[rejected, 1 - seats[declined]] += truco_machine.rewards[self.truco_state[rejected]]
+        self.finished[rejected] = True
+
+        accepted = games[~declined]
+        truco_calls = self.truco_calls[accepted]
+        # Whoever accepts can raise later, unless truco was already raised after being accepted
+        can_raise = ((self.has_retruco[accepted] == -1) & ((truco_calls == truco_quiero).sum(axis=1) < 2)
+                     & ((truco_calls == vale_cuatro).sum(axis=1) == 0))
+        self.has_retruco[accepted] = np.where(can_raise, seats[~declined], -1)
+        self.truco_next[accepted] = -1
+
+    def fold(self, games, seats):
+        opponents = 1 - seats
+        envido_active = self.is_envido_active(games)
+        folded = games[envido_active]
+        if len(folded):
+            self.add_envido_calls(folded, seats[envido_active], np.full(len(folded), envido_no_quiero))
+            self.scores[folded, opponents[envido_active]] += envido_machine.rewards[self.envido_state[folded]]
+
+        truco_active = self.is_truco_active(games)
+        folded = games[truco_active]
+        if len(folded):
+            self.add_truco_calls(folded, seats[truco_active], np.full(len(folded), truco_no_quiero))
+        started = self.truco_count[games] > 0
+        points = np.where(started, truco_machine.rewards[self.truco_state[games]], 1)
+        self.scores[games, opponents] += points
+        self.finished[games] = True
+
+    def play_cards(self, games, seats, cards):
+        hands = self.hands[games, seats]
+        hands[hands == cards[:, None]] = -1
+        self.hands[games, seats] = hands
+        count = self.played[games]
+        self.played_ids[games, count] = cards
+        self.played_by[games, count] = seats
+        self.played[games] += 1
+
+        # The first card of a round passes the turn, the second ends the round
+        leading = count % 2 == 0
+        self.card_next[games[leading]] = 1 - seats[leading]
+        games, seats, count = games[~leading], seats[~leading], count[~leading]
+        if len(games) == 0:
+            return
+
+        self.round[games] += 1
+        lead_tiers = card_tier[self.played_ids[games, count - 1]]
+        tiers = card_tier[self.played_ids[games, count]]
+        # The leader keeps the lead unless the second card beats it
+        self.card_next[games] = np.where(lead_tiers >= tiers, 1 - seats, seats)
+
+        codes = np.full((len(games), 3), unplayed, dtype=np.intp)
+        first = self.first_seat[games]
+        for r in range(3):
+            played = count >= 2 * r + 1
+            ids = self.played_ids[games, 2 * r:2 * r + 2]
+            by = self.played_by[games, 2 * r:2 * r + 2]
+            first_tiers = card_tier[np.where(by[:, 0] == first, ids[:, 0], ids[:, 1])]
+            second_tiers = card_tier[np.where(by[:, 0] == first, ids[:, 1], ids[:, 0])]
+            results = np.where(first_tiers > second_tiers, first_won, np.where(first_tiers < second_tiers, second_won, tied))
+            codes[:, r] = np.where(played, results, unplayed)
+        winners = card_game_winners[codes[:, 0], codes[:, 1], codes[:, 2]]
+
+        decided = winners >= 0
+        games, first, winners = games[decided], first[decided], winners[decided]
+        winning_seats = np.where(winners == first_won, first, 1 - first)
+        points = np.where(self.truco_count[games] > 0, truco_machine.rewards[self.truco_state[games]], 1)
+        self.scores[games, winning_seats] += points
+        self.finished[games] = True
+
+    def update(self, games):
+        ''' Next seats, legal masks and, with encode, the encoded states of games.
+        '''
+        envido_next = self.envido_next[games]
+        truco_next = self.truco_next[games]
+        seats = np.where(envido_next >= 0, envido_next, np.where(truco_next >= 0, truco_next, self.card_next[games]))
+        self.next_seats[games] = seats
+        self.legal_masks[games] = self.get_legal_masks(games, seats)
+        if self.encode_states:
+            self.observations[games] = self.encode(games, seats)
+
+    def get_legal_masks(self, games, seats):
+        ''' Legal actions of seats as bool masks aligned with game_actions, as TrucoGame.get_legal_actions_mask.
+        '''
+        masks = np.zeros((len(games), action_space_dim), dtype=bool)
+        masks[:, fold_action] = True
+        envido_active = self.is_envido_active(games)
+        truco_active = self.is_truco_active(games) & ~envido_active
+        idle = ~envido_active & ~truco_active
+
+        rows = np.flatnonzero(envido_active)
+        masks[rows[:, None], envido_action_ids] = envido_machine.legal_mask[self.envido_state[games[rows]]]
+        rows = np.flatnonzero(truco_active)
+        masks[rows[:, None], truco_action_ids] = truco_machine.legal_mask[self.truco_state[games[rows]]]
+
+        # Envido before the first round ends and before truco is called
+        rows = np.flatnonzero(idle & (self.round[games] == 0) & (self.truco_count[games] == 0) & (self.envido_count[games] == 0))
+        masks[rows[:, None], envido_action_ids] = envido_machine.legal_mask[0]
+
+        truco_count = self.truco_count[games]
+        can_raise = idle & (self.has_retruco[games] == seats)
+        rows = np.flatnonzero(can_raise)
+        masks[rows[:, None], truco_action_ids] = truco_machine.legal_mask[self.truco_state[games[rows]]]
+        rows = np.flatnonzero(idle & ~can_raise & (truco_count == 0))
+        masks[rows[:, None], truco_action_ids] = truco_machine.legal_mask[0]
+
+        rows = np.flatnonzero(idle & (self.card_next[games] == seats))
+        hands = self.hands[games[rows], seats[rows]].astype(np.intp)
+        held = hands >= 0
+        masks[np.repeat(rows, 3)[held.reshape(-1)], card_action_offset + hands[held]] = True
+        return masks
+
+    def encode(self, games, seats):
+        ''' Encoded game states of seats, as environment.encode_game_state.
+        '''
+        count = len(games)
+        rows = np.arange(count)
+        seats = seats.astype(np.intp)
+        states = np.zeros((count, state_space_dim), dtype=np.float32)
+        states[:, game_offset] = seats == self.first_seat[games]
+        states[:, game_offset + 1] = True
+        states[rows, score_offset + 2 * seats] = 1
+        states[:, score_offset + 1] = self.scores[games, 0]
+        states[:, score_offset + 3] = self.scores[games, 1]
+
+        hands = self.hands[games, seats].astype(np.intp)
+        held = hands >= 0
+        states[np.repeat(rows, 3)[held.reshape(-1)], player_cards_offset + hands[held]] = 1
+
+        played_ids = self.played_ids[games].astype(np.intp)
+        played_by = self.played_by[games]
+        for i in range(6):
+            row = cards_played_offset + i * card_row_size
+            played = np.flatnonzero(played_ids[:, i] >= 0)
+            states[played, row] = played_by[played, i] == seats[played]
+            states[played, row + 1 + played_ids[played, i]] = 1
+
+        calls = self.envido_calls[games].astype(np.intp)
+        callers = self.envido_seats[games]
+        for i in range(max_envido_calls):
+            row = envido_calls_offset + i * envido_row_size
+            called = np.flatnonzero(calls[:, i] >= 0)
+            states[called, row] = callers[called, i] == seats[called]
+            states[called, row + 1 + calls[called, i]] = 1
+
+        values = self.envido_values[games]
+        states[:, envidos_offset] = values[rows, seats]
+        states[:, envidos_offset + 1] = np.where(self.is_envido_finished(games), values[rows, 1 - seats], -1)
+
+        calls = self.truco_calls[games].astype(np.intp)
+        callers = self.truco_seats[games]
+        for i in range(max_truco_calls):
+            row = truco_calls_offset + i * truco_row_size
+            called = np.flatnonzero(calls[:, i] >= 0)
+            states[called, row] = callers[called, i] == seats[called]
+            states[called, row + 1 + calls[called, i]] = 1
+        return states
+
+
+def sample_actions(legal_masks, rng):
+    ''' A uniformly random legal action per row.
+    '''
+    return np.argmax(rng.random(legal_masks.shape) * legal_masks, axis=1)
+
+
+def check_parity(num_games=256, steps=2000, seed=0):
+    ''' Play the same random hands with TrucoEnvironment and TrucoBatch, dealing the environment's cards to
+    the batch, and compare legal masks, rewards, dones, next seats and encoded game states at every step.
+    Returns:
+        number of steps compared and number of mismatches of each output
+    '''
+    from environment import TrucoEnvironment
+    from player import Player
+
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    envs = [TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True) for _ in range(num_games)]
+    batch = TrucoBatch(num_games, rng=np.random.default_rng(seed))
+    mismatches = {'next_seats': 0, 'legal_masks': 0, 'observations': 0, 'rewards': 0, 'dones': 0}
+
+    def deal(games):
+        expected = []
+        for i in games:
+            player, legal_mask, game_state = envs[i].reset()
+            expected.append((envs[i].game.get_seat(player), legal_mask, game_state))
+        hands = [[p.get_hand_ids().tolist() for p in envs[i].game.players] for i in games]
+        first_seats = [envs[i].game.first_seat for i in games]
+        batch.reset(games, hands=np.array(hands), first_seats=first_seats)
+        return expected
+
+    def compare(games, expected):
+        for i, (seat, legal_mask, game_state) in zip(games, expected):
+            mismatches['next_seats'] += int(seat != batch.next_seats[i])
+            mismatches['legal_masks'] += int(not np.array_equal(legal_mask, batch.legal_masks[i]))
+            mismatches['observations'] += int(not np.array_equal(game_state, batch.observations[i]))
+
+    games = np.arange(num_games)
+    compare(games, deal(games))
+    for _ in range(steps):
+        actions = sample_actions(batch.legal_masks, rng)
+        players = [env.game.players[s] for env, s in zip(envs, batch.next_seats)]
+        rewards, dones, next_seats, legal_masks, observations = batch.step(actions, auto_reset=False)
+
+        expected = []
+        for i, (env, player, action) in enumerate(zip(envs, players, actions)):
+            reward, done, next_player, legal_mask, game_state = env.step(player, int(action))
+            mismatches['rewards'] += int(reward != rewards[i])
+            mismatches['dones'] += int(done != dones[i])
+            expected.append((env.game.get_seat(next_player), legal_mask, game_state))
+        compare(games, expected)
+
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            compare(finished, deal(finished))
+    return steps * num_games, mismatches
+
+
+def time_random_hands(num_games, steps, encode, seed=0):
+    ''' Hands and decisions per second of TrucoBatch with a random policy.
+    '''
+    rng = np.random.default_rng(seed)
+    batch = TrucoBatch(num_games, rng=rng, encode=encode)
+    next_seats, legal_masks, observations = batch.reset()
+    hands = 0
+    start = timer()
+    for _ in range(steps):
+        rewards, dones, next_seats, legal_masks, observations = batch.step(sample_actions(legal_masks, rng))
+        hands += int(dones.sum())
+    elapsed = timer() - start
+    return hands / elapsed, num_games * steps / elapsed
+
+
+def time_environment_hands(steps, seed=0):
+    ''' Hands and decisions per second of one TrucoEnvironment with a random policy, for reference.
+    '''
+    from environment import TrucoEnvironment
+    from player import Player
+
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+    player, legal_mask, game_state = env.reset()
+    hands = 0
+    start = timer()
+    for _ in range(steps):
+        reward, done, player, legal_mask, game_state = env.step(player, int(sample_actions(legal_mask[None], rng)[0]))
+        if done:
+            hands += 1
+            player, legal_mask, game_state = env.reset()
+    elapsed = timer() - start
+    return hands / elapsed, steps / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the batched engine, or check it against TrucoGame.")
+    parser.add_argument('--games', type=int, default=8192, help="Hands played at once.")
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--check', type=int, metavar='STEPS', help="Compare this many steps of 256 hands with TrucoEnvironment.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.check:
+        compared, mismatches = check_parity(steps=args.check, seed=args.seed)
+        print(f"{compared} steps compared: " + ', '.join(f"{k} {v}" for k, v in mismatches.items()))
+        raise SystemExit(1 if any(mismatches.values()) else 0)
+
+    hands, decisions = time_environment_hands(20000, args.seed)
+    print(f"TrucoEnvironment:           {hands:>12.0f} hands/s {decisions:>12.0f} decisions/s")
+    for encode in (False, True):
+        hands, decisions = time_random_hands(args.games, args.steps, encode, args.seed)
+        print(f"TrucoBatch ({'encoded' if encode else 'no states'}): {hands:>12.0f} hands/s {decisions:>12.0f} decisions/s")
@@ -0,0 +1,341 @@
+'''
+Micro-benchmarks for the engine, the encoder, the agents and the training step.
+
+Every benchmark runs on fixed seeds and reports the median time per call over several repeats.
+
+    python benchmarks.py --output results.json
+    python benchmarks.py --baseline benchmark_baseline.json --save-baseline
+    python benchmarks.py --baseline benchmark_baseline.json --threshold 0.1
+
+With --baseline, results are compared against the stored ones and the exit status is 1 when any
+benchmark got slower by more than threshold (a fraction of the baseline time).
+'''
+from timeit import default_timer as timer
+from pathlib import Path
+import multiprocessing as mp
+import numpy as np
+import torch as T
+import argparse
+import datetime
+import platform
+import logging
+import random
+import json
+import sys
+
+from actions import game_actions, card_action_offset
+from agent import Agent
+from batch_kernel import TrucoBatch, sample_actions
+from card import Card, card_names
+from dealer import Dealer
+from environment import TrucoEnvironment, encode_game_state
+from envido import calculate_envido
+from player import Player
+
+benchmarks = {}
+
+
+def benchmark(name):
+    ''' Register a benchmark. The decorated function sets it up and returns the callable to time.
+    '''
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    T.manual_seed(seed)
+
+
+def measure(run, number, repeat):
+    ''' Seconds per call of run: median and minimum over repeat batches of number calls.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(number):
+            run()
+        times.append((timer() - start) / number)
+    return float(np.median(times)), float(np.min(times))
+
+
+def random_legal_action(legal_mask):
+    return random.choice(np.flatnonzero(legal_mask))
+
+
+def sample_games(count, max_steps, card_actions_only=False):
+    ''' Games advanced a random number of random legal steps, each in its own environment.
+    '''
+    games = []
+    card_mask = np.arange(len(game_actions)) >= card_action_offset
+    while len(games) < count:
+        env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+        player, legal_mask, game_state = env.reset()
+        for _ in range(random.randrange(max_steps + 1)):
+            if card_actions_only:
+                legal_mask = legal_mask & card_mask
+            reward, done, player, legal_mask, game_state = env.step(player, random_legal_action(legal_mask))
+            if done:
+                break
+        games.append((env.game, env.game.get_mano()))
+    return games
+
+
+def sample_transitions(count):
+    env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+    player, legal_mask, game_state = env.reset()
+    transitions = []
+    while len(transitions) < count:
+        action = random_legal_action(legal_mask)
+        reward, done, player, legal_mask, new_game_state = env.step(player, action)
+        transitions.append((game_state, action, reward, done, new_game_state, legal_mask))
+        game_state = new_game_state
+        if done:
+            player, legal_mask, game_state = env.reset()
+    return transitions
+
+
+def build_agent(batch_size=32, min_replay_size=1000):
+    return Agent(
+        Player('benchmark'),
+        device=T.device('cpu'),
+        state_space_dim=339,
+        action_space_dim=len(game_actions),
+        batch_size=batch_size,
+        min_replay_size=min_replay_size,
+        replay_buffer_size=max(10000, min_replay_size),
+        # Always take the greedy action, so every call runs the network
+        epsilon_start=0.0,
+        epsilon_end=0.0
+    )
+
+
+def cycle(items):
+    ''' Endless iterator over items, for benchmarks that need a different input per call.
+    '''
+    i = 0
+    while True:
+        yield items[i]
+        i = (i + 1) % len(items)
+
+
+@benchmark('card_construction')
+def card_construction():
+    names = [(n[0], n[1:]) for n in card_names]
+    return lambda: [Card(suit, rank) for suit, rank in names]
+
+
+@benchmark('dealer_construction')
+def dealer_construction():
+    players = [Player(0), Player(1)]
+
+    def run():
+        for player in players:
+            player.clear_hand()
+        Dealer().deal_cards_in_order(players)
+    return run
+
+
+@benchmark('env_reset')
+def env_reset():
+    env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+    return env.reset
+
+
+@benchmark('env_step')
+def env_step():
+    ''' One random legal step, resetting finished games.
+    '''
+    env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+    state = list(env.reset()[:2])
+
+    def run():
+        player, legal_mask = state
+        reward, done, player, legal_mask, game_state = env.step(player, random_legal_action(legal_mask))
+        state[:] = env.reset()[:2] if done else (player, legal_mask)
+    return run
+
+
+@benchmark('batch_kernel_step_4096')
+def batch_kernel_step():
+    ''' One random legal step of 4096 hands in TrucoBatch, with encoded game states.
+    '''
+    rng = np.random.default_rng(0)
+    batch = TrucoBatch(4096, rng=rng)
+    legal_masks = [batch.reset()[1]]
+
+    def run():
+        legal_masks[0] = batch.step(sample_actions(legal_masks[0], rng))[3]
+    return run
+
+
+@benchmark('encode_game_state')
+def encode_state():
+    games = cycle(sample_games(200, 8))
+
+    def run():
+        game, player = next(games)
+        encode_game_state(player, game)
+    return run
+
+
+@benchmark('get_legal_actions')
+def legal_actions():
+    games = cycle(sample_games(200, 8))
+
+    def run():
+        game, player = next(games)
+        game.get_legal_actions(player)
+    return run
+
+
+@benchmark('get_legal_actions_mask')
+def legal_actions_mask():
+    games = cycle(sample_games(200, 8))
+
+    def run():
+        game, player = next(games)
+        game.get_legal_actions_mask(player)
+    return run
+
+
+@benchmark('calculate_envido')
+def envido():
+    hands = cycle([[Card(n[0], n[1:]) for n in random.sample(card_names, 3)] for _ in range(500)])
+    return lambda: calculate_envido(next(hands))
+
+
+@benchmark('card_game_get_winner')
+def card_game_winner():
+    card_games = [game.card_game for game, player in sample_games(2000, 6, card_actions_only=True)]
+    card_games = cycle([g for g in card_games if len(g.played_by) >= 4])
+    return lambda: next(card_games).get_winner()
+
+
+@benchmark('agent_choose_action')
+def agent_choose_action():
+    agent = build_agent()
+    inputs = cycle([(list(game_actions[mask]), state) for state, action, reward, done, new_state, mask in sample_transitions(200)])
+
+    def run():
+        legal_actions, game_state = next(inputs)
+        agent.choose_action(legal_actions, game_state)
+    return run
+
+
+def agent_choose_actions(batch_size):
+    def setup():
+        agent = build_agent()
+        transitions = sample_transitions(batch_size)
+        game_states = np.stack([t[0] for t in transitions])
+        legal_masks = np.stack([t[5] for t in transitions])
+        return lambda: agent.choose_actions(legal_masks, game_states)
+    return setup
+
+
+def agent_learn(batch_size):
+    def setup():
+        agent = build_agent(batch_size=batch_size, min_replay_size=batch_size)
+        for transition in sample_transitions(2000):
+            agent.save_transition(transition)
+        return agent.learn
+    return setup
+
+
+for size in (32, 128, 512):
+    benchmark(f'agent_choose_actions_{size}')(agent_choose_actions(size))
+    benchmark(f'agent_learn_{size}')(agent_learn(size))
+
+
+def run_benchmarks(names, seed=0, min_time=0.2, repeat=5):
+    ''' Time each benchmark, calibrating the number of calls per repeat to last about min_time seconds.
+    Returns:
+        {name: {'median_us', 'min_us', 'calls'}}
+    '''
+    results = {}
+    for name in names:
+        seed_everything(seed)
+        run = benchmarks[name]()
+
+        # Warm up, then calibrate
+        start = timer()
+        run()
+        number = max(1, int(min_time / max(timer() - start, 1e-7)))
+        number = max(1, int(min_time / max(measure(run, number, 1)[0], 1e-9)))
+
+        median, minimum = measure(run, number, repeat)
+        results[name] = {'median_us': median * 1e6, 'min_us': minimum * 1e6, 'calls': number * repeat}
+        print(f"{name:<28} {median * 1e6:>12.2f}us {minimum * 1e6:>12.2f}us (min) {number * repeat:>9} calls")
+    return results
+
+
+def compare(results, baseline, threshold):
+    ''' Print the change of each benchmark against baseline.
+    Returns:
+        names of benchmarks slower than (1 + threshold) times their baseline
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result['median_us'] / baseline[name]['median_us'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print(f"{name:<28} {baseline[name]['median_us']:>12.2f}us -> {result['median_us']:>12.2f}us {change:>+8.1%}{flag}")
+    return regressions
+
+
+def get_metadata(seed):
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'torch': T.__version__,
+        'platform': platform.platform(),
+        'cpus': mp.cpu_count(),
+        'torch_threads': T.get_num_threads(),
+        'seed': seed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the engine, encoder, agents and training step.")
+    parser.add_argument('names', nargs='*', help="Benchmarks to run, all by default. Substrings match.")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds per repeat.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Write the results as JSON.")
+    parser.add_argument('--baseline', help="JSON results to compare against.")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results to --baseline instead of comparing.")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Slowdown, as a fraction of the baseline, that counts as a regression.")
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(benchmarks))
+        sys.exit(0)
+
+    names = [n for n in benchmarks if not args.names or any(s in n for s in args.names)]
+    if not names:
+        parser.error(f"No benchmark matches {args.names}.")
+
+    logging.basicConfig(level=logging.WARNING)
+    report = {'metadata': get_metadata(args.seed), 'results': run_benchmarks(names, args.seed, args.min_time, args.repeat)}
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline and args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2))
+    elif args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        print()
+        regressions = compare(report['results'], baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
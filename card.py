@@ -1,3 +1,5 @@
+import numpy as np
+
 card_tiers = [
         (['E1'], 13),
         (['B1'], 12),
@@ -18,6 +20,27 @@ card_tiers = [
 valid_suit = ['C', 'B', 'E', 'O']
 valid_rank = ['1', '2', '3', '4', '5', '6', '7', '10', '11', '12']
 
+card_names = [suit + rank for suit in valid_suit for rank in valid_rank]
+
+# Cards are identified by their position in card_names (0..39), the order of init_truco_deck
+card_ids = {name: i for i, name in enumerate(card_names)}
+
+def rank_to_envido_value(rank):
+    if rank in ['10', '11', '12']:
+        return 10
+    else:
+        return int(rank)
+
+# Lookup tables indexed by card id
+card_tier = np.zeros(len(card_names), dtype=np.int8)
+for cards, tier in card_tiers:
+    for name in cards:
+        card_tier[card_ids[name]] = tier
+
+card_suit = np.array([valid_suit.index(suit) for suit in valid_suit for rank in valid_rank], dtype=np.int8)
+card_rank = np.array([valid_rank.index(rank) for suit in valid_suit for rank in valid_rank], dtype=np.int8)
+card_envido_value = np.array([rank_to_envido_value(rank) for suit in valid_suit for rank in valid_rank], dtype=np.int8)
+
 ''' Game-related base classes
 '''
 class Card:
@@ -26,50 +49,59 @@ class Card:
     Note:
         The suit variable in a standard card game should be one of [C, B, E, O] meaning [Copa, Basto, Espada, Oro]
         Similarly the rank variable should be one of ['1', '2', '3', '4', '5', '6', '7', '10', '11', '12']
+
+        There is exactly one Card object per card of the deck (see card_table), so Card(suit, rank) is a
+        table lookup and cards can be compared by identity. The engine works with card ids internally.
     '''
-    suit = None
-    rank = None
-    
+    __slots__ = ('suit', 'rank', 'tier', 'id')
 
-    def __init__(self, suit, rank):
-        ''' Initialize the suit and rank of a card
+    def __new__(cls, suit, rank):
+        ''' Get the card with the given suit and rank
         Args:
             suit: string, suit of the card, should be one of valid_suit
             rank: string, rank of the card, should be one of valid_rank
         '''
-        self.suit = suit
-        self.rank = rank
-        for cards, tier in card_tiers:
-            if suit+rank in cards:
-                self.tier = tier
-                break
-        
+        return card_table[card_ids[suit + rank]]
+
+    @classmethod
+    def _create(cls, card_id):
+        card = object.__new__(cls)
+        card.id = card_id
+        card.suit = card_names[card_id][0]
+        card.rank = card_names[card_id][1:]
+        card.tier = int(card_tier[card_id])
+        return card
+
+    def __reduce__(self):
+        # Unpickling and copying return the shared instance
+        return (Card, (self.suit, self.rank))
 
     def __eq__(self, other):
         if isinstance(other, Card):
-            return self.rank == other.rank and self.suit == other.suit
+            return self.id == other.id
         else:
             # don't attempt to compare against unrelated types
             return NotImplemented
 
     def __hash__(self):
-        suit_index = Card.valid_suit.index(self.suit)
-        rank_index = Card.valid_rank.index(self.rank)
-        return rank_index + 100 * suit_index
+        return self.id
 
     def __str__(self):
         ''' Get string representation of a card.
         Returns:
             string: the combination of rank and suit of a card. Eg: AS, 5H, JD, 3C, ...
         '''
-        return self.get_index()
+        return card_names[self.id]
     
     def compare_as_str(self, card_as_string):
-        return card_as_string == self.__str__()
+        return card_as_string == card_names[self.id]
     
     def get_index(self):
         ''' Get index of a card.
         Returns:
             string: the combination of suit and rank of a card. Eg: 1S, 2H, AD, BJ, RJ...
         '''
-        return self.suit+self.rank
\ No newline at end of file
+        return card_names[self.id]
+
+
+card_table = tuple(Card._create(card_id) for card_id in range(len(card_names)))
@@ -1,9 +1,9 @@
-from more_itertools import locate
 import numpy as np
 import logging
 from collections import Counter
 
-from card_utils import encode_card_array
+from card import card_table, card_tier, card_ids, card_names
+from events import CardPlayed
 
 card_game_tie_states = [
     (['tie', 'tie', 'tie'], 'p0'),
@@ -17,88 +17,139 @@ card_game_tie_states = [
     (['p1', 'p0', 'tie'], 'p1'),
 ]
 
+# Round results relative to the seat that started the hand, for code that works on results directly
+first_won, second_won, tied = 0, 1, 2
+result_codes = {'p0': first_won, 'p1': second_won, 'tie': tied}
+tie_winners = {tuple(result_codes[r] for r in results): result_codes[winner] for results, winner in card_game_tie_states}
+
+def get_card_game_winner(results):
+    ''' first_won or second_won once the card game is decided, None before, as CardGame.get_winner.
+    Args:
+        results: tuple of round results
+    '''
+    if len(results) < 2:
+        return None
+    if results in tie_winners:
+        return tie_winners[results]
+    if results.count(first_won) >= 2:
+        return first_won
+    if results.count(second_won) >= 2:
+        return second_won
+    return None
+
+# Size of CardGame.snapshot: finished, next seat, number of cards played, then the ids and seats of the
+# cards played
+card_game_record_size = 3 + 6 + 6
+
 class CardGame:
+    '''
+    Cards played over the rounds of a hand. Players are referred to by seat, their index in game.players.
+    '''
 
     def __init__(self, game, goes_first):
         '''
         Initialize Card Game.
         '''
         self.game = game
+        # Ids of the cards played in order, and the seats that played them
+        self.played_ids = np.full(6, -1, dtype=np.int8)
+        self.played_by = []
+        self.reset(goes_first)
+
+    def reset(self, goes_first):
         self.finished = False
+        # Seat that plays the next card
         self.card_next = goes_first
-        self.cards_played = []
-        
-    def get_state(self, player):
-        state = []
-        for p, c in self.cards_played:
-            p_id = 1 if player == p else 0
-            turn = [p_id, *encode_card_array(c)]
-            state.append(np.array(turn, dtype=np.int8))
-        
-        # Add padding for 6 turns
-        for i in range(6 - len(state)):
-            state.append(np.zeros(1 + 40, dtype=np.int8))
-            
-        state = np.vstack(state)
+        self.played_ids.fill(-1)
+        self.played_by.clear()
+
+    def snapshot(self):
+        ''' State as card_game_record_size ints, see restore.
+        '''
+        played_by = self.played_by + [-1] * (6 - len(self.played_by))
+        return [int(self.finished), self.card_next, len(self.played_by)] + self.played_ids.tolist() + played_by
+
+    def restore(self, record):
+        self.finished = bool(record[0])
+        self.card_next = record[1]
+        self.played_ids[:] = record[3:9]
+        self.played_by[:] = record[9:9 + record[2]]
+
+    @property
+    def cards_played(self):
+        return [(self.game.players[s], card_table[c]) for s, c in zip(self.played_by, self.played_ids)]
+
+    def get_state(self, seat):
+        state = np.zeros((6, 1 + 40), dtype=np.int8)
+        for i, s in enumerate(self.played_by):
+            state[i, 0] = 1 if seat == s else 0
+            state[i, 1 + self.played_ids[i]] = 1
             
         return state
     
-    def get_legal_actions(self, player):
-        if self.card_next == player:
-            return [card.get_index() for card in player.hand]
+    def get_legal_actions(self, seat):
+        if self.card_next == seat:
+            return [card_names[c] for c in self.game.players[seat].get_hand_ids().tolist()]
         return []
 
+    def get_player_card_ids(self, seat):
+        return [c for s, c in zip(self.played_by, self.played_ids) if s == seat]
+
     def get_winner(self):
-        p0_cards = [card for player, card in self.cards_played if player == self.game.first_move_by]
-        p1_cards = [card for player, card in self.cards_played if player == self.game.second_move_by]
-        
+        ''' Seat that won the card game, None while undecided.
+        '''
         # Minimum 4 cards must be played to have a winner
-        if len(p0_cards) + len(p1_cards) < 4:
+        if len(self.played_by) < 4:
             return None
+
+        first_seat = self.game.first_seat
+        p0_tiers = card_tier[self.get_player_card_ids(first_seat)]
+        p1_tiers = card_tier[self.get_player_card_ids(1 - first_seat)]
         
         results = []
-        for c1, c2 in zip(p0_cards, p1_cards):
-            comparison = c1.tier - c2.tier
-            if comparison > 0:
+        for t1, t2 in zip(p0_tiers, p1_tiers):
+            if t1 > t2:
                 results.append('p0')
-            elif comparison < 0:
+            elif t1 < t2:
                 results.append('p1')
-            elif comparison == 0:
+            else:
                 results.append('tie')
                     
         
         for tie_state, winner in card_game_tie_states:
             if results == tie_state:
-                return self.game.first_move_by if winner == 'p0' else self.game.second_move_by
+                return first_seat if winner == 'p0' else 1 - first_seat
             
         counts = Counter(results)
          
         if counts['p0'] >= 2:
-            return self.game.first_move_by
+            return first_seat
         elif counts['p1'] >= 2:
-            return self.game.second_move_by
+            return 1 - first_seat
         else:
             return None
 
     
     def switch_turn(self):
-        self.card_next = self.game.get_opponent(self.card_next)
+        self.card_next = 1 - self.card_next
 
-    def take_action(self, player, action_played):
-        if self.card_next != player:
-            logging.warning(f"{player} can't play a card out of turn.")
+    def take_action(self, seat, action_played):
+        player = self.game.players[seat]
+        if self.card_next != seat:
+            logging.warning("%s can't play a card out of turn.", player)
             return
 
-        card_played_indexes = list(locate(player.hand, lambda c: c.compare_as_str(action_played)))
-        if len(card_played_indexes) == 1:
-            card_played = player.hand.pop(card_played_indexes[0])
-            self.cards_played.append((player, card_played))
-            logging.info(f"{player} played {card_played}")
-            if len(self.cards_played) % 2 == 0:
+        card_id = card_ids.get(action_played)
+        if card_id is not None and player.remove_card(card_id):
+            self.played_ids[len(self.played_by)] = card_id
+            self.played_by.append(seat)
+            if self.game.events.active:
+                self.game.events.emit(CardPlayed(player, card_id))
+            if len(self.played_by) % 2 == 0:
                 self.game.finish_round()
             else:
                 self.switch_turn()
         elif len(card_played_indexes) > 1:
-            logging.critical(f"{player}: card_played_indexes should never be > 1. Current value: {card_played_indexes}")
+            logging.critical("%s: card_played_indexes should never be > 1. Current value: %s", player, card_played_indexes)
         else:
-            logging.warning(f"{player} can't play the card {action_played}. They don't have it.")
\ No newline at end of file
+            logging.warning("%s can't play the card %s. They don't have it.", player, action_played)
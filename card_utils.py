@@ -1,9 +1,8 @@
-from card import Card
-from deck import init_truco_deck
-from actions import envido_actions, response_actions, truco_actions
+from card import card_names
+from actions import envido_actions, response_actions, truco_actions, game_actions_index
 import numpy as np
 
-default_deck = np.array([card.get_index() for card in init_truco_deck()])
+default_deck = np.array(card_names)
 
 envido_actions = np.concatenate((envido_actions, response_actions))
 
@@ -13,8 +12,13 @@ truco_actions = np.concatenate((truco_actions, response_actions))
 def encode_card_array(cards):
     if not isinstance(cards, list):
         cards = [cards]
-    cards = [str(c) for c in cards]
-    return  [1 if card in cards else 0 for card in default_deck]
+    return encode_card_ids([c.id for c in cards])
+
+
+def encode_card_ids(card_ids):
+    encoded = np.zeros(len(card_names), dtype=np.int8)
+    encoded[card_ids] = 1
+    return encoded
 
     
 def encode_envido(action):
@@ -22,4 +26,10 @@ def encode_envido(action):
 
 def encode_truco(action):
     return [1 if a == action else 0 for a in truco_actions]
-    
\ No newline at end of file
+
+
+def encode_legal_actions(legal_actions):
+    mask = np.zeros(len(game_actions_index), dtype=bool)
+    for action in legal_actions:
+        mask[game_actions_index[action]] = True
+    return mask
@@ -1,18 +1,45 @@
-from deck import init_truco_deck, shuffle_cards
+from card import card_table
+import numpy as np
+import random
 
 class Dealer:
     
-    def __init__(self):
+    def __init__(self, rng=None):
         '''
         Initialize a dealer.
+        Args:
+            rng: numpy Generator used to shuffle, seeded from random when not given
         '''
-        self.deck = init_truco_deck()
-        shuffle_cards(self.deck, True)
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rng is None else rng
+        # The deck is a permutation of card ids, dealt from the end
+        self.order = np.arange(len(card_table), dtype=np.int8)
+        self.shuffle()
+
+    @property
+    def deck(self):
+        ''' Cards not dealt yet, the next one last.
+        '''
+        return [card_table[i] for i in self.order[:self.position]]
+
+    def shuffle(self):
+        ''' Put every card back in the deck and shuffle it, in place.
+        '''
+        self.rng.shuffle(self.order)
+        self.position = len(self.order)
+
+    def set_order(self, order):
+        ''' Put every card back in the deck in a given order instead of shuffling, e.g. a deal from deals.py.
+        Args:
+            order: permutation of the card ids, dealt from the end
+        '''
+        self.order[:] = order
+        self.position = len(self.order)
         
     def deal_cards_in_order(self, players, amount=3):
-        player_index = 0
-        for _ in range(amount * len(players)):
-            if player_index == len(players):
-                player_index = 0
-            players[player_index].hand.append(self.deck.pop())
-            player_index+=1
+        ''' Deal amount cards to each player, one at a time from the end of the deck, in turn.
+        '''
+        start = self.position - amount * len(players)
+        dealt = self.order[start:self.position][::-1]
+        self.position = start
+        for i, player in enumerate(players):
+            player.add_cards(dealt[i::len(players)])
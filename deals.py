@@ -0,0 +1,72 @@
+'''
+Pregenerated deals, for duplicate evaluation.
+
+A deal file is a .npy structured array with one row per deal: the shuffled deck, a permutation of the 40
+card ids dealt from the end as Dealer does, and the seat that goes first. It takes 41 bytes per deal and
+is meant to be memory mapped, so every worker reads the same deals without copying them.
+
+TrucoEnvironment(..., deals=deals) replays the deals in order instead of shuffling. Playing every deal
+twice, with the agents in swapped seats, gives each agent the same cards and the same turn to start, so
+the luck of the deal cancels out of their difference (duplicate Truco), and a comparison needs far fewer
+hands to be significant. The same file gives the same hands on every machine and in every worker.
+
+    python deals.py --output deals.npy --count 100000 --seed 0
+
+    from deals import load_deals
+    deals = load_deals('deals.npy')
+'''
+import numpy as np
+import argparse
+
+from card import card_names
+
+deal_dtype = np.dtype([
+    ('order', np.int8, 40),
+    ('goes_first', np.int8),
+])
+
+
+def generate_deals(count, seed=None):
+    ''' count uniformly shuffled decks, each with a random seat going first.
+    '''
+    rng = np.random.default_rng(seed)
+    deals = np.zeros(count, dtype=deal_dtype)
+    deals['order'] = rng.permuted(np.tile(np.arange(40, dtype=np.int8), (count, 1)), axis=1)
+    deals['goes_first'] = rng.integers(0, 2, count)
+    return deals
+
+
+def save_deals(path, deals):
+    np.save(path, deals)
+
+
+def load_deals(path):
+    ''' The deals saved in path, memory mapped.
+    '''
+    return np.load(path, mmap_mode='r')
+
+
+def get_deal_hands(deals):
+    ''' Card ids each seat is dealt, three cards at a time from the end of the deck, alternating seats.
+    Returns:
+        int8 array (len(deals), 2, 3), e.g. the hands argument of batch_kernel.TrucoBatch.reset
+    '''
+    order = np.asarray(deals['order'])
+    return np.stack((order[:, [39, 37, 35]], order[:, [38, 36, 34]]), axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a file of shuffled deals.")
+    parser.add_argument('--output', default='deals.npy')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=5, help="Print the first deals.")
+    args = parser.parse_args()
+
+    deals = generate_deals(args.count, args.seed)
+    save_deals(args.output, deals)
+    print(f"{args.count} deals, {deals.nbytes / 1024:.0f} KiB written to {args.output}")
+
+    for deal, hands in zip(deals[:args.show], get_deal_hands(deals[:args.show])):
+        seats = ' | '.join(' '.join(card_names[c] for c in hand) for hand in hands)
+        print(f"{seats}  (seat {deal['goes_first']} first)")
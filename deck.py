@@ -1,20 +1,19 @@
-from card import Card, valid_suit, valid_rank
+from card import card_table
+import random
 
 def init_truco_deck():
-    ''' Initialize a truco deck of 52 cards
+    ''' Initialize a truco deck of 40 cards
     Returns:
-        (list): A list of Card object
+        (list): A list of Card object, ordered by card id
     '''
-    res = [Card(suit, rank) for suit in valid_suit for rank in valid_rank]
-    return res
+    return list(card_table)
 
 def shuffle_cards(cards, in_place=False):
-    import random
     if in_place:
         random.shuffle(cards)
         return cards
     else:
-        import copy 
-        copied_cards = copy.deepcopy(cards)
+        # Cards are shared instances, a shallow copy is enough
+        copied_cards = list(cards)
         random.shuffle(copied_cards)
-        return copied_cards
\ No newline at end of file
+        return copied_cards
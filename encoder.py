@@ -0,0 +1,117 @@
+import numpy as np
+
+from card_utils import envido_actions, truco_actions
+
+# Layout of the encoded game state, see environment.encode_game_state
+game_offset = 0
+score_offset = 2
+player_cards_offset = 6
+cards_played_offset = 46
+envido_calls_offset = 292
+envidos_offset = 307
+truco_calls_offset = 309
+state_space_dim = 339
+
+card_row_size = 1 + 40
+envido_row_size = 1 + len(envido_actions)
+truco_row_size = 1 + len(truco_actions)
+
+envido_action_index = {a: i for i, a in enumerate(envido_actions)}
+truco_action_index = {a: i for i, a in enumerate(truco_actions)}
+
+
+class GameStateEncoder:
+    '''
+    Keeps the encoded state of a TrucoGame for both seats and updates it as the game advances.
+
+    Produces the same vectors as environment.encode_game_state, but only writes the slots touched
+    since the last update: new cards played, new wager calls, the scores and who moves next.
+    '''
+
+    def __init__(self):
+        self.game = None
+        self.buffers = np.zeros((2, state_space_dim), dtype=np.float32)
+
+    def get_seat(self, player):
+        return self.game.get_seat(player)
+
+    def reset(self, game):
+        ''' Encode game from scratch. Must be called whenever the game object or its state is replaced.
+        '''
+        self.game = game
+        self.buffers[:] = 0
+        self.cards_seen = 0
+        self.envido_seen = 0
+        self.truco_seen = 0
+        self.envido_revealed = False
+
+        for seat, player in enumerate(game.players):
+            buffer = self.buffers[seat]
+            buffer[game_offset] = 1 if seat == game.first_seat else 0
+            buffer[score_offset + 2 * seat] = 1
+            buffer[player_cards_offset + player.get_hand_ids()] = 1
+            buffer[envidos_offset] = game.envido.calculate_player_envido(seat)
+            buffer[envidos_offset + 1] = -1
+
+        self.update()
+
+    def update(self):
+        ''' Bring the buffers up to date with the game.
+        '''
+        game = self.game
+        buffers = self.buffers
+
+        mano = game.get_mano_seat()
+        buffers[0, game_offset + 1] = 1 if mano == 0 else 0
+        buffers[1, game_offset + 1] = 1 if mano == 1 else 0
+
+        buffers[:, score_offset + 1] = game.scores[0]
+        buffers[:, score_offset + 3] = game.scores[1]
+
+        card_game = game.card_game
+        while self.cards_seen < len(card_game.played_by):
+            i = self.cards_seen
+            seat = card_game.played_by[i]
+            card_id = int(card_game.played_ids[i])
+            row = cards_played_offset + i * card_row_size
+            buffers[seat, row] = 1
+            buffers[:, row + 1 + card_id] = 1
+            buffers[seat, player_cards_offset + card_id] = 0
+            self.cards_seen += 1
+
+        envido_calls = game.envido.envido_calls
+        while self.envido_seen < len(envido_calls):
+            i = self.envido_seen
+            seat, call = envido_calls[i]
+            row = envido_calls_offset + i * envido_row_size
+            buffers[seat, row] = 1
+            buffers[:, row + 1 + envido_action_index[call]] = 1
+            self.envido_seen += 1
+
+        if not self.envido_revealed and game.envido.is_finished():
+            buffers[0, envidos_offset + 1] = buffers[1, envidos_offset]
+            buffers[1, envidos_offset + 1] = buffers[0, envidos_offset]
+            self.envido_revealed = True
+
+        truco_calls = game.truco.truco_calls
+        while self.truco_seen < len(truco_calls):
+            i = self.truco_seen
+            seat, call = truco_calls[i]
+            row = truco_calls_offset + i * truco_row_size
+            buffers[seat, row] = 1
+            buffers[:, row + 1 + truco_action_index[call]] = 1
+            self.truco_seen += 1
+
+    def get_view(self, seat):
+        ''' Encoded state of seat. The view changes as the game advances.
+        '''
+        return self.buffers[seat]
+
+    def encode(self, player, out=None):
+        ''' Encoded state for player, copied into out if given.
+        '''
+        buffer = self.buffers[self.get_seat(player)]
+        if out is None:
+            return buffer.copy()
+        out[:] = buffer
+        return out
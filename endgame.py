@@ -0,0 +1,215 @@
+'''
+Exact solver for the card play of a hand.
+
+Once envido and truco are settled, what is left of a hand is at most 6 cards, and with both hands known
+the winner under best play can be found by searching the whole tree. Only the tiers of the cards matter to
+who wins a round, so positions are canonicalized to tiers: the round results so far, the tier of a card
+led in the current round, the tiers in each hand and who plays next, all relative to the seat that started
+the hand. They are packed into an int key of a transposition table that is shared by every position with
+the same canonical state, so most queries are one dict lookup.
+
+Positions are read from TrucoGame.snapshot records. No further calls are considered: the wagers are taken
+as they stand, and the points at stake are the accepted truco value, or 1 without truco.
+
+    python endgame.py --cache endgame_cache.npz --deals 20000
+
+solves the card play of random deals, saves the table and reports its size and lookup speed.
+'''
+from timeit import default_timer as timer
+from pathlib import Path
+import numpy as np
+import argparse
+
+from card import card_tier
+from card_game import first_won, second_won, tied, get_card_game_winner
+from game import TrucoGame, record_game, record_card_game, record_envido, record_truco
+from player import Player
+from rollout_agent import decode_game_state, get_opponent_hands
+from truco import truco_machine
+
+# Pads a hand and marks a round with no card led yet
+no_tier = 15
+
+
+def pack_position(results, lead_tier, hands, mover):
+    ''' Transposition table key of a canonical position.
+    Args:
+        results: results of the rounds played, at most 2 for an undecided position
+        lead_tier: tier of the card led in the current round, no_tier if none
+        hands: tiers of the cards in hand of the first and the second seat, sorted from highest
+        mover: 0 when the first seat plays next, 1 for the second
+    '''
+    key = len(results)
+    for i in range(2):
+        key = key << 2 | (results[i] if i < len(results) else 0)
+    key = key << 4 | lead_tier
+    for hand in hands:
+        for i in range(3):
+            key = key << 4 | (hand[i] if i < len(hand) else no_tier)
+    return key << 1 | mover
+
+
+def get_position(record):
+    ''' Canonical card play position of a TrucoGame.snapshot record, see pack_position.
+    Returns:
+        results, lead_tier, hands, mover
+    '''
+    first_seat = int(record[record_game + 4])
+    card_next = int(record[record_card_game + 1])
+    played = int(record[record_card_game + 2])
+    played_ids = card_tier[record[record_card_game + 3:record_card_game + 3 + played]].tolist()
+    played_by = record[record_card_game + 9:record_card_game + 9 + played].tolist()
+
+    results = []
+    for i in range(0, played - 1, 2):
+        first, second = played_ids[i], played_ids[i + 1]
+        if played_by[i] != first_seat:
+            first, second = second, first
+        results.append(first_won if first > second else second_won if first < second else tied)
+    lead_tier = played_ids[-1] if played % 2 else no_tier
+
+    hands = []
+    for seat in (first_seat, 1 - first_seat):
+        hand = record[3 * seat:3 * seat + 3]
+        hands.append(tuple(sorted(card_tier[hand[hand >= 0]].tolist(), reverse=True)))
+    return tuple(results), lead_tier, tuple(hands), 0 if card_next == first_seat else 1
+
+
+def get_stake(record):
+    ''' Points the card game is worth, ValueError while a wager is still being called.
+    '''
+    if record[record_envido + 1] >= 0 or record[record_truco + 1] >= 0:
+        raise ValueError("The card play can only be solved once envido and truco are answered.")
+    if record[record_truco + 4] == 0:
+        return 1
+    return truco_machine.get_reward(int(record[record_truco + 3]))
+
+
+class EndgameSolver:
+
+    def __init__(self, path=None):
+        '''
+        Args:
+            path: cache file of the transposition table, loaded when it exists and written by save
+        '''
+        # Position key -> 1 when the first seat wins the card game under best play, -1 otherwise
+        self.table = {}
+        self.path = path
+        if path is not None and Path(path).exists():
+            self.load(path)
+
+    def load(self, path):
+        cache = np.load(path)
+        self.table.update(zip(cache['keys'].tolist(), cache['values'].tolist()))
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        keys = np.fromiter(self.table.keys(), dtype=np.int64, count=len(self.table))
+        values = np.fromiter(self.table.values(), dtype=np.int8, count=len(self.table))
+        np.savez(path, keys=keys, values=values)
+
+    def solve_position(self, results, lead_tier, hands, mover):
+        ''' 1 when the first seat wins the card game from a canonical position under best play, -1 otherwise.
+        '''
+        key = pack_position(results, lead_tier, hands, mover)
+        value = self.table.get(key)
+        if value is not None:
+            return value
+
+        hand = hands[mover]
+        best = None
+        for i, tier in enumerate(hand):
+            if i > 0 and hand[i - 1] == tier:
+                continue
+            next_hands = list(hands)
+            next_hands[mover] = hand[:i] + hand[i + 1:]
+            next_hands = tuple(next_hands)
+
+            if lead_tier == no_tier:
+                value = self.solve_position(results, tier, next_hands, 1 - mover)
+            else:
+                first, second = (tier, lead_tier) if mover == 0 else (lead_tier, tier)
+                round_result = first_won if first > second else second_won if first < second else tied
+                next_results = results + (round_result,)
+                winner = get_card_game_winner(next_results)
+                if winner is not None:
+                    value = 1 if winner == first_won else -1
+                else:
+                    # The leader keeps the lead unless the other card beats it
+                    leader = mover if tier > lead_tier else 1 - mover
+                    value = self.solve_position(next_results, no_tier, next_hands, leader)
+
+            if best is None or (value > best if mover == 0 else value < best):
+                best = value
+
+        if best is None:
+            # No cards left and no winner, which the tie rules do not allow
+            raise ValueError(f"Undecided card game with results {results}.")
+        self.table[key] = best
+        return best
+
+    def solve(self, record, seat):
+        ''' Points won (positive) or lost by seat in the card play of a snapshot record, with both hands known.
+        '''
+        first_seat = int(record[record_game + 4])
+        value = self.solve_position(*get_position(record))
+        return get_stake(record) * value * (1 if seat == first_seat else -1)
+
+    def solve_game(self, game, seat):
+        return self.solve(game.snapshot(), seat)
+
+    def expected_value(self, record, seat, opponent_envido=None):
+        ''' Mean of solve over every hand the opponent of seat can hold, see rollout_agent.get_opponent_hands.
+        The opponent's hand in record is ignored.
+        '''
+        hands = get_opponent_hands(record, seat, opponent_envido)
+        # Hands with the same tiers have the same value
+        tiers = -np.sort(-card_tier[hands], axis=1)
+        unique, first, counts = np.unique(tiers, axis=0, return_index=True, return_counts=True)
+
+        record = record.copy()
+        opponent = 3 * (1 - seat)
+        total = 0
+        for i, count in zip(first, counts):
+            record[opponent:opponent + 3] = -1
+            record[opponent:opponent + hands.shape[1]] = hands[i]
+            total += count * self.solve(record, seat)
+        return total / len(hands)
+
+    def solve_game_state(self, game_state):
+        ''' expected_value for the player of an encoded game state, who must be the next to act.
+        '''
+        record, seat, opponent_envido = decode_game_state(game_state)
+        return self.expected_value(record, seat, opponent_envido)
+
+
+def solve_deals(solver, deals, seed=None):
+    ''' Solve the card play of deals random deals, filling the table.
+    '''
+    players = [Player(0), Player(1)]
+    game = TrucoGame(players, rng=np.random.default_rng(seed))
+    for i in range(deals):
+        game.reset(goes_first=i % 2)
+        solver.solve_game(game, 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve the card play of random deals and cache the results.")
+    parser.add_argument('--cache', default='endgame_cache.npz')
+    parser.add_argument('--deals', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    solver = EndgameSolver(args.cache)
+    cached = len(solver.table)
+
+    start = timer()
+    solve_deals(solver, args.deals, args.seed)
+    elapsed = timer() - start
+    solver.save()
+    print(f"Solved {args.deals} deals in {elapsed:.2f}s, {len(solver.table) - cached} new positions, {len(solver.table)} cached")
+
+    # Same deals again, now answered from the table
+    start = timer()
+    solve_deals(solver, args.deals, args.seed)
+    print(f"Cached lookups: {(timer() - start) / args.deals * 1e6:.1f}us per deal")
@@ -1,8 +1,11 @@
-from wager import is_valid_wager_state, is_wager_active, get_wager_reward, is_wager_finished, is_wager_started
+from wager import WagerMachine, is_wager_active, is_wager_finished, is_wager_started
 import numpy as np
 import logging
+from itertools import combinations, permutations
 
-from card_utils import encode_envido
+from card_utils import encode_envido, envido_actions
+from events import WagerCall, WagerForfeited, EnvidoRevealed
+from card import Card, card_suit, card_envido_value
 
 
 envido_states = [
@@ -16,21 +19,24 @@ envido_states = [
     (['real envido', 'no quiero'], 1)
 ]
 
-def rank_to_envido_value(rank):
-    if rank in ['10', '11', '12']:
-        return 10
-    else:
-        return int(rank)
+envido_machine = WagerMachine(envido_states, envido_actions)
+
+# Longest call sequence, and the size of Envido.snapshot: finished, next seat, wager state,
+# number of calls and a (seat, call index) pair per call
+max_envido_calls = max(len(state) for state, score in envido_states)
+envido_record_size = 4 + 2 * max_envido_calls
 
 def calculate_envido(cards):
     groups = {}
     
     for card in cards:
-        value = rank_to_envido_value(card.rank)
-        if card.suit in groups:
-            groups[card.suit].append(value)
+        card_id = card.id if isinstance(card, Card) else card
+        value = int(card_envido_value[card_id])
+        suit = card_suit[card_id]
+        if suit in groups:
+            groups[suit].append(value)
         else:
-            groups[card.suit] = [value]
+            groups[suit] = [value]
     
     score = 0
     for key, values in groups.items():
@@ -56,26 +62,82 @@ def calculate_envido(cards):
             elif 10 in new_values:
                 score = max(score, sum(new_values) + 10)
             else:
-                two_largest = np.argsort(new_values)
-                score = max(score, sum(two_largest[-2:]))
+                two_largest = sorted(new_values)[-2:]
+                score = max(score, sum(two_largest) + 20)
                 
     return score
 
+# Envido of every 1, 2 and 3 card subset of the deck, indexed by three card ids in any order.
+# Hands with fewer than 3 cards are padded with no_card.
+no_card = 40
+
+def build_envido_table():
+    table = np.zeros((no_card + 1,) * 3, dtype=np.int8)
+    for size in range(1, 4):
+        for cards in combinations(range(no_card), size):
+            table[(*cards, *[no_card] * (3 - size))] = calculate_envido(cards)
+    # Only sorted ids have been filled so far, every other ordering is a transposition of them
+    return np.max([table.transpose(axes) for axes in permutations(range(3))], axis=0)
+
+envido_table = build_envido_table()
+
+def lookup_envido(card_ids):
+    ''' Envido of up to 3 cards given by id.
+    '''
+    card_ids = [*card_ids, no_card, no_card, no_card]
+    return int(envido_table[card_ids[0], card_ids[1], card_ids[2]])
+
+def calculate_envido_batch(card_ids):
+    ''' Envido of many hands at once.
+    Args:
+        card_ids: int array (n_hands, up to 3), -1 marks a missing card
+    Returns:
+        int8 array (n_hands,)
+    '''
+    card_ids = np.asarray(card_ids)
+    padded = np.full((card_ids.shape[0], 3), no_card, dtype=np.intp)
+    padded[:, :card_ids.shape[1]] = np.where(card_ids < 0, no_card, card_ids)
+    return envido_table[padded[:, 0], padded[:, 1], padded[:, 2]]
+
 class Envido:
+    '''
+    Envido wager. Players are referred to by seat, their index in game.players.
+    '''
 
     def __init__(self, game):
         '''
         Initialize envido.
         '''
         self.game = game
+        self.envido_calls = []
+        self.reset()
+
+    def reset(self):
         self.finished = False
+        # Seat expected to answer, None when nobody is
         self.envido_next = None
-        self.envido_calls = [] 
+        # (seat, call) pairs
+        self.envido_calls.clear()
+        self.wager_state = 0
     
-    def get_state(self, player):
+    def snapshot(self):
+        ''' State as envido_record_size ints, see restore.
+        '''
+        record = [int(self.finished), -1 if self.envido_next is None else self.envido_next, self.wager_state, len(self.envido_calls)]
+        for seat, call in self.envido_calls:
+            record += (seat, envido_machine.action_index[call])
+        return record + [-1] * (envido_record_size - len(record))
+
+    def restore(self, record):
+        self.finished = bool(record[0])
+        self.envido_next = None if record[1] < 0 else record[1]
+        self.wager_state = record[2]
+        self.envido_calls[:] = [(record[4 + 2 * i], envido_machine.actions[record[5 + 2 * i]]) for i in range(record[3])]
+
+    def get_state(self, seat):
         state = []
-        for p, c in self.envido_calls:
-            p_id = 1 if player == p else 0
+        for s, c in self.envido_calls:
+            p_id = 1 if seat == s else 0
             turn = [p_id, *encode_envido(c)]
             state.append(np.array(turn, dtype=np.int8))
             
@@ -87,46 +149,55 @@ class Envido:
             
         envidos = None
         if self.is_finished():
-            envidos = np.array([self.calculate_player_envido(player), self.calculate_player_envido(self.game.get_opponent(player))])
+            envidos = np.array([self.calculate_player_envido(seat), self.calculate_player_envido(1 - seat)])
         else:
-            envidos = np.array([self.calculate_player_envido(player), -1])
+            envidos = np.array([self.calculate_player_envido(seat), -1])
             
         return state, envidos
     
     
-    def get_legal_actions(self, player):
-        if self.envido_next == player:
-            raw_state = [call for player, call in self.envido_calls]
-    
-            legal_actions = []
-            for state, val in envido_states:
-                if state[:len(raw_state)] == raw_state and len(raw_state) < len(state):
-                    legal_actions.append(state[len(raw_state)])
-
-            return list(dict.fromkeys(legal_actions))
+    def get_legal_actions(self, seat):
+        if self.envido_next == seat:
+            return list(envido_machine.legal_actions[self.wager_state])
         elif not self.is_started():
             return ['envido', 'real envido']
         return []
+
+    def get_legal_actions_mask(self, seat):
+        ''' Legal calls for seat as a bool mask over envido_machine.actions.
+        '''
+        if self.envido_next == seat:
+            return envido_machine.legal_mask[self.wager_state]
+        elif not self.is_started():
+            return envido_machine.legal_mask[0]
+        return envido_machine.legal_mask[envido_machine.dead_state]
     
-    def calculate_player_envido(self, player):
-        cards = np.concatenate(([c for p, c in self.game.get_cards_played() if player == p], player.hand))
-        return calculate_envido(cards)
+    def calculate_player_envido(self, seat):
+        return lookup_envido(self.game.card_game.get_player_card_ids(seat) + self.game.players[seat].get_hand_ids().tolist())
 
     def get_winner(self):    
-        p1_envido = self.calculate_player_envido(self.game.first_move_by)
-        p2_envido = self.calculate_player_envido(self.game.second_move_by)
+        first_seat = self.game.first_seat
+        p1_envido = self.calculate_player_envido(first_seat)
+        p2_envido = self.calculate_player_envido(1 - first_seat)
         
-        logging.debug(f"{self.game.first_move_by} has an envido of {p1_envido}")
-        logging.debug(f"{self.game.second_move_by} has an envido of {p2_envido}")
+        if self.game.events.active:
+            self.game.events.emit(EnvidoRevealed(self.game.first_move_by, p1_envido))
+            self.game.events.emit(EnvidoRevealed(self.game.second_move_by, p2_envido))
         
-        return self.game.first_move_by if p1_envido >= p2_envido else self.game.second_move_by
+        return first_seat if p1_envido >= p2_envido else 1 - first_seat
 
     
+    def add_call(self, seat, call):
+        self.envido_calls.append((seat, call))
+        self.wager_state = envido_machine.step(self.wager_state, call)
+        if self.game.events.active:
+            self.game.events.emit(WagerCall('envido', self.game.players[seat], call))
+
     def get_reward(self):
-        return get_wager_reward(envido_states, self.envido_calls)
+        return envido_machine.get_reward(self.wager_state)
     
     def switch_turn(self):
-        self.envido_next = self.game.get_opponent(self.envido_next)
+        self.envido_next = 1 - self.envido_next
 
     def is_started(self):
         return is_wager_started(self.envido_calls)
@@ -140,46 +211,35 @@ class Envido:
 
     
     def is_valid_state(self, action):
-        return is_valid_wager_state(envido_states, self.envido_calls, action)
+        return envido_machine.is_valid(self.wager_state, action)
 
 
-    def take_action(self, player, action_played):
+    def take_action(self, seat, action_played):
         if self.is_valid_state(action_played):
-            if len(self.envido_calls) == 0 and self.game.get_mano() == player:
-                self.envido_calls.append((player, action_played))
-                logging.info(f"{player} called {action_played}.")
-                self.envido_next = self.game.get_opponent(player)
-            elif self.is_active() and self.envido_calls[-1][0] != player:
-                self.envido_calls.append((player, action_played))
-                logging.info(f"{player} called {action_played}")
+            if len(self.envido_calls) == 0 and self.game.get_mano_seat() == seat:
+                self.add_call(seat, action_played)
+                self.envido_next = 1 - seat
+            elif self.is_active() and self.envido_calls[-1][0] != seat:
+                self.add_call(seat, action_played)
                 self.switch_turn()
             else:
-                logging.warn(f"{player} can't call {action_played}. Not Your Turn.")
+                logging.warning("%s can't call %s. Not Your Turn.", self.game.players[seat], action_played)
         else:
-            logging.warn(f"{player} can't call {action_played}. Invalid Envido State.")
+            logging.warning("%s can't call %s. Invalid Envido State.", self.game.players[seat], action_played)
 
-    def take_terminal_action(self, player, action_played):
-        self.envido_calls.append((player, action_played))
-        logging.info(f"{player} called {action_played} envido")
+    def take_terminal_action(self, seat, action_played):
+        self.add_call(seat, action_played)
         if action_played == "no quiero":
-            opponent = self.game.get_opponent(player)
-            reward = self.get_reward()
-            self.game.update_score(opponent, reward)
-            logging.debug(f"{opponent} was rewarded {reward} for winning envido.")
+            self.game.update_score(1 - seat, self.get_reward(), 'envido')
         else:
-            winner = self.get_winner()
-            reward = self.get_reward()
-            self.game.update_score(winner, reward)
-            logging.debug(f"{winner} was rewarded {reward} for winning envido.")
+            self.game.update_score(self.get_winner(), self.get_reward(), 'envido')
         # de-activate envido    
         self.envido_next = None
         self.finished = True
 
-    def fold(self, player):
+    def fold(self, seat):
         if self.is_active():
-            self.envido_calls.append((player, 'no quiero'))
-            logging.debug(f"{player} forfeited envido")
-            opponent = self.game.get_opponent(player)
-            reward = self.get_reward()
-            self.game.update_score(opponent, reward)
-            logging.debug(f"{opponent} was rewarded {reward} for winning envido.")
+            self.add_call(seat, 'no quiero')
+            if self.game.events.active:
+                self.game.events.emit(WagerForfeited('envido', self.game.players[seat]))
+            self.game.update_score(1 - seat, self.get_reward(), 'envido')
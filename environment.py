@@ -3,6 +3,15 @@ import logging
 import numpy as np
 import random
 from actions import game_actions
+from encoder import GameStateEncoder
+from events import EventBus, LoggingSink, HandStarted
+from profiler import profiler
+
+reset_phase = profiler.phase('env.reset')
+step_phase = profiler.phase('env.step')
+action_phase = profiler.phase('env.take_action')
+encode_phase = profiler.phase('env.encode')
+legal_actions_phase = profiler.phase('env.legal_actions')
 
 def encode_game_state(player, game):
     state = game.get_state(player)
@@ -19,18 +28,37 @@ def encode_game_state(player, game):
 
 class TrucoEnvironment:
 
-    def __init__(self, players, logging_level=logging.WARNING):
-        self.game = TrucoGame(players)
+    def __init__(self, players, logging_level=logging.WARNING, legal_actions_mask=False, events=None, rng=None, deals=None):
+        '''
+        Args:
+            events: EventBus shared by every hand played, see events.py. A LoggingSink is attached when
+                    logging_level lets INFO messages through and the bus does not have one yet.
+            rng: numpy Generator the deck is shuffled with, seeded from random when not given
+            deals: deal array, see deals.py, replayed in order by reset instead of shuffling. Each deal sets
+                   the deck and the seat that goes first, and the deals start over once all are played.
+        '''
+        self.events = EventBus() if events is None else events
+        # One game is reused for every hand
+        self.game = TrucoGame(players, events=self.events, rng=rng)
+        # Return legal actions as a bool mask aligned with game_actions instead of a list of names
+        self.legal_actions_mask = legal_actions_mask
+        self.encoder = GameStateEncoder()
         self.players = players
+        self.deals = deals
+        # Next deal to replay
+        self.deal_index = 0
         self.games_won = [(p, 0) for p in players]
         self.games_played = 0
         logging.basicConfig(level=logging_level , format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
+        # A bus shared by several environments gets a single sink
+        if logging_level <= logging.INFO and not any(isinstance(s, LoggingSink) for s in self.events.subscribers):
+            self.events.subscribe(LoggingSink())
 
-    def reset(self, force=False, goes_first=None): 
-        # Clear player cards
-        for player in self.players:
-            player.hand.clear()
-            
+    def reset(self, force=False, goes_first=None, out=None): 
+        with reset_phase:
+            return self._reset(force, goes_first, out)
+
+    def _reset(self, force, goes_first, out):
         winner = self.game.get_winner()
         if winner is not None:
             self.games_won = [(p, wins + 1) if p == winner else (p, wins) for p, wins in self.games_won]
@@ -38,27 +66,61 @@ class TrucoEnvironment:
         elif force:
             logging.debug("Game ended with no winner.")
             
-        self.game = TrucoGame(self.players, goes_first=goes_first if goes_first else random.getrandbits(1))
+        if self.deals is None:
+            self.game.reset(goes_first=goes_first if goes_first else random.getrandbits(1))
+        else:
+            deal = self.deals[self.deal_index]
+            self.deal_index = (self.deal_index + 1) % len(self.deals)
+            self.game.reset(goes_first=int(deal['goes_first']), order=deal['order'])
+        
+        self.encoder.reset(self.game)
         
         first_move_by = self.game.get_mano()
         
-        logging.info("New Game.")
+        if self.events.active:
+            self.events.emit(HandStarted(self.game.first_move_by, self.game.second_move_by))
         
-        return first_move_by, self.game.get_legal_actions(first_move_by), encode_game_state(first_move_by, self.game)
+        return first_move_by, self.get_legal_actions(first_move_by), self.encoder.encode(first_move_by, out)
+
+    def step(self, player, action, out=None):
+        with step_phase:
+            return self._step(player, action, out)
 
-    def step(self, player, action):
-        old_score = self.game.scoreboard.copy()
+    def _step(self, player, action, out):
+        seat = self.game.get_seat(player)
+        old_lead = self.game.get_lead(seat)
         
-        self.game.take_action(player, action)
+        with action_phase:
+            self.game.take_action(player, action)
         next_player = self.game.get_mano()
         
-        new_score = self.game.scoreboard.copy()
-        reward = 0
-        for i in range(len(new_score)):
-            if new_score[i][0] == player:
-                reward += (new_score[i][1] - old_score[i][1])
-            else:
-                reward -= (new_score[i][1] - old_score[i][1])
+        # Points won minus points given away by the action
+        reward = self.game.get_lead(seat) - old_lead
         
-        return reward, 1 if self.game.finished else 0, next_player, self.game.get_legal_actions(next_player), encode_game_state(next_player, self.game)
+        with legal_actions_phase:
+            legal_actions = self.get_legal_actions(next_player)
+        with encode_phase:
+            self.encoder.update()
+            game_state = self.encoder.encode(next_player, out)
+        
+        return reward, 1 if self.game.finished else 0, next_player, legal_actions, game_state
+
+    def snapshot(self, out=None):
+        ''' State of the current hand, see TrucoGame.snapshot.
+        '''
+        return self.game.snapshot(out)
+
+    def restore(self, record, out=None):
+        ''' Go back to a snapshot of a hand. Returns what reset does: next player, legal actions and
+        encoded game state.
+        '''
+        self.game.restore(record)
+        self.encoder.reset(self.game)
+        next_player = self.game.get_mano()
+        return next_player, self.get_legal_actions(next_player), self.encoder.encode(next_player, out)
+
+    def get_legal_actions(self, player):
+        if self.legal_actions_mask:
+            return self.game.get_legal_actions_mask(player)
+        return self.game.get_legal_actions(player)
         
\ No newline at end of file
@@ -0,0 +1,130 @@
+'''
+Structured events emitted by a hand of Truco.
+
+TrucoGame and its parts publish what happens (cards played, wager calls, points scored, ...) to an
+EventBus. Emitters check bus.active before building an event, so with no subscribers a hand costs one
+attribute lookup per event and nothing is formatted or logged.
+
+    events = EventBus()
+    events.subscribe(LoggingSink())
+    env = TrucoEnvironment(players, events=events)
+'''
+from collections import namedtuple, Counter
+from card import card_names
+from player import Player
+import logging
+
+HandStarted = namedtuple('HandStarted', ['first_move_by', 'second_move_by'])
+CardPlayed = namedtuple('CardPlayed', ['player', 'card_id'])
+# wager is 'envido' or 'truco'
+WagerCall = namedtuple('WagerCall', ['wager', 'player', 'call'])
+WagerForfeited = namedtuple('WagerForfeited', ['wager', 'player'])
+EnvidoRevealed = namedtuple('EnvidoRevealed', ['player', 'envido'])
+# reason is 'envido', 'truco' or 'hand'
+ScoreUpdate = namedtuple('ScoreUpdate', ['player', 'points', 'reason'])
+# next_player leads the next round
+RoundFinished = namedtuple('RoundFinished', ['round', 'next_player'])
+Folded = namedtuple('Folded', ['player'])
+# scores is ((player, score), (player, score))
+HandFinished = namedtuple('HandFinished', ['scores'])
+
+
+class EventBus:
+    '''
+    Delivers events to subscribers, in subscription order.
+    '''
+
+    def __init__(self):
+        self.subscribers = []
+        self.active = False
+
+    def subscribe(self, subscriber):
+        ''' subscriber is called with every event.
+        '''
+        self.subscribers.append(subscriber)
+        self.active = True
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+        self.active = len(self.subscribers) > 0
+
+    def emit(self, event):
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+
+class LoggingSink:
+    '''
+    Logs events the way the game used to: hand, card and call events at INFO, the rest at DEBUG.
+    '''
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger()
+
+    def __call__(self, event):
+        log = self.logger.log
+        kind = type(event)
+        if kind is CardPlayed:
+            log(logging.INFO, "%s played %s", event.player, card_names[event.card_id])
+        elif kind is WagerCall:
+            log(logging.INFO, "%s called %s (%s)", event.player, event.call, event.wager)
+        elif kind is Folded:
+            log(logging.INFO, "%s folded.", event.player)
+        elif kind is HandStarted:
+            log(logging.INFO, "New Game.")
+        elif kind is HandFinished:
+            log(logging.INFO, "Hand finished.")
+            for player, score in event.scores:
+                log(logging.INFO, "%s scored %s", player, score)
+        elif kind is ScoreUpdate:
+            log(logging.DEBUG, "%s was rewarded %s for winning %s.", event.player, event.points, event.reason)
+        elif kind is EnvidoRevealed:
+            log(logging.DEBUG, "%s has an envido of %s", event.player, event.envido)
+        elif kind is WagerForfeited:
+            log(logging.DEBUG, "%s forfeited %s", event.player, event.wager)
+        elif kind is RoundFinished:
+            log(logging.DEBUG, "Round %s finished. %s starts the next one.", event.round, event.next_player)
+
+
+def player_ids(value):
+    if isinstance(value, Player):
+        return value.get_id()
+    elif isinstance(value, tuple):
+        return tuple(map(player_ids, value))
+    return value
+
+
+class EventRecorder:
+    '''
+    Keeps every event, with players replaced by their ids so the record does not change as hands are dealt.
+    '''
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(type(event)(*map(player_ids, event)))
+
+    def clear(self):
+        self.events.clear()
+
+
+class EventCounter:
+    '''
+    Aggregate metrics: events by type, wager calls and points scored by reason.
+    '''
+
+    def __init__(self):
+        self.events = Counter()
+        self.calls = Counter()
+        self.points = Counter()
+
+    def __call__(self, event):
+        kind = type(event)
+        self.events[kind.__name__] += 1
+        if kind is WagerCall:
+            self.calls[(event.wager, event.call)] += 1
+        elif kind is ScoreUpdate:
+            self.points[event.reason] += event.points
+
@@ -1,109 +1,242 @@
 import numbers
 import numpy as np
-from envido import Envido
-from actions import game_actions, envido_actions, truco_actions, response_actions, playable_cards
-from truco import Truco
-from card_utils import encode_card_array, encode_envido, encode_truco
-from card_game import CardGame
+from envido import Envido, envido_machine, envido_record_size
+from actions import game_actions, game_actions_index, card_action_offset, envido_actions, truco_actions, response_actions
+from card import card_tier, card_ids
+from truco import Truco, truco_machine, truco_record_size
+from card_utils import encode_card_ids, encode_envido, encode_truco
+from card_game import CardGame, card_game_record_size
 from dealer import Dealer
+from player import Player
+from events import EventBus, ScoreUpdate, RoundFinished, Folded, HandFinished
 
 import logging
 
+# Index in game_actions of each envido and truco call
+envido_action_ids = np.array([game_actions_index[a] for a in envido_machine.actions])
+truco_action_ids = np.array([game_actions_index[a] for a in truco_machine.actions])
+fold_action_id = game_actions_index['fold']
+
+# Layout of the int16 records written by TrucoGame.snapshot
+record_hands = 0                # 3 card ids per seat in hand order, -1 padded
+record_game = 6                 # scores of both seats, finished, round, first seat
+record_card_game = 11
+record_envido = record_card_game + card_game_record_size
+record_truco = record_envido + envido_record_size
+record_size = record_truco + truco_record_size
+
 
 class TrucoGame:
+    '''
+    A hand of Truco between two players. Internally players are referred to by seat, their index in
+    players; the public methods take and return Player objects.
+    '''
     
-    
-    def __init__(self, players, goes_first=0):
+    def __init__(self, players, goes_first=0, events=None, rng=None):
         '''
         Initialize a Game of Truco.
+        Args:
+            events: EventBus the game publishes to, a private one when not given
+            rng: numpy Generator the dealer shuffles with
         '''
         self.players = players
-        self.dealer = Dealer()
+        self.events = EventBus() if events is None else events
+        self.dealer = Dealer(rng)
+        # Points of each seat
+        self.scores = np.zeros(2, dtype=np.int16)
+        self.envido = Envido(self)
+        self.truco = Truco(self)
+        self.card_game = CardGame(self, goes_first)
+        self.deal(goes_first)
+
+    def reset(self, goes_first=0, order=None):
+        ''' Start a new hand with the same objects: reshuffle, clear hands, calls and cards played, and deal.
+        Args:
+            order: deck to deal from instead of a shuffled one, see Dealer.set_order
+        '''
+        self.scores[:] = 0
+        if order is None:
+            self.dealer.shuffle()
+        else:
+            self.dealer.set_order(order)
+        self.envido.reset()
+        self.truco.reset()
+        self.card_game.reset(goes_first)
+        self.deal(goes_first)
+
+    def deal(self, goes_first):
         self.finished = False
         self.round = 0
-        self.scoreboard = np.array([(p, 0) for p in players])
-        self.first_move_by = self.players[goes_first] 
-        self.second_move_by = self.players[1 - goes_first] 
+        self.first_seat = goes_first
         
+        for player in self.players:
+            player.clear_hand()
         self.dealer.deal_cards_in_order(self.players)
-        
-        self.envido = Envido(self)
-        self.truco = Truco(self)
-        self.card_game = CardGame(self, self.first_move_by)
+
+    def snapshot(self, out=None):
+        ''' The state of the hand (cards in hand, scores, cards played and calls) as an int16 record of
+        record_size values. The deck and the event subscribers are not part of it.
+        Args:
+            out: int16 array of record_size to write into, e.g. a row of a preallocated batch
+        '''
+        record = []
+        for player in self.players:
+            hand = player.get_hand_ids().tolist()
+            record += hand + [-1] * (3 - len(hand))
+        record += [int(self.scores[0]), int(self.scores[1]), int(self.finished), self.round, self.first_seat]
+        record += self.card_game.snapshot() + self.envido.snapshot() + self.truco.snapshot()
+        if out is None:
+            return np.array(record, dtype=np.int16)
+        out[:] = record
+        return out
+
+    def restore(self, record):
+        ''' Return to the state of a snapshot, refilling the players' hands in place.
+        A record can be restored any number of times, to branch several continuations from it.
+        '''
+        values = record.tolist() if isinstance(record, np.ndarray) else list(record)
+        for seat, player in enumerate(self.players):
+            player.set_hand([c for c in values[3 * seat:3 * seat + 3] if c >= 0])
+        self.scores[:] = values[record_game:record_game + 2]
+        self.finished = bool(values[record_game + 2])
+        self.round = values[record_game + 3]
+        self.first_seat = values[record_game + 4]
+        self.card_game.restore(values[record_card_game:record_envido])
+        self.envido.restore(values[record_envido:record_truco])
+        self.truco.restore(values[record_truco:record_size])
+
+    def clone(self):
+        ''' Independent copy of the hand, with new players of the same ids and no event subscribers.
+        Its dealer gets a generator spawned from this game's, which does not advance it.
+        '''
+        game = TrucoGame([Player(p.get_id()) for p in self.players], rng=self.dealer.rng.spawn(1)[0])
+        game.restore(self.snapshot())
+        return game
+
+    @property
+    def first_move_by(self):
+        return self.players[self.first_seat]
+
+    @property
+    def second_move_by(self):
+        return self.players[1 - self.first_seat]
+
+    @property
+    def scoreboard(self):
+        ''' (player, score) pairs.
+        '''
+        return np.array([(p, s) for p, s in zip(self.players, self.scores.tolist())])
+
+    def get_seat(self, player):
+        ''' Index of player in players, -1 for a player not in the game.
+        '''
+        if player is self.players[0]:
+            return 0
+        elif player is self.players[1]:
+            return 1
+        elif player == self.players[0]:
+            return 0
+        elif player == self.players[1]:
+            return 1
+        return -1
 
     def get_state(self, player):
-        started =  1 if player == self.first_move_by else 0
-        mano = 1 if player == self.get_mano() else 0
+        seat = self.get_seat(player)
+        started =  1 if seat == self.first_seat else 0
+        mano = 1 if seat == self.get_mano_seat() else 0
         game_config = np.array([started, mano], dtype=np.int8)
         
         score = []
-        for p, s in self.scoreboard:
-            p_id = 1 if player == p else 0
-            turn = [p_id, s]
+        for s in range(2):
+            p_id = 1 if seat == s else 0
+            turn = [p_id, self.scores[s]]
             score.append(np.array(turn, dtype = np.int8))
         
         score = np.vstack(score)
     
-        # Order cards from highest to lowest rank to reduce potential card space
-        ordered_cards = sorted(player.hand, key=lambda x: x.tier, reverse=True)
-        
-        player_cards = np.array(encode_card_array(ordered_cards), dtype=np.int8)
+        player_cards = encode_card_ids(player.get_hand_ids())
             
         state = {
             'game': game_config,
             'player_cards': player_cards,
             'score': score,
-            'cards_played': self.card_game.get_state(player),
-            'envido_state': self.envido.get_state(player),
-            'truco_state': self.truco.get_state(player)
+            'cards_played': self.card_game.get_state(seat),
+            'envido_state': self.envido.get_state(seat),
+            'truco_state': self.truco.get_state(seat)
             
         }
             
         return state
     
     def get_score(self, player):
-        if self.scoreboard[0][0] == player:
-            return self.scoreboard[0][1]
-        else:
-            return self.scoreboard[1][1]
-        
-        return 0
+        seat = self.get_seat(player)
+        return self.scores[seat] if seat >= 0 else 0
     
+    def get_lead(self, seat):
+        ''' Points of seat minus points of its opponent, 0 for a seat not in the game.
+        '''
+        if seat < 0:
+            return 0
+        return int(self.scores[seat]) - int(self.scores[1 - seat])
+
     def get_winner(self):
         if self.finished:
-            if self.scoreboard[0][1] >= self.scoreboard[1][1]:
-                return self.scoreboard[0][0]
-            else:
-                return self.scoreboard[1][0]
+            return self.players[0] if self.scores[0] >= self.scores[1] else self.players[1]
             
         return None
         
     def get_legal_actions(self, player):
-        if self.get_mano() != player:
+        seat = self.get_seat(player)
+        if self.get_mano_seat() != seat:
             return []
         elif self.envido.is_active():
-            return self.envido.get_legal_actions(player)  + ['fold']
+            return self.envido.get_legal_actions(seat)  + ['fold']
         elif self.truco.is_active():
-            return self.truco.get_legal_actions(player)  + ['fold']
+            return self.truco.get_legal_actions(seat)  + ['fold']
         
         aggregate = ['fold']
         
         if self.round == 0 and not self.truco.is_started():
-            aggregate.extend(self.envido.get_legal_actions(player))
+            aggregate.extend(self.envido.get_legal_actions(seat))
     
-        aggregate.extend(self.truco.get_legal_actions(player))
+        aggregate.extend(self.truco.get_legal_actions(seat))
         
-        return np.hstack((aggregate, self.card_game.get_legal_actions(player)))
+        return np.hstack((aggregate, self.card_game.get_legal_actions(seat)))
+
+    def get_legal_actions_mask(self, player):
+        ''' Legal actions for player as a bool mask aligned with game_actions.
+        '''
+        mask = np.zeros(len(game_actions), dtype=bool)
+        seat = self.get_seat(player)
+        if self.get_mano_seat() != seat:
+            return mask
+
+        mask[fold_action_id] = True
+        if self.envido.is_active():
+            mask[envido_action_ids] |= self.envido.get_legal_actions_mask(seat)
+            return mask
+        elif self.truco.is_active():
+            mask[truco_action_ids] |= self.truco.get_legal_actions_mask(seat)
+            return mask
+
+        if self.round == 0 and not self.truco.is_started():
+            mask[envido_action_ids] |= self.envido.get_legal_actions_mask(seat)
+
+        mask[truco_action_ids] |= self.truco.get_legal_actions_mask(seat)
+
+        if self.card_game.card_next == seat:
+            mask[card_action_offset + player.get_hand_ids()] = True
+
+        return mask
             
     
     def get_cards_played(self):
         return self.card_game.cards_played
 
-    def update_score(self, player, score):
-        if player == self.scoreboard[0][0]:
-            self.scoreboard[0][1] += score
-        else:
-            self.scoreboard[1][1] += score
+    def update_score(self, seat, score, reason='hand'):
+        self.scores[seat] += score
+        if self.events.active:
+            self.events.emit(ScoreUpdate(self.players[seat], score, reason))
         
     def get_opponent(self, player):
         if player == self.players[0]:
@@ -111,45 +244,45 @@ class TrucoGame:
         else:
             return self.players[0]
     
-    def get_mano(self):
+    def get_mano_seat(self):
+        ''' Seat that acts next.
+        '''
         if self.envido.envido_next is not None:
             return self.envido.envido_next
         elif self.truco.truco_next is not None:
             return self.truco.truco_next
         return self.card_game.card_next
+
+    def get_mano(self):
+        return self.players[self.get_mano_seat()]
         
     def finish_hand(self):
         self.finished = True
-        logging.info("Hand finished.")
-        logging.info(f"{self.scoreboard[0][0]} scored {self.scoreboard[0][1]}")
-        logging.info(f"{self.scoreboard[1][0]} scored {self.scoreboard[1][1]}")
+        if self.events.active:
+            self.events.emit(HandFinished(tuple(zip(self.players, self.scores.tolist()))))
     
     def finish_round(self):
         self.round += 1
         
-        first_played = self.card_game.cards_played[-2]
-        second_played = self.card_game.cards_played[-1]
-        comparison = first_played[1].tier - second_played[1].tier
-        if comparison >= 0:
+        first_played = self.card_game.played_ids[2 * self.round - 2]
+        second_played = self.card_game.played_ids[2 * self.round - 1]
+        if card_tier[first_played] >= card_tier[second_played]:
             self.card_game.switch_turn() # switch if second person wins round
-            logging.debug(f"{second_played[0]} won the round playing {str(second_played[1])}. They will start the next one.")
         
         winner = self.card_game.get_winner()
         if winner is not None: 
             if self.truco.is_started():
-                reward = self.truco.get_reward()
-                self.update_score(winner, reward)
-                logging.debug(f"{winner} was rewarded {reward} for winning truco.")
+                self.update_score(winner, self.truco.get_reward(), 'truco')
             else:
                 self.update_score(winner, 1)
-                logging.debug(f"{winner} was rewarded 1 for winning hand.")
             self.finish_hand()
-        else:
-            logging.debug("Round finished")
+        elif self.events.active:
+            self.events.emit(RoundFinished(self.round, self.players[self.card_game.card_next]))
         
     def take_action(self, player, action):
-        if self.get_mano() != player:
-            logging.warning(f"{player}: Can't play out of turn.")
+        seat = self.get_seat(player)
+        if self.get_mano_seat() != seat:
+            logging.warning("%s: Can't play out of turn.", player)
             return 
         
         action_played = game_actions[action] if isinstance(action, numbers.Number) else action
@@ -157,48 +290,42 @@ class TrucoGame:
         if action_played in envido_actions:
             if self.round == 0:
                 if not self.truco.is_started():
-                    self.envido.take_action(player, action_played) 
+                    self.envido.take_action(seat, action_played) 
                 else:
-                    logging.warn(f"{player}: Envido can only be played before Truco.")
+                    logging.warning("%s: Envido can only be played before Truco.", player)
             else:
-                logging.warning(f"{player}: Envido can only be played in the first round")
+                logging.warning("%s: Envido can only be played in the first round", player)
         elif action_played in truco_actions:
             if not self.envido.is_active():
-                self.truco.take_action(player, action_played)
+                self.truco.take_action(seat, action_played)
             else:
-                logging.warning(f"{player} can't call {action_played} unless envido has finished.")
+                logging.warning("%s can't call %s unless envido has finished.", player, action_played)
         elif action_played in response_actions:
             if self.envido.is_active() and self.envido.is_valid_state(action_played):
-                if self.envido.envido_next == player:
-                    self.envido.take_terminal_action(player, action_played) 
+                if self.envido.envido_next == seat:
+                    self.envido.take_terminal_action(seat, action_played) 
                 else:
-                    logging.warning(f"{player} can't call {action_played} envido for others.")
+                    logging.warning("%s can't call %s envido for others.", player, action_played)
             elif self.truco.is_active() and self.truco.is_valid_state(action_played):
-                self.truco.take_terminal_action(player, action_played)
+                self.truco.take_terminal_action(seat, action_played)
             else:
-                logging.warning(f"{player} can't call {action_played} right now.")
-        elif action_played in playable_cards:
+                logging.warning("%s can't call %s right now.", player, action_played)
+        elif action_played in card_ids:
             if not self.envido.is_active():
                 if not self.truco.is_active():
-                    self.card_game.take_action(player, action_played)
+                    self.card_game.take_action(seat, action_played)
                 else:
-                    logging.warning(f"{player} can't play the card {action_played} before responding to truco.")
+                    logging.warning("%s can't play the card %s before responding to truco.", player, action_played)
             else:
-                logging.warning(f"{player} can't play the card {action_played} before responding to envido.")
+                logging.warning("%s can't play the card %s before responding to envido.", player, action_played)
         elif action_played == "fold":
-            logging.info(f"{player} folded.")
+            if self.events.active:
+                self.events.emit(Folded(player))
             if self.envido.is_started():
-                self.envido.fold(player)
+                self.envido.fold(seat)
                 
             if self.truco.is_started():
-                self.truco.fold(player)
+                self.truco.fold(seat)
             else:
-                opponent = self.get_opponent(player)
-                self.update_score(opponent, 1)
-                logging.debug(f"{opponent} was rewarded 1 for winning hand.")
+                self.update_score(1 - seat, 1)
             self.finish_hand()
-
-            
-        
-            
-    
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''
+Strength of every 3-card hand.
+
+There are C(40, 3) = 9880 hands. For each one the table holds, against a random hand of the other 37 cards:
+the probability of winning the card play when going first and when going second, the probability of
+winning envido in each case (the seat that started the hand wins ties), the hand's envido and the
+distribution of the opponent's envido.
+
+Card play is scored under best play with both hands known, as endgame.EndgameSolver solves it. Only the
+tiers of the cards matter to it, so every pair of tier hands is solved once, and every pair of hands that
+do not share a card is then evaluated with array operations.
+
+The table is a structured array saved as .npy, meant to be memory mapped:
+
+    python hand_strength.py --output hand_strength.npy
+
+    from hand_strength import load_hand_strength, hand_index
+    table = load_hand_strength()
+    table[hand_index([0, 12, 27])]['card_win']
+'''
+from timeit import default_timer as timer
+from itertools import combinations
+from math import comb
+import numpy as np
+import argparse
+
+from card import card_names, card_tier
+from envido import envido_table
+
+num_hands = comb(40, 3)
+max_envido = 33
+
+hand_strength_dtype = np.dtype([
+    ('cards', np.int8, 3),
+    ('envido', np.int8),
+    ('card_win', np.float32),           # Mean of the two below
+    ('card_win_first', np.float32),
+    ('card_win_second', np.float32),
+    ('envido_win_first', np.float32),
+    ('envido_win_second', np.float32),
+    ('opponent_envido', np.uint16, max_envido + 1),   # Number of opponent hands with each envido
+])
+
+# Every hand as sorted card ids, in the order of the table
+hand_cards = np.array(list(combinations(range(40), 3)), dtype=np.int8)
+
+# Row of the hand made of any three different cards, in any order
+hand_index_table = np.full((40, 40, 40), -1, dtype=np.int16)
+for i, (a, b, c) in enumerate(hand_cards.tolist()):
+    for order in ((a, b, c), (a, c, b), (b, a, c), (b, c, a), (c, a, b), (c, b, a)):
+        hand_index_table[order] = i
+
+
+def hand_index(card_ids):
+    ''' Table row of a hand, or rows of an (n, 3) array of hands.
+    '''
+    card_ids = np.asarray(card_ids)
+    return hand_index_table[card_ids[..., 0], card_ids[..., 1], card_ids[..., 2]]
+
+
+def solve_tier_hands(tier_hands):
+    ''' 1 where the first tier hand wins the card play against the second when it goes first, 0 otherwise.
+    Returns:
+        int8 array (len(tier_hands), len(tier_hands))
+    '''
+    from endgame import EndgameSolver, no_tier
+
+    solver = EndgameSolver()
+    tier_hands = [tuple(hand) for hand in tier_hands.tolist()]
+    wins = np.zeros((len(tier_hands), len(tier_hands)), dtype=np.int8)
+    for i, first in enumerate(tier_hands):
+        for j, second in enumerate(tier_hands):
+            wins[i, j] = solver.solve_position((), no_tier, (first, second), 0) == 1
+    return wins
+
+
+def build_hand_strength(chunk_size=256):
+    ''' Compute the table.
+    '''
+    table = np.zeros(num_hands, dtype=hand_strength_dtype)
+    table['cards'] = hand_cards
+    envidos = envido_table[hand_cards[:, 0], hand_cards[:, 1], hand_cards[:, 2]].astype(np.intp)
+    table['envido'] = envidos
+
+    # Card play only depends on the tiers of the cards, sorted from highest
+    tiers = -np.sort(-card_tier[hand_cards], axis=1)
+    tier_hands, tier_ids = np.unique(tiers, axis=0, return_inverse=True)
+    wins = solve_tier_hands(tier_hands)
+
+    masks = (np.uint64(1) << hand_cards.astype(np.uint64)).sum(axis=1, dtype=np.uint64)
+    for start in range(0, num_hands, chunk_size):
+        rows = slice(start, min(start + chunk_size, num_hands))
+        count = rows.stop - rows.start
+        # Opponent hands that do not share a card with the hand
+        valid = (masks[rows, None] & masks[None, :]) == 0
+        opponents = valid.sum(axis=1)
+
+        first_wins = wins[tier_ids[rows, None], tier_ids[None, :]]
+        second_wins = 1 - wins[tier_ids[None, :], tier_ids[rows, None]]
+        table['card_win_first'][rows] = (first_wins * valid).sum(axis=1) / opponents
+        table['card_win_second'][rows] = (second_wins * valid).sum(axis=1) / opponents
+
+        own, other = envidos[rows, None], envidos[None, :]
+        table['envido_win_first'][rows] = ((own >= other) & valid).sum(axis=1) / opponents
+        table['envido_win_second'][rows] = ((own > other) & valid).sum(axis=1) / opponents
+
+        bins = np.arange(count)[:, None] * (max_envido + 1) + other
+        histogram = np.bincount(bins[valid], minlength=count * (max_envido + 1))
+        table['opponent_envido'][rows] = histogram.reshape(count, max_envido + 1)
+
+    table['card_win'] = (table['card_win_first'] + table['card_win_second']) / 2
+    return table
+
+
+def load_hand_strength(path='hand_strength.npy'):
+    ''' The table saved by this module, memory mapped.
+    '''
+    return np.load(path, mmap_mode='r')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the hand strength table.")
+    parser.add_argument('--output', default='hand_strength.npy')
+    parser.add_argument('--show', type=int, default=10, help="Print the strongest and weakest hands.")
+    args = parser.parse_args()
+
+    start = timer()
+    table = build_hand_strength()
+    np.save(args.output, table)
+    print(f"{num_hands} hands in {timer() - start:.1f}s, {table.nbytes / 1024:.0f} KiB written to {args.output}")
+
+    order = np.argsort(-table['card_win'])
+    for name, rows in (('Strongest', order[:args.show]), ('Weakest', order[-args.show:])):
+        print(f"\n{name}:")
+        for row in table[rows]:
+            cards = ' '.join(card_names[c] for c in row['cards'])
+            print(f"{cards:<12} card play {row['card_win']:.3f} (first {row['card_win_first']:.3f}, second {row['card_win_second']:.3f})"
+                  f" | envido {row['envido']:>2} wins {row['envido_win_first']:.3f} / {row['envido_win_second']:.3f}")
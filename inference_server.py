@@ -0,0 +1,225 @@
+'''
+Batched inference for agents playing many games at once.
+
+Games submit decision requests (legal actions and game state) for an agent. The server gathers pending
+requests until max_batch_size of them are waiting or the oldest one has waited max_wait seconds, then runs
+a single epsilon-greedy forward pass per agent with Agent.choose_actions and hands the actions back.
+
+Clients in the same process use InferenceClient. Worker processes use RemoteInferenceClient, created
+before the worker is started with InferenceServer.create_remote_client.
+
+An error while answering a batch, or stopping the server with requests still queued, is raised to the
+clients waiting on those requests, and the server keeps answering the others.
+'''
+from agent import get_legal_actions_mask
+from concurrent.futures import Future
+from queue import Queue, Empty
+from timeit import default_timer as timer
+import multiprocessing as mp
+import numpy as np
+import threading
+import pickle
+
+
+class InferenceServer:
+
+    def __init__(self, agents, max_batch_size=256, max_wait=0.002, start_method=None):
+        '''
+        Args:
+            agents: agents to serve, by name. Anything with choose_actions(legal_masks, game_states)
+            max_batch_size: most requests answered by one forward pass
+            max_wait: seconds a request can wait for others to join its batch
+        '''
+        self.agents = {agent.get_name(): agent for agent in agents}
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests = Queue()
+        self.ctx = mp.get_context(start_method)
+        self.remote_requests = None
+        self.remote_responses = []
+
+        # Held while running a forward pass, so weights can be updated safely between batches
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = []
+
+        self.batches = 0
+        self.decisions = 0
+
+    def check_name(self, name):
+        if name not in self.agents:
+            raise KeyError(f"No agent named {name!r} is served.")
+
+    def submit(self, name, legal_actions, game_state):
+        ''' Queue a decision for agent name.
+        Returns:
+            Future resolved with the chosen action index, or with the error raised while choosing it
+        '''
+        self.check_name(name)
+        future = Future()
+        self.requests.put((name, get_legal_actions_mask(legal_actions), game_state, future))
+        return future
+
+    def choose_action(self, name, legal_actions, game_state):
+        return self.submit(name, legal_actions, game_state).result()
+
+    def get_client(self, name):
+        return InferenceClient(self, name)
+
+    def create_remote_client(self, name):
+        ''' Client for a worker process. Must be created before the worker starts.
+        '''
+        self.check_name(name)
+        if self.remote_requests is None:
+            self.remote_requests = self.ctx.Queue()
+        responses = self.ctx.Queue()
+        self.remote_responses.append(responses)
+        return RemoteInferenceClient(name, len(self.remote_responses) - 1, self.remote_requests, responses)
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._serve, daemon=True)]
+        if self.remote_requests is not None:
+            self.threads.append(threading.Thread(target=self._forward_remote, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        ''' Stop the server threads, failing the requests that were not answered.
+        '''
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+        error = RuntimeError("The inference server was stopped before answering.")
+        while self.remote_requests is not None:
+            try:
+                client_id, name, legal_mask, game_state = self.remote_requests.get_nowait()
+            except Empty:
+                break
+            RemoteReply(self.remote_responses[client_id]).set_exception(error)
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except Empty:
+                break
+            request[3].set_exception(error)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _forward_remote(self):
+        while self.running:
+            try:
+                client_id, name, legal_mask, game_state = self.remote_requests.get(timeout=0.1)
+            except Empty:
+                continue
+            self.requests.put((name, legal_mask, game_state, RemoteReply(self.remote_responses[client_id])))
+
+    def _collect(self):
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except Empty:
+            return []
+
+        deadline = timer() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - timer()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while self.running:
+            batch = self._collect()
+            if batch:
+                self.process(batch)
+
+    def process(self, batch):
+        ''' Answer a list of (name, legal_mask, game_state, reply) requests, where reply is a Future or a
+        RemoteReply. A batch that fails is answered with its error.
+        '''
+        by_agent = {}
+        for request in batch:
+            by_agent.setdefault(request[0], []).append(request)
+
+        with self.lock:
+            for name, requests in by_agent.items():
+                try:
+                    legal_masks = np.stack([r[1] for r in requests])
+                    game_states = np.stack([r[2] for r in requests])
+                    actions = self.agents[name].choose_actions(legal_masks, game_states)
+                except Exception as e:
+                    for request in requests:
+                        request[3].set_exception(e)
+                    continue
+                for request, action in zip(requests, actions):
+                    request[3].set_result(int(action))
+                self.batches += 1
+                self.decisions += len(requests)
+
+
+class RemoteReply:
+    '''
+    Answers a request from a RemoteInferenceClient through its response queue, like a Future.
+    '''
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def set_result(self, action):
+        self.responses.put(action)
+
+    def set_exception(self, error):
+        # The queue pickles in a background thread, where an error that cannot be pickled would be lost
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(repr(error))
+        self.responses.put(error)
+
+
+class InferenceClient:
+    '''
+    Stands in for an agent in a game loop, forwarding its decisions to an InferenceServer.
+    '''
+
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+
+    def choose_action(self, legal_actions, game_state):
+        return self.server.choose_action(self.name, legal_actions, game_state)
+
+    def get_name(self):
+        return self.name
+
+
+class RemoteInferenceClient:
+    '''
+    InferenceClient for another process, talking to the server through multiprocessing queues.
+    '''
+
+    def __init__(self, name, client_id, requests, responses):
+        self.name = name
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+
+    def choose_action(self, legal_actions, game_state):
+        self.requests.put((self.client_id, self.name, get_legal_actions_mask(legal_actions), np.asarray(game_state)))
+        response = self.responses.get()
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+    def get_name(self):
+        return self.name
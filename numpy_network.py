@@ -0,0 +1,192 @@
+'''
+Inference-only NumPy copies of the DQN networks.
+
+For one state, or a handful, the PyTorch modules spend most of their time in framework overhead rather
+than in the 339x256x128(x64) matrix products. NumpyDQNetwork holds the same weights as plain arrays and
+runs the MLP directly in float32. The int8 mode only emulates int8 weights and activations, to measure
+what quantization does to the Q values: it runs on float32 copies of the weights, so it saves no memory
+and is slower than float32.
+
+    python numpy_network.py Coors Fede
+    python numpy_network.py Coors Fede --check
+
+reports the numerical drift and the per-state latency of each saved agent against its torch network.
+With --check it exits with an error when the drift of either mode exceeds its tolerance.
+'''
+from torch import nn
+from timeit import default_timer as timer
+import numpy as np
+import argparse
+
+activations = {
+    nn.Tanh: np.tanh,
+    nn.ReLU: lambda x, out=None: np.maximum(x, 0, out=out),
+    nn.LeakyReLU: lambda x, out=None: np.maximum(x, 0.01 * x, out=out),
+}
+
+# Activations of the hidden layers are quantized over [-1, 1], the range of Tanh
+activation_scale = 1 / 127
+
+# Largest drift --check accepts, relative to the largest absolute Q value of the torch network
+float32_tolerance = 1e-5
+int8_tolerance = 1e-2
+
+
+class NumpyDQNetwork:
+
+    def __init__(self, weights, biases, activation=np.tanh, quantize=False):
+        '''
+        Args:
+            weights: list of (in, out) float arrays, one per Linear layer
+            biases: list of (out,) float arrays
+            activation: applied after every layer but the last
+            quantize: emulate int8 weights, with one scale per output unit, and int8 hidden activations over
+                      [-1, 1]. Inputs must be small integers, as encoded game states are. The integer products
+                      are run on float32 copies, which is exact since every sum stays below 2 ** 24. This is
+                      for measuring accuracy only: it keeps float32 weights and runs slower than float32.
+        '''
+        self.activation = activation
+        self.quantize = quantize
+        self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+
+        if quantize:
+            self.scales = [np.maximum(np.abs(w).max(axis=0), 1e-12) / 127 for w in weights]
+            self.quantized_weights = [np.round(w / s).astype(np.int8) for w, s in zip(weights, self.scales)]
+            self.weights = [w.astype(np.float32) for w in self.quantized_weights]
+            self.scales = [s.astype(np.float32) for s in self.scales]
+        else:
+            self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+
+        # Reused outputs for single states
+        self.buffers = [np.empty(b.shape[0], dtype=np.float32) for b in self.biases]
+
+    @classmethod
+    def from_torch(cls, net, quantize=False):
+        ''' Export a LessDQNetwork or VeryDQNetwork.
+        '''
+        weights, biases, activation = [], [], np.tanh
+        for module in net.net:
+            if isinstance(module, nn.Linear):
+                weights.append(module.weight.detach().cpu().numpy().T)
+                biases.append(module.bias.detach().cpu().numpy())
+            elif type(module) in activations:
+                activation = activations[type(module)]
+            else:
+                raise ValueError(f"Can't export {module} to NumPy.")
+        return cls(weights, biases, activation=activation, quantize=quantize)
+
+    def _forward_float(self, x, single):
+        last = len(self.weights) - 1
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            if single:
+                x = np.dot(x, w, out=self.buffers[i])
+                x += b
+            else:
+                x = x @ w
+                x += b
+            if i < last:
+                self.activation(x, out=x)
+        return x
+
+    def _forward_quantized(self, x):
+        last = len(self.weights) - 1
+        # Encoded game states are integers already
+        x_q = np.rint(x)
+        x_scale = 1.0
+        for i, (w, b, s) in enumerate(zip(self.weights, self.biases, self.scales)):
+            x = x_q @ w
+            x *= s * x_scale
+            x += b
+            if i < last:
+                self.activation(x, out=x)
+                x_q = np.rint(x * 127)
+                x_scale = activation_scale
+        return x
+
+    def forward(self, game_states):
+        ''' Q values of one state (state_space_dim,) or a batch (n, state_space_dim).
+        '''
+        game_states = np.asarray(game_states, dtype=np.float32)
+        if self.quantize:
+            return self._forward_quantized(game_states)
+        return self._forward_float(game_states, game_states.ndim == 1).copy()
+
+    __call__ = forward
+
+    def act(self, game_state):
+        return self.forward(game_state)
+
+
+def parity_error(net, numpy_net, game_states, relative=False):
+    ''' Largest absolute difference between the Q values of net and numpy_net over game_states, divided by
+    the largest absolute Q value of net when relative.
+    '''
+    import torch as T
+    with T.no_grad():
+        expected = net(T.as_tensor(np.asarray(game_states, dtype=np.float32))).cpu().numpy()
+    error = float(np.abs(numpy_net(game_states) - expected).max())
+    if relative:
+        error /= max(float(np.abs(expected).max()), 1e-12)
+    return error
+
+
+def sample_game_states(count, seed=0):
+    ''' Encoded states from games played with random legal actions.
+    '''
+    from environment import TrucoEnvironment
+    from player import Player
+    import random
+
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    env = TrucoEnvironment([Player(0), Player(1)], legal_actions_mask=True)
+    player, legal_mask, game_state = env.reset()
+    game_states = [game_state]
+    while len(game_states) < count:
+        action = rng.choice(np.flatnonzero(legal_mask))
+        reward, done, player, legal_mask, game_state = env.step(player, action)
+        if done:
+            player, legal_mask, game_state = env.reset()
+        game_states.append(game_state)
+    return np.stack(game_states)
+
+
+if __name__ == '__main__':
+    import torch as T
+    from agent import load_agent
+
+    parser = argparse.ArgumentParser(description="Compare NumPy inference against the torch networks of saved agents.")
+    parser.add_argument('names', nargs='+')
+    parser.add_argument('--states', type=int, default=2000)
+    parser.add_argument('--check', action='store_true', help=f"Fail when the relative drift exceeds {float32_tolerance:g} (float32) or {int8_tolerance:g} (int8).")
+    args = parser.parse_args()
+
+    game_states = sample_game_states(args.states)
+    failures = []
+    for name in args.names:
+        agent = load_agent(name, T.device('cpu'))
+        net = agent.online_net
+        for quantize in (False, True):
+            numpy_net = NumpyDQNetwork.from_torch(net, quantize=quantize)
+
+            start = timer()
+            for state in game_states:
+                numpy_net.act(state)
+            numpy_time = (timer() - start) / len(game_states)
+
+            start = timer()
+            with T.no_grad():
+                for state in game_states:
+                    net.act(T.as_tensor(state))
+            torch_time = (timer() - start) / len(game_states)
+
+            mode = 'int8' if quantize else 'float32'
+            drift = parity_error(net, numpy_net, game_states)
+            relative_drift = parity_error(net, numpy_net, game_states, relative=True)
+            print(f"{name} | {mode} | Max drift: {drift:.2e} ({relative_drift:.1e} relative) | NumPy: {numpy_time * 1e6:.1f}us | Torch: {torch_time * 1e6:.1f}us")
+            if relative_drift > (int8_tolerance if quantize else float32_tolerance):
+                failures.append(f"{name} {mode}")
+
+    if args.check:
+        print(f"Drift over tolerance: {', '.join(failures)}" if failures else "Every drift within tolerance.")
+        raise SystemExit(1 if failures else 0)
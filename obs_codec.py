@@ -0,0 +1,92 @@
+import numpy as np
+
+from encoder import state_space_dim, score_offset, envidos_offset
+
+# Scores and envidos are small integers, every other feature of an encoded game state is 0 or 1
+integer_features = np.array([score_offset + 1, score_offset + 3, envidos_offset, envidos_offset + 1])
+binary_features = np.setdiff1d(np.arange(state_space_dim), integer_features)
+
+packed_binary_size = (len(binary_features) + 7) // 8
+packed_obs_size = packed_binary_size + len(integer_features)
+
+
+def pack_observations(observations):
+    ''' Compress encoded game states: binary features are bit-packed, integer features stored as int8.
+    Args:
+        observations: float array (n, state_space_dim) or a single state
+    Returns:
+        uint8 array (n, packed_obs_size), or (packed_obs_size,) for a single state
+    '''
+    observations = np.asarray(observations)
+    single = observations.ndim == 1
+    observations = np.atleast_2d(observations)
+
+    packed = np.empty((observations.shape[0], packed_obs_size), dtype=np.uint8)
+    packed[:, :packed_binary_size] = np.packbits(observations[:, binary_features] != 0, axis=1)
+    packed[:, packed_binary_size:] = observations[:, integer_features].astype(np.int8).view(np.uint8)
+    return packed[0] if single else packed
+
+
+def unpack_observations(packed, out=None):
+    ''' Inverse of pack_observations.
+    Args:
+        packed: uint8 array (n, packed_obs_size) or a single packed state
+        out: optional float32 array to decode into
+    '''
+    packed = np.asarray(packed)
+    single = packed.ndim == 1
+    packed = np.atleast_2d(packed)
+
+    if out is None:
+        out = np.empty((packed.shape[0], state_space_dim), dtype=np.float32)
+    target = out[np.newaxis] if out.ndim == 1 else out
+    target[:, binary_features] = np.unpackbits(packed[:, :packed_binary_size], axis=1, count=len(binary_features))
+    target[:, integer_features] = packed[:, packed_binary_size:].view(np.int8)
+    return out[0] if single and out.ndim == 2 else out
+
+
+def pack_masks(masks):
+    return np.packbits(np.asarray(masks, dtype=bool), axis=-1)
+
+
+def unpack_masks(packed, action_space_dim, out=None):
+    unpacked = np.unpackbits(packed, axis=-1, count=action_space_dim).view(bool)
+    if out is None:
+        return unpacked
+    out[:] = unpacked
+    return out
+
+
+def save_transitions(path, observations, actions, rewards, dones, new_observations, legal_masks=None):
+    ''' Write transitions to an .npz file with packed observations.
+    '''
+    arrays = {
+        'observations': pack_observations(observations),
+        'actions': np.asarray(actions, dtype=np.int64),
+        'rewards': np.asarray(rewards, dtype=np.float32),
+        'dones': np.asarray(dones, dtype=np.float32),
+        'new_observations': pack_observations(new_observations),
+    }
+    if legal_masks is not None:
+        arrays['legal_masks'] = pack_masks(legal_masks)
+        arrays['action_space_dim'] = np.asarray(np.shape(legal_masks)[-1])
+    np.savez(path, **arrays)
+
+
+def load_transitions(path):
+    ''' Read transitions written by save_transitions.
+    Returns:
+        observations, actions, rewards, dones, new observations, legal masks (None if not saved)
+    '''
+    with np.load(path) as data:
+        legal_masks = None
+        if 'legal_masks' in data:
+            legal_masks = unpack_masks(data['legal_masks'], int(data['action_space_dim']))
+        return (
+            unpack_observations(data['observations']),
+            data['actions'],
+            data['rewards'],
+            data['dones'],
+            unpack_observations(data['new_observations']),
+            legal_masks
+        )
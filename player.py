@@ -1,16 +1,64 @@
+from card import Card, card_table
+import numpy as np
+
+# Most cards a player holds
+hand_capacity = 3
+
+
 class Player:
-    
+
     def __init__(self, player_id):
         ''' Initilize a player.
         Args:
             player_id (int): The id of the player
         '''
         self.player_id = player_id
-        self.hand = []
-        
+        # Ids of the cards in hand in the order they were dealt, the first hand_size are valid
+        self.hand_ids = np.full(hand_capacity, -1, dtype=np.intp)
+        self.hand_size = 0
+
+    @property
+    def hand(self):
+        ''' Cards in hand as Card objects, built from hand_ids. Changing the list does not change the hand.
+        '''
+        return [card_table[c] for c in self.hand_ids[:self.hand_size].tolist()]
+
+    @hand.setter
+    def hand(self, cards):
+        self.set_hand([c.id if isinstance(c, Card) else c for c in cards])
+
+    def get_hand_ids(self):
+        ''' Ids of the cards in hand, as a view of hand_ids.
+        '''
+        return self.hand_ids[:self.hand_size]
+
+    def set_hand(self, card_ids):
+        self.hand_ids[:len(card_ids)] = card_ids
+        self.hand_size = len(card_ids)
+
+    def clear_hand(self):
+        self.hand_size = 0
+
+    def add_cards(self, card_ids):
+        self.hand_ids[self.hand_size:self.hand_size + len(card_ids)] = card_ids
+        self.hand_size += len(card_ids)
+
+    def remove_card(self, card_id):
+        ''' Take card_id out of the hand, keeping the order of the others.
+        Returns:
+            False when the card is not in hand
+        '''
+        ids = self.hand_ids[:self.hand_size].tolist()
+        if card_id not in ids:
+            return False
+        i = ids.index(card_id)
+        self.hand_ids[i:self.hand_size - 1] = self.hand_ids[i + 1:self.hand_size]
+        self.hand_size -= 1
+        return True
+
     def __str__(self):
         return f"Player {self.player_id} | Cards: {[str(c) for c in self.hand]}"
-    
+
     def __eq__(self, other):
         if isinstance(other, Player):
             return self.get_id() == other.get_id()
@@ -20,4 +68,4 @@ class Player:
         ''' Return the id of the player
         '''
 
-        return self.player_id
\ No newline at end of file
+        return self.player_id
@@ -0,0 +1,201 @@
+'''
+Per-phase timing of training.
+
+The environment, the agents and the self-play trainer time their phases (env stepping, observation
+encoding, action selection, replay sampling, forward and backward passes, target network syncs, ...)
+through the module-level profiler. It is off by default, and a disabled phase costs one attribute check.
+
+    from profiler import profiler
+    profiler.enable()
+    profiler.start_dumps('stats.csv', every=30)
+    profiler.capture(after_steps=100000, steps=5000, path='capture')
+
+Phases nest, so a phase's percentage includes its sub-phases ('learn' includes 'learn.backward').
+'''
+from collections import defaultdict, Counter
+from timeit import default_timer as timer
+from pathlib import Path
+import cProfile
+import tracemalloc
+import datetime
+import signal
+import json
+import csv
+
+
+class Phase:
+    '''
+    Context manager adding the time spent inside it to a phase of its Profiler.
+    '''
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.start = timer()
+        return self
+
+    def __exit__(self, *args):
+        if self.start is not None:
+            self.profiler.add_time(self.name, timer() - self.start)
+            self.start = None
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.dump_path = None
+        self.dump_every = None
+        self.pending_capture = None
+        self.cprofile = None
+        self.total_steps = 0
+        self.reset()
+
+    def reset(self):
+        ''' Start a new interval of measurements.
+        '''
+        self.times = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+        self.steps = 0
+        self.interval_start = timer()
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self.reset()
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self, *args):
+        self.disable() if self.enabled else self.enable()
+
+    def toggle_on_signal(self, signum=signal.SIGUSR1):
+        ''' Enable or disable the profiler whenever the process receives signum.
+        '''
+        signal.signal(signum, self.toggle)
+
+    def phase(self, name):
+        ''' Context manager timing name. Phases are cached, so instrumented code can hold on to them.
+        '''
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+        return self.phases[name]
+
+    def add_time(self, name, seconds):
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def step(self, amount=1):
+        ''' Count training steps, which drive throughput, periodic dumps and the capture window.
+        '''
+        if not self.enabled:
+            return
+        self.steps += amount
+        self.total_steps += amount
+        if self.pending_capture is not None or self.cprofile is not None:
+            self.check_capture()
+        if self.dump_path is not None and timer() - self.interval_start >= self.dump_every:
+            self.dump(self.dump_path)
+            self.reset()
+
+    def summary(self):
+        ''' Statistics of the current interval.
+        Returns:
+            dict with elapsed seconds, steps, steps per second, counters and, per phase, total seconds,
+            calls, mean microseconds per call and percentage of the interval
+        '''
+        elapsed = max(timer() - self.interval_start, 1e-9)
+        phases = {
+            name: {
+                'seconds': seconds,
+                'calls': self.calls[name],
+                'mean_us': seconds / self.calls[name] * 1e6,
+                'percent': 100 * seconds / elapsed,
+            }
+            for name, seconds in sorted(self.times.items())
+        }
+        return {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'elapsed': elapsed,
+            'steps': self.steps,
+            'steps_per_s': self.steps / elapsed,
+            'counters': dict(self.counters),
+            'phases': phases,
+        }
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"Steps: {summary['steps']} ({summary['steps_per_s']:.0f}/s) | Elapsed: {summary['elapsed']:.1f}s"]
+        for name, phase in summary['phases'].items():
+            lines.append(f"{name:<28} {phase['percent']:>6.1f}% {phase['mean_us']:>10.1f}us x {phase['calls']}")
+        for name, count in summary['counters'].items():
+            lines.append(f"{name:<28} {count}")
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        ''' Append the current interval to path: one row per phase for .csv files, one JSON object per
+        line otherwise.
+        '''
+        summary = self.summary()
+        path = Path(path)
+        if path.suffix == '.csv':
+            header = not path.exists()
+            with path.open('a', newline='') as f:
+                writer = csv.writer(f)
+                if header:
+                    writer.writerow(['time', 'elapsed', 'steps', 'steps_per_s', 'phase', 'seconds', 'calls', 'mean_us', 'percent'])
+                for name, phase in summary['phases'].items():
+                    writer.writerow([summary['time'], summary['elapsed'], summary['steps'], summary['steps_per_s'], name, phase['seconds'], phase['calls'], phase['mean_us'], phase['percent']])
+                for name, count in summary['counters'].items():
+                    writer.writerow([summary['time'], summary['elapsed'], summary['steps'], summary['steps_per_s'], name, '', count, '', ''])
+        else:
+            with path.open('a') as f:
+                f.write(json.dumps(summary) + '\n')
+
+    def start_dumps(self, path, every=30):
+        ''' Dump to path every `every` seconds, checked on each step.
+        '''
+        self.dump_path = path
+        self.dump_every = every
+
+    def capture(self, after_steps, steps, path, memory=False):
+        ''' Run cProfile, and tracemalloc when memory is set, from step after_steps for steps steps.
+        Writes path.prof (cProfile stats) and path.mem.txt (top allocations).
+        '''
+        self.pending_capture = (self.total_steps + after_steps, steps, path, memory)
+
+    def check_capture(self):
+        if self.pending_capture is not None:
+            start, steps, path, memory = self.pending_capture
+            if self.total_steps >= start:
+                self.pending_capture = None
+                self.capture_end = self.total_steps + steps
+                self.capture_path = path
+                self.capture_memory = memory
+                if memory:
+                    tracemalloc.start()
+                self.cprofile = cProfile.Profile()
+                self.cprofile.enable()
+        elif self.total_steps >= self.capture_end:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(f"{self.capture_path}.prof")
+            self.cprofile = None
+            if self.capture_memory:
+                top = tracemalloc.take_snapshot().statistics('lineno')[:50]
+                tracemalloc.stop()
+                Path(f"{self.capture_path}.mem.txt").write_text('\n'.join(str(s) for s in top) + '\n')
+
+
+profiler = Profiler()
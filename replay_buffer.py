@@ -0,0 +1,307 @@
+import numpy as np
+import argparse
+
+from obs_codec import packed_obs_size, pack_observations, unpack_observations, pack_masks, unpack_masks
+
+
+class ReplayBuffer:
+    '''
+    Replay memory backed by preallocated NumPy arrays.
+
+    Transitions are (game_state, action, reward, done, new_game_state) tuples, optionally followed by the
+    legal actions mask of new_game_state. Observations take one row per transition, in the same ring as the
+    transitions. A new_game_state that the next transition starts from (consecutive moves of one player)
+    points at that transition's row; any other one, e.g. a terminal state or the opponent's view, takes a
+    row of a separate ring of next_capacity rows. With the default next_capacity of maxlen the buffer always
+    holds maxlen transitions once full. A smaller ring saves memory, but reusing one of its rows evicts the
+    transition still pointing at it, together with every older one, so when few next states are shared (as
+    in self-play, where the next state is the opponent's view) the buffer then holds about next_capacity
+    transitions.
+    With compress, observations and masks are kept bit-packed (see obs_codec) and decoded when sampled.
+    '''
+
+    def __init__(self, maxlen, state_space_dim, action_space_dim, compress=False, next_capacity=None):
+        '''
+        Args:
+            next_capacity: rows for next states not shared with the next transition, maxlen by default
+        '''
+        self.maxlen = maxlen
+        self.state_space_dim = state_space_dim
+        self.action_space_dim = action_space_dim
+        self.compress = compress
+        self.next_capacity = maxlen if next_capacity is None else next_capacity
+        self.size = 0
+        self.position = 0
+
+        # Rows [0, maxlen) hold the state of the transition at the same index, the rest are the next state ring
+        self.obs_capacity = maxlen + self.next_capacity
+        if compress:
+            self.observations = np.zeros((self.obs_capacity, packed_obs_size), dtype=np.uint8)
+            self.legal_masks = np.tile(pack_masks(np.ones(action_space_dim, dtype=bool)), (self.obs_capacity, 1))
+        else:
+            self.observations = np.zeros((self.obs_capacity, state_space_dim), dtype=np.float32)
+            self.legal_masks = np.ones((self.obs_capacity, action_space_dim), dtype=bool)
+        self.all_legal = self.legal_masks[0].copy()
+
+        # Next row of the next state ring to write, and the transition each row was written for
+        self.next_position = 0
+        self.next_owners = np.full(self.next_capacity, -1, dtype=np.int32)
+        # Whether the next state of the last transition is still waiting at next_position to be shared
+        self.next_pending = False
+
+        self.new_obs_index = np.full(maxlen, -1, dtype=np.int32)
+        self.actions = np.zeros(maxlen, dtype=np.int16)
+        self.rewards = np.zeros(maxlen, dtype=np.float32)
+        self.dones = np.zeros(maxlen, dtype=np.float32)
+
+        self.batch = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def start(self):
+        ''' Index of the oldest transition.
+        '''
+        return (self.position - self.size) % self.maxlen
+
+    def _evict(self, count):
+        ''' Drop the count oldest transitions.
+        '''
+        self.size -= count
+
+    def append(self, transition):
+        game_state, action, reward, done, new_game_state = transition[:5]
+        legal_mask = transition[5] if len(transition) > 5 else None
+        if self.compress:
+            game_state = pack_observations(game_state)
+            new_game_state = pack_observations(new_game_state)
+            legal_mask = None if legal_mask is None else pack_masks(legal_mask)
+
+        i = self.position
+        if self.size == self.maxlen:
+            self._evict(1)
+
+        pending = self.maxlen + self.next_position
+        if self.next_pending:
+            last = (i - 1) % self.maxlen
+            if self.size > 0 and np.array_equal(self.observations[pending], game_state):
+                # The last transition ended where this one starts, its next state row is freed
+                self.new_obs_index[last] = i
+                self.legal_masks[i] = self.legal_masks[pending]
+            else:
+                self.next_position = (self.next_position + 1) % self.next_capacity
+                pending = self.maxlen + self.next_position
+
+        self.observations[i] = game_state
+        self.new_obs_index[i] = -1
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.position = (i + 1) % self.maxlen
+        self.size += 1
+
+        owner = self.next_owners[self.next_position]
+        if owner >= 0 and self.new_obs_index[owner] == pending and (owner - self.start) % self.maxlen < self.size:
+            self._evict((owner - self.start) % self.maxlen + 1)
+        self.observations[pending] = new_game_state
+        self.legal_masks[pending] = self.all_legal if legal_mask is None else legal_mask
+        self.next_owners[self.next_position] = i
+        self.new_obs_index[i] = pending
+        self.next_pending = True
+
+    def _get_batch(self, batch_size):
+        if self.batch is None or self.batch[0].shape[0] != batch_size:
+            self.batch = (
+                np.empty((batch_size, self.state_space_dim), dtype=np.float32),
+                np.empty(batch_size, dtype=np.int64),
+                np.empty(batch_size, dtype=np.float32),
+                np.empty(batch_size, dtype=np.float32),
+                np.empty((batch_size, self.state_space_dim), dtype=np.float32),
+                np.empty((batch_size, self.action_space_dim), dtype=bool)
+            )
+        return self.batch
+
+    def sample_indices(self, batch_size):
+        # Sampled with replacement, which is O(batch_size) regardless of the buffer size
+        return (self.start + np.random.randint(0, self.size, size=batch_size)) % self.maxlen
+
+    def gather(self, indices):
+        ''' Copy the transitions at indices into the reused batch arrays.
+        Returns:
+            observations, actions, rewards, dones, new observations, new legal masks
+        '''
+        obs, actions, rewards, dones, new_obs, new_masks = self._get_batch(len(indices))
+        new_obs_slots = self.new_obs_index[indices]
+        actions[:] = self.actions[indices]
+        np.take(self.rewards, indices, out=rewards)
+        np.take(self.dones, indices, out=dones)
+        if self.compress:
+            unpack_observations(self.observations[indices], out=obs)
+            unpack_observations(self.observations[new_obs_slots], out=new_obs)
+            unpack_masks(self.legal_masks[new_obs_slots], self.action_space_dim, out=new_masks)
+        else:
+            np.take(self.observations, indices, axis=0, out=obs)
+            np.take(self.observations, new_obs_slots, axis=0, out=new_obs)
+            np.take(self.legal_masks, new_obs_slots, axis=0, out=new_masks)
+        return obs, actions, rewards, dones, new_obs, new_masks
+
+    def sample(self, batch_size):
+        return self.gather(self.sample_indices(batch_size))
+
+    @property
+    def nbytes(self):
+        ''' Memory held by the buffer, in bytes.
+        '''
+        arrays = [self.observations, self.legal_masks, self.next_owners, self.new_obs_index, self.actions, self.rewards, self.dones]
+        if self.batch is not None:
+            arrays.extend(self.batch)
+        return sum(a.nbytes for a in arrays)
+
+
+class SumTree:
+    '''
+    Binary tree stored in an array where each node holds the sum of its children.
+    Leaves are the priorities of the replay slots. Updates and prefix-sum searches are O(log n) per
+    item and are done for a whole batch at once.
+    '''
+
+    def __init__(self, capacity):
+        self.leaf_offset = 1
+        while self.leaf_offset < capacity:
+            self.leaf_offset *= 2
+        self.depth = self.leaf_offset.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaf_offset, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[indices + self.leaf_offset]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.leaf_offset
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        ''' Index of the leaf where each cumulative value falls.
+        '''
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = values > left_sums
+            values -= np.where(go_right, left_sums, 0)
+            nodes = left + go_right
+        return nodes - self.leaf_offset
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''
+    ReplayBuffer that samples transitions proportionally to priority ** alpha, where the priority is
+    the absolute TD error last measured for them. New transitions get the highest priority seen so far.
+    Importance sampling weights correct the bias, with beta annealed from beta_start to 1 over beta_steps
+    sampled batches.
+    '''
+
+    def __init__(self, maxlen, state_space_dim, action_space_dim, compress=False, next_capacity=None, alpha=0.6, beta_start=0.4, beta_steps=1000000, epsilon=1e-6):
+        super().__init__(maxlen, state_space_dim, action_space_dim, compress=compress, next_capacity=next_capacity)
+        self.alpha = alpha
+        self.beta_start = beta_start
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.tree = SumTree(maxlen)
+        self.max_priority = 1.0
+        self.samples_taken = 0
+
+    @property
+    def beta(self):
+        return min(1.0, self.beta_start + (1.0 - self.beta_start) * self.samples_taken / self.beta_steps)
+
+    def _evict(self, count):
+        # Evicted transitions can no longer be sampled
+        self.tree.update((self.start + np.arange(count)) % self.maxlen, np.zeros(count))
+        super()._evict(count)
+
+    def append(self, transition):
+        i = self.position
+        super().append(transition)
+        self.tree.update([i], [self.max_priority])
+
+    def sample_prioritized(self, batch_size):
+        ''' Sample indices proportionally to priority, one per equal slice of the total priority.
+        Returns:
+            indices, importance sampling weights (float32, normalized to a max of 1)
+        '''
+        total = self.tree.total
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        indices = self.tree.find(values)
+        # Rounding can land a value on an empty leaf, use the newest transition instead
+        empty = (indices >= self.maxlen) | ((indices - self.start) % self.maxlen >= self.size)
+        indices[empty] = (self.position - 1) % self.maxlen
+
+        # Keep the weight of a leaf rounded down to 0 finite
+        probabilities = np.maximum(self.tree.get(indices), self.epsilon ** self.alpha) / total
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.samples_taken += 1
+
+        return indices, weights.astype(np.float32)
+
+    def sample(self, batch_size):
+        indices, weights = self.sample_prioritized(batch_size)
+        return self.gather(indices)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.tree.tree.nbytes
+
+
+def check_self_play_fill(maxlen=5000, steps=30000, next_capacity=None, seed=0):
+    ''' Fill one buffer per player with the transitions of random self-play, stored the way self_play's actors
+    and the training notebooks do: new_game_state is the view of the player who moves next.
+    Returns:
+        transitions held by each player's buffer
+    '''
+    from actions import game_actions
+    from encoder import state_space_dim
+    from environment import TrucoEnvironment
+    from player import Player
+    import random
+
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    players = [Player(0), Player(1)]
+    env = TrucoEnvironment(players, legal_actions_mask=True)
+    buffers = {p.get_id(): ReplayBuffer(maxlen, state_space_dim, game_actions.shape[0], next_capacity=next_capacity) for p in players}
+    player, legal_mask, game_state = env.reset()
+    for _ in range(steps):
+        action = rng.choice(np.flatnonzero(legal_mask))
+        reward, done, next_player, next_legal_mask, new_game_state = env.step(player, action)
+        buffers[player.get_id()].append((game_state, action, reward, done, new_game_state, next_legal_mask))
+        player, legal_mask, game_state = next_player, next_legal_mask, new_game_state
+        if done:
+            player, legal_mask, game_state = env.reset()
+    return [len(buffer) for buffer in buffers.values()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that replay buffers fed by self-play fill up to maxlen.")
+    parser.add_argument('--maxlen', type=int, default=5000)
+    parser.add_argument('--steps', type=int, default=30000)
+    parser.add_argument('--next-capacity', type=int, default=None)
+    args = parser.parse_args()
+
+    sizes = check_self_play_fill(args.maxlen, args.steps, args.next_capacity)
+    print(f"Transitions held after {args.steps} steps: {sizes} of {args.maxlen}")
+    raise SystemExit(0 if min(sizes) == args.maxlen else 1)
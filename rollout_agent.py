@@ -0,0 +1,401 @@
+'''
+Determinized Monte Carlo search.
+
+RolloutAgent chooses actions from the legal actions and the encoded game state, like Agent and RandomAgent.
+For each decision it rebuilds the hand from the game state and samples hands for the opponent among the
+cards it has not seen, consistent with the opponent's envido once it is revealed. Every legal action is
+played in a TrucoGame restored from each sample and followed by a rollout to the end of the hand, and the
+action with the best mean point lead is chosen.
+
+Rollouts follow a random policy, or an epsilon-greedy DQN one when given a network. They run in batches of
+samples, in the agent's process or over a pool of worker processes, until the move's rollout budget or time
+budget is spent.
+
+    python rollout_agent.py --hands 200 --rollouts 64
+    python rollout_agent.py --opponent Coors --policy Coors --time-budget 0.5 --workers 3
+'''
+from collections import deque
+from itertools import combinations
+from timeit import default_timer as timer
+import multiprocessing as mp
+import numpy as np
+import argparse
+import logging
+
+from agent import RandomAgent, get_legal_actions_mask, load_agent
+from encoder import (GameStateEncoder, game_offset, score_offset, player_cards_offset, cards_played_offset,
+                     envido_calls_offset, envidos_offset, truco_calls_offset, card_row_size, envido_row_size,
+                     truco_row_size)
+from envido import envido_machine, calculate_envido_batch
+from truco import truco_machine
+from card import card_tier
+from game import TrucoGame, record_game, record_card_game, record_envido, record_truco, record_size
+from environment import TrucoEnvironment
+from player import Player
+from profiler import profiler
+
+search_phase = profiler.phase('rollout.search')
+
+
+def get_calls(game_state, offset, row_size, rows, seat):
+    ''' (seat, call index) pairs of the wager call rows of an encoded game state.
+    '''
+    calls = []
+    for i in range(rows):
+        row = game_state[offset + i * row_size:offset + (i + 1) * row_size]
+        hot = np.flatnonzero(row[1:])
+        if len(hot) == 0:
+            break
+        calls.append((seat if row[0] else 1 - seat, int(hot[0])))
+    return calls
+
+
+def get_has_retruco(truco_calls):
+    ''' Seat that accepted truco and can still raise, as Truco.take_action and take_terminal_action leave it.
+    '''
+    has_retruco = None
+    calls = []
+    for seat, call in truco_calls:
+        active = len(calls) > 0 and calls[-1] not in ('quiero', 'no quiero')
+        calls.append(call)
+        if call == 'quiero':
+            can_raise = has_retruco is None and calls.count('quiero') < 2 and calls.count('vale cuatro') == 0
+            has_retruco = seat if can_raise else None
+        elif call != 'no quiero' and not active:
+            has_retruco = None
+    return has_retruco
+
+
+def get_wager_record(machine, calls, finished=False):
+    ''' Envido.snapshot or Truco.snapshot record of (seat, call index) calls, without the has_retruco seat.
+    '''
+    state = 0
+    for seat, call in calls:
+        state = machine.step(state, machine.actions[call])
+    active = len(calls) > 0 and machine.actions[calls[-1][1]] not in ('quiero', 'no quiero')
+    next_seat = 1 - calls[-1][0] if active else -1
+    pairs = [value for pair in calls for value in pair]
+    return [int(finished), next_seat, state, len(calls), *pairs]
+
+
+def decode_game_state(game_state):
+    ''' Rebuild the hand seen by the player of an encoded game state, who must be the next to act.
+    Returns:
+        record: int16 TrucoGame.snapshot record with the opponent's hand left empty (-1)
+        seat: seat of the player
+        opponent_envido: envido of the opponent, None while it is not revealed
+    '''
+    game_state = np.asarray(game_state)
+    seat = 0 if game_state[score_offset] else 1
+    first_seat = seat if game_state[game_offset] else 1 - seat
+
+    record = np.full(record_size, -1, dtype=np.int16)
+    hand = np.flatnonzero(game_state[player_cards_offset:player_cards_offset + 40])
+    record[3 * seat:3 * seat + len(hand)] = hand
+
+    # Cards played, and who leads each round: the winner, or the player who led it on a tie
+    played_ids, played_by = [], []
+    for i in range(6):
+        row = game_state[cards_played_offset + i * card_row_size:cards_played_offset + (i + 1) * card_row_size]
+        hot = np.flatnonzero(row[1:])
+        if len(hot) == 0:
+            break
+        played_ids.append(int(hot[0]))
+        played_by.append(seat if row[0] else 1 - seat)
+    card_next = first_seat
+    for i, card_id in enumerate(played_ids):
+        if i % 2 == 0:
+            card_next = 1 - played_by[i]
+        elif card_tier[played_ids[i - 1]] >= card_tier[card_id]:
+            card_next = played_by[i - 1]
+        else:
+            card_next = played_by[i]
+
+    rounds = len(played_ids) // 2
+    record[record_game:record_card_game] = [game_state[score_offset + 1], game_state[score_offset + 3], 0, rounds, first_seat]
+
+    card_game = [0, card_next, len(played_ids), *played_ids, *[-1] * (6 - len(played_ids)), *played_by]
+    record[record_card_game:record_card_game + len(card_game)] = card_game
+
+    envido_calls = get_calls(game_state, envido_calls_offset, envido_row_size, 3, seat)
+    envido_finished = len(envido_calls) > 0 and envido_machine.actions[envido_calls[-1][1]] in ('quiero', 'no quiero')
+    envido = get_wager_record(envido_machine, envido_calls, envido_finished)
+    record[record_envido:record_envido + len(envido)] = envido
+
+    truco_calls = get_calls(game_state, truco_calls_offset, truco_row_size, 5, seat)
+    truco = get_wager_record(truco_machine, truco_calls)
+    has_retruco = get_has_retruco([(s, truco_machine.actions[c]) for s, c in truco_calls])
+    truco.insert(2, -1 if has_retruco is None else has_retruco)
+    record[record_truco:record_truco + len(truco)] = truco
+
+    opponent_envido = int(game_state[envidos_offset + 1])
+    return record, seat, None if opponent_envido == -1 else opponent_envido
+
+
+def get_unseen_cards(record, seat):
+    ''' Cards seat has not seen, and the cards its opponent has played.
+    '''
+    played = record[record_card_game + 3:record_card_game + 9]
+    played_by = record[record_card_game + 9:record_card_game + 15]
+    hand = record[3 * seat:3 * seat + 3]
+    seen = np.zeros(40, dtype=bool)
+    seen[hand[hand >= 0]] = True
+    seen[played[played >= 0]] = True
+    return np.flatnonzero(~seen), played[(played_by == 1 - seat) & (played >= 0)]
+
+
+def get_opponent_hands(record, seat, opponent_envido=None):
+    ''' Every hand the opponent of seat can still hold: the cards seat has not seen, matching the opponent's
+    envido when it is known.
+    Returns:
+        int array (hands, cards left in the opponent's hand)
+    '''
+    unseen, opponent_played = get_unseen_cards(record, seat)
+    size = 3 - len(opponent_played)
+    combos = list(combinations(unseen, size))
+    hands = np.array(combos, dtype=np.intp).reshape(len(combos), size)
+    if opponent_envido is None or size == 0:
+        return hands
+
+    full_hands = np.hstack((np.tile(opponent_played, (len(hands), 1)), hands))
+    consistent = hands[calculate_envido_batch(full_hands) == opponent_envido]
+    if len(consistent) == 0:
+        logging.warning("No opponent hand matches envido %s, using every hand.", opponent_envido)
+        return hands
+    return consistent
+
+
+def sample_opponent_hands(record, seat, opponent_envido, count, rng):
+    ''' count hands drawn uniformly from get_opponent_hands.
+    '''
+    if opponent_envido is None:
+        # Draw straight from the unseen cards, without listing every hand
+        unseen, opponent_played = get_unseen_cards(record, seat)
+        keys = rng.random((count, len(unseen)))
+        return unseen[np.argsort(keys, axis=1)[:, :3 - len(opponent_played)]]
+
+    hands = get_opponent_hands(record, seat, opponent_envido)
+    return hands[rng.integers(len(hands), size=count)]
+
+
+class RolloutWorker:
+    '''
+    Plays rollouts in a scratch game, in the agent's process or in a pool worker.
+    '''
+
+    def __init__(self, policy_net=None, epsilon=0.1, seed=None):
+        '''
+        Args:
+            policy_net: network with act(game_state) choosing the rollout actions epsilon-greedily,
+                        random rollouts when None
+        '''
+        self.players = [Player(0), Player(1)]
+        self.game = TrucoGame(self.players)
+        self.encoder = GameStateEncoder()
+        self.policy_net = policy_net
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng(seed)
+
+    def choose_action(self, seat, legal_mask):
+        legal_ids = np.flatnonzero(legal_mask)
+        if self.policy_net is None or self.rng.random() < self.epsilon:
+            return int(legal_ids[self.rng.integers(len(legal_ids))])
+        q_values = self.policy_net.act(self.encoder.get_view(seat))
+        return int(np.argmax(np.where(legal_mask, q_values, -np.inf)))
+
+    def rollout(self, record, seat, action):
+        ''' Points won minus points given away by seat when it plays action from record and the hand is
+        played out with the rollout policy.
+        '''
+        game = self.game
+        game.restore(record)
+        game.take_action(self.players[seat], action)
+        if self.policy_net is not None:
+            self.encoder.reset(game)
+
+        while not game.finished:
+            mano = game.get_mano_seat()
+            game.take_action(self.players[mano], self.choose_action(mano, game.get_legal_actions_mask(self.players[mano])))
+            if self.policy_net is not None:
+                self.encoder.update()
+
+        return game.get_lead(seat) - (int(record[record_game + seat]) - int(record[record_game + 1 - seat]))
+
+    def run(self, record, seat, hands, action_ids):
+        ''' Total return of each action over the opponent hands.
+        '''
+        record = record.copy()
+        opponent = 3 * (1 - seat)
+        totals = np.zeros(len(action_ids))
+        for hand in hands:
+            record[opponent:opponent + len(hand)] = hand
+            for i, action in enumerate(action_ids):
+                totals[i] += self.rollout(record, seat, action)
+        return totals
+
+
+_worker = None
+
+def _init_worker(policy_net, epsilon):
+    global _worker
+    _worker = RolloutWorker(policy_net, epsilon)
+
+def _run_batch(record, seat, hands, action_ids, seed):
+    _worker.rng = np.random.default_rng(seed)
+    return _worker.run(record, seat, hands, action_ids)
+
+
+class RolloutAgent:
+
+    def __init__(self, player, rollouts=256, time_budget=None, batch_size=16, num_workers=0,
+                 policy_net=None, epsilon=0.1, seed=None, start_method=None):
+        '''
+        Args:
+            rollouts: opponent hands sampled per move, each playing out every legal action. None for no limit,
+                      time_budget must then be set
+            time_budget: seconds per move, after which no more batches are started. At least one batch runs
+            batch_size: opponent hands per batch, the unit of work of a worker
+            num_workers: worker processes, 0 to play the rollouts in this process
+            policy_net: network of the epsilon-greedy rollout policy, e.g. a NumpyDQNetwork. Random rollouts
+                        when None
+            epsilon: exploration of the DQN rollout policy
+            seed: seed of the hand sampling and of the rollouts, for moves that do not depend on the workers
+        '''
+        if rollouts is None and time_budget is None:
+            raise ValueError("RolloutAgent needs a rollout budget, a time budget or both.")
+        self.player = player
+        self.rollouts = rollouts
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.rng = np.random.default_rng(seed)
+
+        self.worker = RolloutWorker(policy_net, epsilon)
+        self.pool = None
+        if num_workers > 0:
+            ctx = mp.get_context(start_method)
+            self.pool = ctx.Pool(num_workers, initializer=_init_worker, initargs=(policy_net, epsilon))
+
+        # Mean return of each legal action and hands sampled at the last decision
+        self.last_values = None
+        self.last_samples = 0
+
+    def has_budget(self, submitted, deadline):
+        if submitted == 0:
+            return True
+        return (self.rollouts is None or submitted < self.rollouts) and (deadline is None or timer() < deadline)
+
+    def search(self, record, seat, opponent_envido, action_ids):
+        ''' Mean return of each action over as many sampled opponent hands as the budget allows.
+        '''
+        deadline = None if self.time_budget is None else timer() + self.time_budget
+        # Keep every worker busy while the next batches are sampled
+        max_pending = 2 * self.num_workers if self.pool is not None else 1
+        pending = deque()
+        totals = np.zeros(len(action_ids))
+        submitted = 0
+
+        while True:
+            while len(pending) < max_pending and self.has_budget(submitted, deadline):
+                size = self.batch_size if self.rollouts is None else min(self.batch_size, self.rollouts - submitted)
+                hands = sample_opponent_hands(record, seat, opponent_envido, size, self.rng)
+                seed = int(self.rng.integers(2 ** 63))
+                if self.pool is not None:
+                    pending.append(self.pool.apply_async(_run_batch, (record, seat, hands, action_ids, seed)))
+                else:
+                    self.worker.rng = np.random.default_rng(seed)
+                    pending.append(self.worker.run(record, seat, hands, action_ids))
+                submitted += size
+            if not pending:
+                break
+            result = pending.popleft()
+            totals += result.get() if self.pool is not None else result
+
+        profiler.count('rollout.samples', submitted)
+        self.last_samples = submitted
+        return totals / submitted
+
+    def choose_action(self, legal_actions, game_state):
+        legal_ids = np.flatnonzero(get_legal_actions_mask(legal_actions))
+        if len(legal_ids) == 1:
+            return int(legal_ids[0])
+
+        with search_phase:
+            record, seat, opponent_envido = decode_game_state(game_state)
+            self.last_values = self.search(record, seat, opponent_envido, legal_ids)
+        return int(legal_ids[np.argmax(self.last_values)])
+
+    def choose_actions(self, legal_masks, game_states):
+        return np.array([self.choose_action(m, s) for m, s in zip(legal_masks, game_states)])
+
+    def learn(self):
+        pass
+
+    def save_transition(self, transition):
+        pass
+
+    def save_reward(self, episode_reward):
+        pass
+
+    def get_name(self):
+        return self.player.get_id()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+def play_hands(agent, opponent, hands):
+    ''' Play hands between agent and opponent, each going first half of the time.
+    Returns:
+        points won minus points conceded by agent in each hand
+    '''
+    players = [agent.player, opponent.player]
+    env = TrucoEnvironment(players, legal_actions_mask=True)
+    agents = {agent.get_name(): agent, opponent.get_name(): opponent}
+    leads = []
+    for hand in range(hands):
+        player, legal_mask, game_state = env.reset(force=True, goes_first=hand % 2)
+        done = 0
+        while not done:
+            action = agents[player.get_id()].choose_action(legal_mask, game_state)
+            reward, done, player, legal_mask, game_state = env.step(player, action)
+        leads.append(env.game.get_lead(0))
+    return np.array(leads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play a rollout agent against a saved agent or a random one.")
+    parser.add_argument('--opponent', default='random', help="Saved agent to play against, or random.")
+    parser.add_argument('--policy', help="Saved agent whose network guides the rollouts. Random rollouts by default.")
+    parser.add_argument('--epsilon', type=float, default=0.1, help="Exploration of the rollout policy.")
+    parser.add_argument('--hands', type=int, default=100)
+    parser.add_argument('--rollouts', type=int, default=64, help="Opponent hands sampled per move, 0 for no limit.")
+    parser.add_argument('--time-budget', type=float, help="Seconds per move.")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    policy_net = None
+    if args.policy:
+        policy_net = load_agent(args.policy, 'cpu', numpy_inference=True).get_inference_net()
+
+    agent = RolloutAgent(Player('rollout'), rollouts=args.rollouts or None, time_budget=args.time_budget,
+                         batch_size=args.batch_size, num_workers=args.workers, policy_net=policy_net,
+                         epsilon=args.epsilon, seed=args.seed)
+    if args.opponent == 'random':
+        opponent = RandomAgent(Player('random'))
+    else:
+        opponent = load_agent(args.opponent, 'cpu', numpy_inference=True)
+
+    start = timer()
+    leads = play_hands(agent, opponent, args.hands)
+    elapsed = timer() - start
+    agent.close()
+
+    print(f"{args.hands} hands against {args.opponent} in {elapsed:.1f}s")
+    print(f"Points per hand: {leads.mean():+.3f} (std {leads.std():.2f})")
+    print(f"Hands won: {np.mean(leads > 0):.1%} | lost: {np.mean(leads < 0):.1%}")
@@ -0,0 +1,376 @@
+'''
+Actor/learner self-play training.
+
+Actor processes play TrucoEnvironment games with acting-only copies of the agents and stream their
+transitions through a bounded queue to the learner, which owns each Agent's optimizer and replay memory.
+The learner sends fresh weights to the actors every broadcast_freq gradient steps.
+
+    python self_play.py --names Jorge Ale Mai Dimi --actors 4
+'''
+from environment import TrucoEnvironment
+from agent import Agent, ActorAgent, save_agent, load_agent
+from actions import game_actions
+from obs_codec import pack_observations, unpack_observations, pack_masks, unpack_masks
+from player import Player
+from profiler import profiler
+from timeit import default_timer as timer
+from pathlib import Path
+from queue import Empty, Full
+import multiprocessing as mp
+import numpy as np
+import torch as T
+import argparse
+import datetime
+import logging
+import random
+
+wait_phase = profiler.phase('trainer.wait')
+unpack_phase = profiler.phase('trainer.unpack')
+broadcast_phase = profiler.phase('trainer.broadcast')
+
+
+def pack_transitions(transitions):
+    game_states, actions, rewards, dones, new_game_states, legal_masks = zip(*transitions)
+    return (
+        pack_observations(np.stack(game_states)),
+        np.asarray(actions, dtype=np.int16),
+        np.asarray(rewards, dtype=np.float32),
+        np.asarray(dones, dtype=np.int8),
+        pack_observations(np.stack(new_game_states)),
+        pack_masks(np.stack(legal_masks))
+    )
+
+
+def unpack_transitions(packed):
+    game_states, actions, rewards, dones, new_game_states, legal_masks = packed
+    return zip(
+        unpack_observations(game_states),
+        actions.tolist(),
+        rewards.tolist(),
+        dones.tolist(),
+        unpack_observations(new_game_states),
+        unpack_masks(legal_masks, game_actions.shape[0])
+    )
+
+
+def get_weights(agent):
+    return {k: v.detach().cpu() for k, v in agent.online_net.state_dict().items()}
+
+
+def actor_loop(actor_id, agent_specs, transition_queue, weight_queue, stop_event, seed, chunk_size, swap_freq, profile=None):
+    '''
+    Plays games between random pairs of agents until stop_event is set.
+    Transitions are sent per agent in chunks of chunk_size, along with the number of steps the actor has played
+    so far. Weights are refreshed whenever the learner sent new ones.
+    With profile, a (stats path, seconds between dumps) pair, the actor dumps its own phase timings.
+    '''
+    random.seed(seed)
+    np.random.seed(seed)
+    T.manual_seed(seed)
+    T.set_num_threads(1)
+
+    send_phase = profiler.phase('actor.send')
+    if profile is not None:
+        path, every = profile
+        path = Path(path)
+        profiler.enable()
+        profiler.start_dumps(path.with_name(f"{path.stem}_actor{actor_id}{path.suffix}"), every)
+
+    agents = {name: ActorAgent(Player(name), config, state_dict) for name, config, state_dict in agent_specs}
+    names = list(agents)
+    pending = {name: [] for name in names}
+    steps = 0
+
+    def send(name):
+        with send_phase:
+            chunk = pack_transitions(pending[name])
+            pending[name].clear()
+            # Blocks while the learner is behind
+            while not stop_event.is_set():
+                try:
+                    transition_queue.put((actor_id, name, chunk, steps), timeout=1)
+                    return
+                except Full:
+                    pass
+
+    while not stop_event.is_set():
+        random.shuffle(names)
+        env = TrucoEnvironment([agents[names[0]].player, agents[names[1]].player], legal_actions_mask=True)
+        player, legal_actions, game_state = env.reset()
+
+        for _ in range(swap_freq):
+            try:
+                weights = weight_queue.get_nowait()
+                for name, (state_dict, step) in weights.items():
+                    agents[name].load_weights(state_dict, step)
+            except Empty:
+                pass
+
+            agent = agents[player.get_id()]
+            action = agent.choose_action(legal_actions, game_state)
+            reward, done, next_player, next_legal_actions, new_game_state = env.step(player, action)
+            steps += 1
+            profiler.step()
+
+            pending[agent.get_name()].append((game_state, action, reward, done, new_game_state, next_legal_actions))
+            if len(pending[agent.get_name()]) >= chunk_size:
+                send(agent.get_name())
+                if stop_event.is_set():
+                    return
+
+            player, legal_actions, game_state = next_player, next_legal_actions, new_game_state
+            if done:
+                player, legal_actions, game_state = env.reset()
+
+
+class Throughput:
+    '''
+    Counts events and reports their rate since the last report.
+    '''
+    def __init__(self):
+        self.total = 0
+        self.last_total = 0
+        self.last_time = timer()
+
+    def add(self, count=1):
+        self.total += count
+
+    def rate(self):
+        now = timer()
+        rate = (self.total - self.last_total) / max(now - self.last_time, 1e-9)
+        self.last_total = self.total
+        self.last_time = now
+        return rate
+
+
+class SelfPlayTrainer:
+    '''
+    Learner side of self-play: owns the agents, trains them on the transitions sent by the actors and
+    broadcasts their weights back.
+    '''
+
+    def __init__(self, agents, num_actors=2, broadcast_freq=500, queue_size=64, chunk_size=128, updates_per_step=1.0, swap_freq=30000, save_freq=1000000, log_freq=30, start_method='spawn', seed=None, profile=None, profile_freq=30):
+        '''
+        Args:
+            profile: stats file (.csv, or JSON lines otherwise) for the learner's phase timings, actors write
+                     theirs next to it. Profiling stays off when None.
+            profile_freq: seconds between stats dumps
+        '''
+        if len(agents) < 2:
+            raise ValueError("Self-play needs at least two agents.")
+
+        self.agents = {agent.get_name(): agent for agent in agents}
+        self.num_actors = num_actors
+        # How many gradient steps between weight broadcasts
+        self.broadcast_freq = broadcast_freq
+        self.chunk_size = chunk_size
+        # Gradient steps per transition received
+        self.updates_per_step = updates_per_step
+        self.swap_freq = swap_freq
+        self.save_freq = save_freq
+        # Seconds between throughput reports
+        self.log_freq = log_freq
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.profile = profile
+        self.profile_freq = profile_freq
+
+        self.ctx = mp.get_context(start_method)
+        self.transition_queue = self.ctx.Queue(maxsize=queue_size)
+        self.weight_queues = [self.ctx.Queue(maxsize=1) for _ in range(num_actors)]
+        self.stop_event = self.ctx.Event()
+        self.actors = []
+
+        # Steps played by the actors, as last reported by each one, and transitions the learner took in
+        self.env_steps = Throughput()
+        self.actor_steps = [0] * num_actors
+        self.transitions = Throughput()
+        self.grad_steps = Throughput()
+        self.updates_owed = 0.0
+        self.last_broadcast = 0
+
+    def start(self):
+        agent_specs = [(name, agent.get_config(), get_weights(agent)) for name, agent in self.agents.items()]
+        for i in range(self.num_actors):
+            profile = None if self.profile is None else (self.profile, self.profile_freq)
+            args = (i, agent_specs, self.transition_queue, self.weight_queues[i], self.stop_event, self.seed + i, self.chunk_size, self.swap_freq, profile)
+            actor = self.ctx.Process(target=actor_loop, args=args, daemon=True)
+            actor.start()
+            self.actors.append(actor)
+
+    def broadcast(self):
+        weights = {name: (get_weights(agent), agent.step) for name, agent in self.agents.items()}
+        for queue in self.weight_queues:
+            # Replace weights the actor has not picked up yet
+            try:
+                queue.get_nowait()
+            except Empty:
+                pass
+            try:
+                queue.put_nowait(weights)
+            except Full:
+                pass
+        self.last_broadcast = self.grad_steps.total
+
+    def consume(self, name, chunk):
+        agent = self.agents[name]
+        with unpack_phase:
+            transitions = list(unpack_transitions(chunk))
+        for transition in transitions:
+            agent.save_transition(transition)
+            agent.step += 1
+            self.transitions.add()
+
+            self.updates_owed += self.updates_per_step
+            while self.updates_owed >= 1:
+                self.updates_owed -= 1
+                if len(agent.replay_buffer) >= agent.min_replay_size:
+                    agent.learn()
+                    self.grad_steps.add()
+
+        profiler.step(len(transitions))
+        if self.grad_steps.total - self.last_broadcast >= self.broadcast_freq:
+            with broadcast_phase:
+                self.broadcast()
+
+    def report(self):
+        elapsed = str(datetime.timedelta(seconds=int(timer() - self.start_time)))
+        print(f"Env steps: {self.env_steps.total} ({self.env_steps.rate():.0f}/s) | Transitions: {self.transitions.total} ({self.transitions.rate():.0f}/s) | Gradient steps: {self.grad_steps.total} ({self.grad_steps.rate():.0f}/s) | Queue: {self.transition_queue.qsize()} | Time: {elapsed}")
+        for name, agent in self.agents.items():
+            print(f"Player: {name} | Step: {agent.step} | Replay: {len(agent.replay_buffer)}")
+
+    def save(self):
+        for agent in self.agents.values():
+            save_agent(agent)
+
+    def train(self, max_steps=None):
+        ''' Train until the actors have played max_steps steps in total, or until interrupted.
+        '''
+        self.start_time = timer()
+        last_report = self.start_time
+        last_save = 0
+        if self.profile is not None:
+            profiler.enable()
+            profiler.start_dumps(self.profile, self.profile_freq)
+
+        self.start()
+        try:
+            while max_steps is None or self.env_steps.total < max_steps:
+                try:
+                    with wait_phase:
+                        actor_id, name, chunk, steps = self.transition_queue.get(timeout=1)
+                except Empty:
+                    if not any(actor.is_alive() for actor in self.actors):
+                        raise RuntimeError("All actors exited.")
+                    continue
+
+                self.env_steps.add(steps - self.actor_steps[actor_id])
+                self.actor_steps[actor_id] = steps
+                self.consume(name, chunk)
+
+                if timer() - last_report >= self.log_freq:
+                    self.report()
+                    last_report = timer()
+
+                if self.save_freq and self.env_steps.total - last_save >= self.save_freq:
+                    self.save()
+                    last_save = self.env_steps.total
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        # Unblock actors waiting on a full queue
+        try:
+            while True:
+                self.transition_queue.get_nowait()
+        except Empty:
+            pass
+        for actor in self.actors:
+            actor.join(timeout=5)
+            if actor.is_alive():
+                actor.terminate()
+        self.actors.clear()
+
+
+def get_agents(names, device, args):
+    agents = []
+    for name in names:
+        if Path(f"./agent_saves/{name}/model.pt").exists():
+            agents.append(load_agent(name, device))
+        else:
+            agents.append(Agent(
+                Player(name),
+                device=device,
+                state_space_dim=339,
+                action_space_dim=game_actions.shape[0],
+                model_type=args.model_type,
+                replay_buffer_size=args.replay_buffer_size,
+                batch_size=args.batch_size,
+                target_update_freq=args.target_update_freq,
+                epsilon_end=args.epsilon_end,
+                epsilon_decay=args.epsilon_decay,
+                learning_rate=args.learning_rate,
+                weight_decay=args.weight_decay,
+                compress_replay=args.compress_replay,
+                replay_next_capacity=args.replay_next_capacity,
+                prioritized_replay=args.prioritized_replay
+            ))
+    return agents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train agents through multi-process self-play.")
+    parser.add_argument('--names', nargs='+', required=True, help="Agents to train, loaded from agent_saves when they exist.")
+    parser.add_argument('--actors', type=int, default=max(1, mp.cpu_count() - 1))
+    parser.add_argument('--max-steps', type=int, default=None, help="Stop once the actors have played this many steps in total.")
+    parser.add_argument('--broadcast-freq', type=int, default=500, help="Gradient steps between weight broadcasts.")
+    parser.add_argument('--queue-size', type=int, default=64, help="Transition chunks buffered before actors block.")
+    parser.add_argument('--chunk-size', type=int, default=128)
+    parser.add_argument('--updates-per-step', type=float, default=1.0)
+    parser.add_argument('--swap-freq', type=int, default=30000)
+    parser.add_argument('--save-freq', type=int, default=1000000)
+    parser.add_argument('--log-freq', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--model-type', default='deep')
+    parser.add_argument('--replay-buffer-size', type=int, default=15000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--target-update-freq', type=int, default=1500)
+    parser.add_argument('--epsilon-end', type=float, default=0.05)
+    parser.add_argument('--epsilon-decay', type=int, default=1500000)
+    parser.add_argument('--learning-rate', type=float, default=0.0005)
+    parser.add_argument('--weight-decay', type=float, default=1e-3)
+    parser.add_argument('--compress-replay', action='store_true')
+    parser.add_argument('--replay-next-capacity', type=int, help="Replay rows for next states, --replay-buffer-size by default. Smaller saves memory, but actor transitions rarely share their next state, so each buffer then holds only about this many of them, see ReplayBuffer.")
+    parser.add_argument('--prioritized-replay', action='store_true')
+    parser.add_argument('--profile', default=None, help="Stats file (.csv or JSON lines) for per-phase timings. kill -USR1 toggles profiling.")
+    parser.add_argument('--profile-freq', type=float, default=30, help="Seconds between stats dumps.")
+    parser.add_argument('--capture-after', type=int, default=None, help="Learner steps before a cProfile capture.")
+    parser.add_argument('--capture-steps', type=int, default=10000)
+    parser.add_argument('--capture-memory', action='store_true', help="Also trace allocations during the capture.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    device = T.device("cuda:0" if T.cuda.is_available() else "cpu")
+
+    trainer = SelfPlayTrainer(
+        get_agents(args.names, device, args),
+        num_actors=args.actors,
+        broadcast_freq=args.broadcast_freq,
+        queue_size=args.queue_size,
+        chunk_size=args.chunk_size,
+        updates_per_step=args.updates_per_step,
+        swap_freq=args.swap_freq,
+        save_freq=args.save_freq,
+        log_freq=args.log_freq,
+        seed=args.seed,
+        profile=args.profile,
+        profile_freq=args.profile_freq
+    )
+    if args.profile is not None:
+        profiler.toggle_on_signal()
+        if args.capture_after is not None:
+            profiler.capture(args.capture_after, args.capture_steps, Path(args.profile).with_suffix(''), memory=args.capture_memory)
+    try:
+        trainer.train(args.max_steps)
+    finally:
+        trainer.save()
@@ -0,0 +1,148 @@
+'''
+Sequential tests for stopping a matchup early.
+
+A test is fed the point differential of every hand (points of the first agent minus points of the second)
+and settles on a verdict as soon as the evidence allows at the configured error rates:
+
+    'first'   the first agent is stronger
+    'second'  the second agent is stronger
+    'even'    the difference is smaller than delta points per hand (IntervalTest only)
+
+verdict stays None while the test is undecided. Both tests use the normal approximation of the mean
+differential, with its variance estimated from the hands played, and do not decide before min_hands.
+
+    test = SPRT(delta=0.1)
+    for differential in hands:
+        test.update(differential)
+        if test.verdict is not None:
+            break
+'''
+from abc import ABC, abstractmethod
+from statistics import NormalDist
+import math
+
+
+class SequentialTest(ABC):
+    '''
+    Running mean and variance of the differentials, shared by the tests.
+    '''
+    name = None
+
+    def __init__(self, min_hands=100):
+        self.min_hands = min_hands
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.verdict = None
+
+    def update(self, differential):
+        self.count += 1
+        self.total += differential
+        self.total_squares += differential * differential
+        if self.verdict is None and self.count >= self.min_hands:
+            self.verdict = self.decide()
+        return self.verdict
+
+    @abstractmethod
+    def decide(self):
+        ''' Verdict from the hands seen so far, None while undecided.
+        '''
+
+    @property
+    @abstractmethod
+    def settings(self):
+        ''' The test's name and parameters, as a JSON serializable dict.
+        '''
+
+    @property
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return max(self.total_squares - self.total * self.total / self.count, 0.0) / (self.count - 1)
+
+    def interval(self, z=1.96):
+        ''' Confidence interval of the mean differential.
+        '''
+        half_width = z * math.sqrt(self.variance / max(self.count, 1))
+        return self.mean - half_width, self.mean + half_width
+
+
+class SPRT(SequentialTest):
+    '''
+    Wald's sequential probability ratio test of "the first agent wins delta points per hand more" against
+    "the second agent does". It stops at the first verdict that crosses its bound, with error rates alpha
+    (wrongly saying 'first') and beta (wrongly saying 'second') when the true difference is delta or more.
+    Closer matchups take longer, and may run out of hands without a verdict.
+    '''
+    name = 'sprt'
+
+    def __init__(self, delta=0.1, alpha=0.05, beta=0.05, min_hands=100):
+        super().__init__(min_hands)
+        self.delta = delta
+        self.alpha = alpha
+        self.beta = beta
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    @property
+    def llr(self):
+        ''' Log likelihood ratio of the two hypotheses, the means +delta and -delta.
+        '''
+        variance = self.variance
+        if variance == 0:
+            return 0.0
+        return 2 * self.delta * self.total / variance
+
+    @property
+    def settings(self):
+        return {'name': self.name, 'delta': self.delta, 'alpha': self.alpha, 'beta': self.beta, 'min_hands': self.min_hands}
+
+    def decide(self):
+        llr = self.llr
+        if llr >= self.upper:
+            return 'first'
+        elif llr <= self.lower:
+            return 'second'
+        return None
+
+
+class IntervalTest(SequentialTest):
+    '''
+    Stops when the confidence interval of the mean differential excludes 0, or lies within (-delta, delta).
+    The interval is only checked every check_every hands, and alpha is split evenly over the checks that
+    fit in max_hands (Bonferroni), so looking repeatedly keeps the overall error rate below alpha.
+    '''
+    name = 'ci'
+
+    def __init__(self, delta=0.1, alpha=0.05, max_hands=100000, check_every=100, min_hands=100):
+        super().__init__(min_hands)
+        self.delta = delta
+        self.alpha = alpha
+        self.max_hands = max_hands
+        self.check_every = check_every
+        checks = max(1, math.ceil(max_hands / check_every))
+        self.z = NormalDist().inv_cdf(1 - alpha / (2 * checks))
+
+    def decide(self):
+        if self.count % self.check_every:
+            return None
+        low, high = self.interval(self.z)
+        if low > 0:
+            return 'first'
+        elif high < 0:
+            return 'second'
+        elif -self.delta < low and high < self.delta:
+            return 'even'
+        return None
+
+    @property
+    def settings(self):
+        return {'name': self.name, 'delta': self.delta, 'alpha': self.alpha, 'max_hands': self.max_hands,
+                'check_every': self.check_every, 'min_hands': self.min_hands}
+
+
+sequential_tests = {test.name: test for test in (SPRT, IntervalTest)}
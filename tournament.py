@@ -0,0 +1,379 @@
+'''
+Round-robin tournament between saved agents.
+
+Every agent under agent_saves/ (and RandomAgent, as a baseline) plays every other one for a number of
+hands, each going first in half of them. Pairings are played in parallel by a pool of worker processes,
+and each finished pairing is appended to a JSON lines file right away, so an interrupted tournament can
+be run again with the same file and only plays the pairings still missing.
+
+The report ranks the agents by Elo, fitted to all results at once, and gives the metrics of the README
+model evaluation per agent: win rate, game duration (decisions per hand) and points conceded, plus the
+win rate of every pairing.
+
+With --test, each pairing stops as soon as a sequential test (see sequential.py) settles which agent is
+stronger, --hands becoming a budget, and the report adds the hands and CPU time that were saved.
+With --deals, every pairing replays the same deal file, each deal twice with the agents in swapped seats,
+which removes the luck of the deal from the comparison (see deals.py).
+
+    python tournament.py --hands 2000 --results tournament.jsonl
+    python tournament.py Coors Fede Stella --workers 3
+    python tournament.py --hands 20000 --test sprt --delta 0.1 --alpha 0.05
+    python tournament.py --hands 20000 --test sprt --deals deals.npy
+'''
+from timeit import default_timer as timer
+from functools import partial
+from itertools import combinations
+from pathlib import Path
+import multiprocessing as mp
+import numpy as np
+import argparse
+import logging
+import random
+import json
+import time
+import zlib
+
+from agent import RandomAgent, load_agent
+from deals import load_deals
+from environment import TrucoEnvironment
+from player import Player
+from sequential import SPRT, IntervalTest, sequential_tests
+
+random_name = 'random'
+
+# Agents loaded by this worker process, by name
+_agents = {}
+
+
+def discover_agents(path='./agent_saves'):
+    ''' Names of the saved agents, the directories of path holding a model.pt.
+    '''
+    return sorted(p.parent.name for p in Path(path).glob('*/model.pt'))
+
+
+def get_agent(name, epsilon):
+    ''' Agent called name, loaded once per process. Saved agents choose actions with their NumPy network,
+    with exploration set to epsilon.
+    '''
+    if name not in _agents:
+        if name == random_name:
+            _agents[name] = RandomAgent(Player(random_name))
+        else:
+            agent = load_agent(name, 'cpu', numpy_inference=True)
+            agent.epsilon_start = agent.epsilon_end = epsilon
+            _agents[name] = agent
+    return _agents[name]
+
+
+def get_pairing_seed(seed, names):
+    return zlib.crc32('|'.join(names).encode()) ^ seed
+
+
+def get_settings(hands, seed, epsilon=0.0, sequential_test=None, deals_path=None):
+    ''' What the result of a pairing depends on besides its agents. Recorded with each result, and a
+    result is only reused by a run with the same settings.
+    '''
+    return {
+        'budget': hands,
+        'seed': seed,
+        'epsilon': epsilon,
+        'deals': deals_path,
+        'test': None if sequential_test is None else sequential_test().settings,
+    }
+
+
+def play_pairing(names, hands, seed, epsilon=0.0, sequential_test=None, deals_path=None):
+    ''' Play hands hands between two agents, each going first in half of them.
+    Args:
+        sequential_test: callable creating a sequential.SequentialTest, fed the point differential of each
+                         hand. The pairing stops as soon as the test reaches a verdict
+        deals_path: deal file, see deals.py. Its deals are played in order, each one twice with the agents
+                    in swapped seats, and the test is fed the mean differential of both hands of a deal
+    Returns:
+        dict with, for each agent in names order, hands won, points won and decisions taken, plus hands
+        drawn (equal points), the hands played out of the budget and the test's verdict
+    '''
+    settings = get_settings(hands, seed, epsilon, sequential_test, deals_path)
+    seed = get_pairing_seed(seed, names)
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    agents = [get_agent(name, epsilon) for name in names]
+    by_id = {agent.player.get_id(): agent for agent in agents}
+
+    deals = None
+    if deals_path is not None:
+        deals = load_deals(deals_path)
+        if hands > 2 * len(deals):
+            raise ValueError(f"{hands} hands need {(hands + 1) // 2} deals, {deals_path} has {len(deals)}.")
+
+    # Without deals the second seat goes first, so each ordering makes a different agent start. With deals,
+    # both orderings replay the same deals, and each agent gets the other's cards and turn the second time.
+    envs = [TrucoEnvironment([agents[0].player, agents[1].player], legal_actions_mask=True, rng=np.random.default_rng(seed), deals=deals),
+            TrucoEnvironment([agents[1].player, agents[0].player], legal_actions_mask=True, rng=np.random.default_rng(seed + 1), deals=deals)]
+
+    test = None if sequential_test is None else sequential_test()
+    wins, points, turns = [0, 0], [0, 0], [0, 0]
+    draws = played = 0
+    differential = 0
+    start = timer()
+    cpu_start = time.process_time()
+    for hand in range(hands):
+        env = envs[hand % 2]
+        player, legal_mask, game_state = env.reset(force=True, goes_first=1)
+        done = 0
+        while not done:
+            index = names.index(player.get_id())
+            action = by_id[player.get_id()].choose_action(legal_mask, game_state)
+            reward, done, player, legal_mask, game_state = env.step(player, action)
+            turns[index] += 1
+
+        scores = [int(env.game.get_score(agent.player)) for agent in agents]
+        points[0] += scores[0]
+        points[1] += scores[1]
+        if scores[0] == scores[1]:
+            draws += 1
+        else:
+            wins[0 if scores[0] > scores[1] else 1] += 1
+        played += 1
+        if test is None:
+            continue
+        differential += scores[0] - scores[1]
+        if deals is not None and hand % 2 == 0:
+            continue
+        if test.update(differential / 2 if deals is not None else differential) is not None:
+            break
+        differential = 0
+
+    return {
+        'agents': list(names),
+        'hands': played,
+        **settings,
+        'verdict': None if test is None else test.verdict,
+        'wins': wins,
+        'draws': draws,
+        'points': points,
+        'turns': turns,
+        'seconds': timer() - start,
+        'cpu_seconds': time.process_time() - cpu_start,
+    }
+
+
+def _play_pairing(args):
+    return play_pairing(*args)
+
+
+def load_results(path):
+    ''' Pairings recorded in a results file, skipping a line cut short by an interrupted write.
+    '''
+    results = []
+    if Path(path).exists():
+        for line in Path(path).read_text().splitlines():
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning("Skipping an unreadable line of %s.", path)
+    return results
+
+
+def run_tournament(names, hands, results_path, workers=1, seed=0, epsilon=0.0, sequential_test=None, deals_path=None, start_method=None):
+    ''' Play every pairing of names not yet in results_path, appending each result as it finishes.
+    With a sequential_test, see play_pairing, pairings use up to hands hands. Results are only reused
+    when recorded with the same settings, see get_settings.
+    Returns:
+        the results of every pairing of names, recorded earlier or just played
+    '''
+    settings = get_settings(hands, seed, epsilon, sequential_test, deals_path)
+    results = [r for r in load_results(results_path)
+               if all(k in r and r[k] == v for k, v in settings.items()) and set(r['agents']) <= set(names)]
+    played = {tuple(sorted(r['agents'])) for r in results}
+    pending = [pair for pair in combinations(sorted(names), 2) if pair not in played]
+    print(f"{len(played)} pairings already played, {len(pending)} to play.")
+
+    tasks = [(pair, hands, seed, epsilon, sequential_test, deals_path) for pair in pending]
+    with open(results_path, 'a') as f:
+        def record(result):
+            results.append(result)
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            a, b = result['agents']
+            verdict = f", {result['verdict'] or 'no verdict'} after {result['hands']} hands" if sequential_test is not None else ''
+            print(f"[{len(results)}/{len(played) + len(pending)}] {a} vs {b}: {result['wins'][0]}-{result['wins'][1]}{verdict} ({result['seconds']:.1f}s)")
+
+        if workers > 0:
+            with mp.get_context(start_method).Pool(workers) as pool:
+                for result in pool.imap_unordered(_play_pairing, tasks):
+                    record(result)
+        else:
+            for task in tasks:
+                record(_play_pairing(task))
+    return results
+
+
+def fit_elo(results, names, prior=1.0, iterations=1000):
+    ''' Elo ratings fitted to every result at once (Bradley-Terry), with a mean of 1500.
+    Draws count as half a win. prior adds that many drawn hands to every pairing, so agents that never
+    win or never lose still get finite ratings.
+    '''
+    index = {name: i for i, name in enumerate(names)}
+    games = np.zeros((len(names), len(names)))
+    scores = np.zeros(len(names))
+    for r in results:
+        a, b = index[r['agents'][0]], index[r['agents'][1]]
+        games[a, b] += r['hands'] + prior
+        games[b, a] += r['hands'] + prior
+        scores[a] += r['wins'][0] + (r['draws'] + prior) / 2
+        scores[b] += r['wins'][1] + (r['draws'] + prior) / 2
+
+    # Minorization-maximization updates of the strengths
+    strengths = np.ones(len(names))
+    for _ in range(iterations):
+        denominators = (games / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+        updated = np.where(denominators > 0, scores / np.maximum(denominators, 1e-12), strengths)
+        updated /= np.exp(np.log(updated).mean())
+        if np.allclose(updated, strengths, rtol=1e-10):
+            break
+        strengths = updated
+    ratings = 400 * np.log10(strengths)
+    return dict(zip(names, (ratings - ratings.mean() + 1500).tolist()))
+
+
+def summarize(results, names):
+    ''' Per agent totals and README metrics, and the win rate of each agent against each other one.
+    Returns:
+        stats: {name: {'elo', 'hands', 'win_rate', 'points', 'points_conceded', 'duration'}}, win rates
+        and points per hand, duration in decisions per hand
+        win_rates: {(name, opponent): win rate}
+    '''
+    elo = fit_elo(results, names)
+    totals = {name: np.zeros(6) for name in names}   # hands, wins, draws, points, points conceded, decisions
+    win_rates = {}
+    for r in results:
+        for i, name in enumerate(r['agents']):
+            opponent = r['agents'][1 - i]
+            totals[name] += [r['hands'], r['wins'][i], r['draws'], r['points'][i], r['points'][1 - i], sum(r['turns'])]
+            win_rates[name, opponent] = (r['wins'][i] + r['draws'] / 2) / r['hands']
+
+    stats = {}
+    for name in names:
+        hands, wins, draws, points, conceded, decisions = totals[name]
+        hands = max(hands, 1)
+        stats[name] = {
+            'elo': elo[name],
+            'hands': int(hands),
+            'win_rate': (wins + draws / 2) / hands,
+            'points': points / hands,
+            'points_conceded': conceded / hands,
+            'duration': decisions / hands,
+        }
+    return stats, win_rates
+
+
+def format_report(stats, win_rates):
+    names = sorted(stats, key=lambda n: -stats[n]['elo'])
+    lines = [f"{'Agent':<12} {'Elo':>7} {'Hands':>8} {'Win rate':>9} {'Points':>7} {'Conceded':>9} {'Duration':>9}"]
+    for name in names:
+        s = stats[name]
+        lines.append(f"{name:<12} {s['elo']:>7.0f} {s['hands']:>8} {s['win_rate']:>9.3f} {s['points']:>7.2f} {s['points_conceded']:>9.2f} {s['duration']:>9.2f}")
+
+    lines += ['', 'Win rate of the row agent against the column agent:', ' ' * 12 + ''.join(f"{n[:7]:>8}" for n in names)]
+    for name in names:
+        cells = ''.join(f"{win_rates[name, o]:>8.3f}" if (name, o) in win_rates else f"{'-':>8}" for o in names)
+        lines.append(f"{name:<12}{cells}")
+    return '\n'.join(lines)
+
+
+def format_savings(results):
+    ''' Hands played against the hands budgeted, and the CPU time the hands not played would have taken at
+    each pairing's own pace.
+    '''
+    hands = sum(r['hands'] for r in results)
+    budget = sum(r.get('budget', r['hands']) for r in results)
+    cpu = sum(r.get('cpu_seconds', 0.0) for r in results)
+    saved = sum(r.get('cpu_seconds', 0.0) / max(r['hands'], 1) * (r.get('budget', r['hands']) - r['hands']) for r in results)
+    settled = sum(r.get('verdict') is not None for r in results)
+    return (f"{settled}/{len(results)} pairings settled early. Hands played: {hands} of {budget} ({hands / max(budget, 1):.1%})"
+            f" | CPU time: {cpu:.1f}s, about {saved:.1f}s saved")
+
+
+def check_resume(name, hands=200):
+    ''' Play name against RandomAgent under changing settings in a scratch results file, checking that a run
+    only reuses the results recorded with its own settings.
+    Returns:
+        list of (run, pairings played, pairings expected), for the runs that played a different number
+    '''
+    from deals import generate_deals, save_deals
+    import tempfile
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'results.jsonl'
+        deals_path = str(Path(directory) / 'deals.npy')
+        save_deals(deals_path, generate_deals(hands, seed=0))
+
+        sprt = partial(SPRT, min_hands=50)
+        runs = [
+            ('fixed', {}, 1),
+            ('fixed again', {}, 0),
+            ('sprt', {'sequential_test': sprt}, 1),
+            ('sprt again', {'sequential_test': sprt}, 0),
+            ('sprt with another delta', {'sequential_test': partial(SPRT, delta=0.2, min_hands=50)}, 1),
+            ('ci', {'sequential_test': partial(IntervalTest, max_hands=hands, min_hands=50)}, 1),
+            ('fixed after the tests', {}, 0),
+            ('another budget', {'hands': hands // 2}, 1),
+            ('another seed', {'seed': 1}, 1),
+            ('another epsilon', {'epsilon': 0.1}, 1),
+            ('deals', {'deals_path': deals_path}, 1),
+            ('deals again', {'deals_path': deals_path}, 0),
+            ('deals with another seed', {'deals_path': deals_path, 'seed': 1}, 1),
+        ]
+        for run, kwargs, expected in runs:
+            before = len(load_results(path))
+            run_tournament([name, random_name], kwargs.pop('hands', hands), path, workers=0, **kwargs)
+            played = len(load_results(path)) - before
+            if played != expected:
+                failures.append((run, played, expected))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Round-robin tournament between the agents in agent_saves.")
+    parser.add_argument('names', nargs='*', help="Agents to include, every saved agent by default.")
+    parser.add_argument('--hands', type=int, default=1000, help="Hands per pairing.")
+    parser.add_argument('--results', default='tournament.jsonl', help="JSON lines file of finished pairings, resumed from.")
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count() - 1), help="Worker processes, 0 to play in this process.")
+    parser.add_argument('--epsilon', type=float, default=0.0, help="Exploration of the saved agents.")
+    parser.add_argument('--no-random', action='store_true', help="Leave RandomAgent out.")
+    parser.add_argument('--test', choices=sorted(sequential_tests), help="Stop each pairing once this sequential test settles it, within --hands.")
+    parser.add_argument('--delta', type=float, default=0.1, help="Difference in points per hand the sequential test is sized for.")
+    parser.add_argument('--alpha', type=float, default=0.05, help="Error rate of the sequential test.")
+    parser.add_argument('--min-hands', type=int, default=100, help="Hands (deals, with --deals) before the sequential test can stop a pairing.")
+    parser.add_argument('--deals', help="Deal file, see deals.py, to play every deal twice with the agents in swapped seats.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help="Check that results are only resumed under the same settings, with the first agent named.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    names = args.names or discover_agents()
+    if args.check:
+        failures = check_resume(names[0])
+        for run, played, expected in failures:
+            print(f"{run}: played {played} pairings instead of {expected}")
+        print("Resume check " + ("failed." if failures else "passed."))
+        raise SystemExit(1 if failures else 0)
+    if not args.no_random and random_name not in names:
+        names = [*names, random_name]
+    if len(names) < 2:
+        parser.error("A tournament needs at least two agents.")
+
+    sequential_test = None
+    if args.test == 'sprt':
+        sequential_test = partial(SPRT, delta=args.delta, alpha=args.alpha, beta=args.alpha, min_hands=args.min_hands)
+    elif args.test == 'ci':
+        sequential_test = partial(IntervalTest, delta=args.delta, alpha=args.alpha, max_hands=args.hands, min_hands=args.min_hands)
+
+    results = run_tournament(names, args.hands, args.results, args.workers, args.seed, args.epsilon, sequential_test, args.deals)
+    print()
+    print(format_report(*summarize(results, names)))
+    if args.test:
+        print()
+        print(format_savings(results))
@@ -1,7 +1,8 @@
-from wager import is_valid_wager_state, is_wager_active, get_wager_reward, is_wager_finished, is_wager_started
+from wager import WagerMachine, is_wager_active, is_wager_finished, is_wager_started
 import logging
 import numpy as np
-from card_utils import encode_truco
+from card_utils import encode_truco, truco_actions
+from events import WagerCall, WagerForfeited
 
 truco_states = [
     (['truco', 'quiero'], 2),
@@ -19,24 +20,62 @@ truco_states = [
     (['truco', 'quiero', 're-truco', 'vale cuatro', 'no quiero'], 3),
 ]
 
+truco_machine = WagerMachine(truco_states, truco_actions)
+
+# Longest call sequence, and the size of Truco.snapshot: finished, next seat, has_retruco seat,
+# wager state, number of calls and a (seat, call index) pair per call
+max_truco_calls = max(len(state) for state, score in truco_states)
+truco_record_size = 5 + 2 * max_truco_calls
 
-class Truco:
 
+class Truco:
+    '''
+    Truco wager. Players are referred to by seat, their index in game.players.
+    '''
 
     def __init__(self, game):
         '''
         Initialize Truco.
         '''
         self.game = game
+        self.truco_calls = []
+        self.reset()
+
+    def reset(self):
         self.finished = False
+        # Seat expected to answer, None when nobody is
         self.truco_next = None
+        # Seat that accepted and can raise later, None when nobody can
         self.has_retruco = None
-        self.truco_calls = []
+        # (seat, call) pairs
+        self.truco_calls.clear()
+        self.wager_state = 0
         
-    def get_state(self, player):
+    def snapshot(self):
+        ''' State as truco_record_size ints, see restore.
+        '''
+        record = [
+            int(self.finished),
+            -1 if self.truco_next is None else self.truco_next,
+            -1 if self.has_retruco is None else self.has_retruco,
+            self.wager_state,
+            len(self.truco_calls)
+        ]
+        for seat, call in self.truco_calls:
+            record += (seat, truco_machine.action_index[call])
+        return record + [-1] * (truco_record_size - len(record))
+
+    def restore(self, record):
+        self.finished = bool(record[0])
+        self.truco_next = None if record[1] < 0 else record[1]
+        self.has_retruco = None if record[2] < 0 else record[2]
+        self.wager_state = record[3]
+        self.truco_calls[:] = [(record[5 + 2 * i], truco_machine.actions[record[6 + 2 * i]]) for i in range(record[4])]
+
+    def get_state(self, seat):
         state = []
-        for p, c in self.truco_calls:
-            p_id = 1 if player == p else 0
+        for s, c in self.truco_calls:
+            p_id = 1 if seat == s else 0
             turn = [p_id, *encode_truco(c)]
             state.append(np.array(turn, dtype = np.int8))
             
@@ -48,23 +87,31 @@ class Truco:
             
         return state
     
-    def get_legal_actions(self, player):
-        if self.truco_next == player or self.has_retruco == player:
-            raw_state = [call for player, call in self.truco_calls]
-    
-            legal_actions = []
-            for state, val in truco_states:
-                if state[:len(raw_state)] == raw_state and len(raw_state) < len(state):
-                    legal_actions.append(state[len(raw_state)])
-
-            return list(dict.fromkeys(legal_actions))
+    def get_legal_actions(self, seat):
+        if self.truco_next == seat or self.has_retruco == seat:
+            return list(truco_machine.legal_actions[self.wager_state])
         elif not self.is_started():
             return ['truco']
         return []
 
+    def get_legal_actions_mask(self, seat):
+        ''' Legal calls for seat as a bool mask over truco_machine.actions.
+        '''
+        if self.truco_next == seat or self.has_retruco == seat:
+            return truco_machine.legal_mask[self.wager_state]
+        elif not self.is_started():
+            return truco_machine.legal_mask[0]
+        return truco_machine.legal_mask[truco_machine.dead_state]
+
+
+    def add_call(self, seat, call):
+        self.truco_calls.append((seat, call))
+        self.wager_state = truco_machine.step(self.wager_state, call)
+        if self.game.events.active:
+            self.game.events.emit(WagerCall('truco', self.game.players[seat], call))
 
     def get_reward(self):
-        return get_wager_reward(truco_states, self.truco_calls)
+        return truco_machine.get_reward(self.wager_state)
         
     def is_started(self):
         return is_wager_started(self.truco_calls)
@@ -74,7 +121,7 @@ class Truco:
 
 
     def is_valid_state(self, action):
-        return is_valid_wager_state(truco_states, self.truco_calls, action)
+        return truco_machine.is_valid(self.wager_state, action)
     
 
     def is_finished(self):
@@ -82,50 +129,41 @@ class Truco:
     
           
     def switch_turn(self):
-        self.truco_next = self.game.get_opponent(self.truco_next)
+        self.truco_next = 1 - self.truco_next
 
-    def take_action(self, player, action_played):
+    def take_action(self, seat, action_played):
         if self.is_valid_state(action_played):
-            if not self.is_started() and action_played == "truco" and self.game.get_mano() == player:
-                self.truco_calls.append((player,action_played))
-                logging.info(f"{player} called {action_played} to start truco")
-                self.truco_next = self.game.get_opponent(player)
-            elif self.is_active() and self.truco_next == player:
-                self.truco_calls.append((player, action_played))
-                logging.info(f"{player} called {action_played}")
-                self.truco_next = self.game.get_opponent(player)
-            elif self.has_retruco == player and (action_played == "re-truco" or action_played == "vale cuatro"):
-                self.truco_calls.append((player, action_played))
-                logging.info(f"{player} called {action_played} for re-truco")
-                self.truco_next = self.game.get_opponent(player)
+            if not self.is_started() and action_played == "truco" and self.game.get_mano_seat() == seat:
+                self.add_call(seat, action_played)
+                self.truco_next = 1 - seat
+            elif self.is_active() and self.truco_next == seat:
+                self.add_call(seat, action_played)
+                self.truco_next = 1 - seat
+            elif self.has_retruco == seat and (action_played == "re-truco" or action_played == "vale cuatro"):
+                self.add_call(seat, action_played)
+                self.truco_next = 1 - seat
                 self.has_retruco = None 
             else:
-                logging.warning(f"{player} can't call {action_played}. Not your turn.")
+                logging.warning("%s can't call %s. Not your turn.", self.game.players[seat], action_played)
         else:
-            logging.warn(f"{player} can't call {action_played}. Invalid Truco State.")
+            logging.warning("%s can't call %s. Invalid Truco State.", self.game.players[seat], action_played)
 
-    def take_terminal_action(self, player, action_played):
-        self.truco_calls.append((player, action_played))
-        logging.info(f"{player} called {action_played} truco")
+    def take_terminal_action(self, seat, action_played):
+        self.add_call(seat, action_played)
         if action_played == "no quiero":
-            opponent = self.game.get_opponent(player)
-            reward = self.get_reward()
-            self.game.update_score(opponent, reward)
-            logging.debug(f"{opponent} was rewarded {reward} for winning truco.")
+            self.game.update_score(1 - seat, self.get_reward(), 'truco')
             self.game.finish_hand()
         else:
             #is re-truco possible ?
             if self.has_retruco is None and [call for p, call in self.truco_calls].count('quiero') < 2 and [call for p, call in self.truco_calls].count('vale cuatro') == 0:
-                self.has_retruco = player
+                self.has_retruco = seat
             else:
                 self.has_retruco = None
             self.truco_next = None
     
-    def fold(self, player):
+    def fold(self, seat):
         if self.is_active():
-            self.truco_calls.append((player, 'no quiero'))
-        logging.debug(f"{player} forfeited truco")
-        opponent = self.game.get_opponent(player)
-        reward = self.get_reward()
-        self.game.update_score(opponent, reward)
-        logging.debug(f"{opponent} was rewarded {reward} for winning truco.")
\ No newline at end of file
+            self.add_call(seat, 'no quiero')
+        if self.game.events.active:
+            self.game.events.emit(WagerForfeited('truco', self.game.players[seat]))
+        self.game.update_score(1 - seat, self.get_reward(), 'truco')
\ No newline at end of file
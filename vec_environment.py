@@ -0,0 +1,164 @@
+from environment import TrucoEnvironment
+from player import Player
+from actions import game_actions
+import multiprocessing as mp
+import numpy as np
+import logging
+import random
+
+
+class EnvShard:
+    '''
+    A group of TrucoEnvironments stepped together. Lives either in the main process or in a worker.
+    '''
+
+    def __init__(self, num_envs, player_offset=0, logging_level=logging.WARNING):
+        self.envs = [TrucoEnvironment([Player(player_offset + 2 * i), Player(player_offset + 2 * i + 1)], logging_level=logging_level, legal_actions_mask=True) for i in range(num_envs)]
+        self.next_players = [None] * num_envs
+        self.observations = np.zeros((num_envs, 339), dtype=np.float32)
+        self.legal_masks = np.zeros((num_envs, game_actions.shape[0]), dtype=bool)
+        self.next_seats = np.zeros(num_envs, dtype=np.int8)
+
+    def _record(self, i, env, next_player, legal_mask):
+        self.next_players[i] = next_player
+        self.next_seats[i] = env.players.index(next_player)
+        self.legal_masks[i] = legal_mask
+
+    def reset(self):
+        for i, env in enumerate(self.envs):
+            next_player, legal_mask, _ = env.reset(out=self.observations[i])
+            self._record(i, env, next_player, legal_mask)
+
+        return self.next_seats.copy(), self.legal_masks.copy(), self.observations.copy()
+
+    def step(self, actions):
+        rewards = np.zeros(len(self.envs), dtype=np.float32)
+        dones = np.zeros(len(self.envs), dtype=np.int8)
+
+        for i, env in enumerate(self.envs):
+            reward, done, next_player, legal_mask, _ = env.step(self.next_players[i], int(actions[i]), out=self.observations[i])
+            rewards[i] = reward
+            dones[i] = done
+            if done:
+                next_player, legal_mask, _ = env.reset(out=self.observations[i])
+            self._record(i, env, next_player, legal_mask)
+
+        return rewards, dones, self.next_seats.copy(), self.legal_masks.copy(), self.observations.copy()
+
+
+def _worker(remote, parent_remote, num_envs, player_offset, seed, logging_level):
+    parent_remote.close()
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    shard = EnvShard(num_envs, player_offset, logging_level)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                remote.send(shard.step(data))
+            elif cmd == 'reset':
+                remote.send(shard.reset())
+            elif cmd == 'close':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+
+class VecTrucoEnvironment:
+    '''
+    Runs num_envs independent games of Truco and steps them together over stacked NumPy arrays.
+
+    Games are split across num_workers subprocesses, or played in the calling process when num_workers is 0.
+    Finished games are reset automatically, so the arrays returned for a game that is done describe the
+    first state of its next game. Seats (0 or 1) index the players of each game, see get_players.
+    '''
+
+    def __init__(self, num_envs, num_workers=0, seed=None, logging_level=logging.WARNING, start_method=None):
+        self.num_envs = num_envs
+        self.num_workers = min(num_workers, num_envs)
+        self.closed = False
+
+        if self.num_workers == 0:
+            if seed is not None:
+                random.seed(seed)
+                np.random.seed(seed)
+            self.shard = EnvShard(num_envs, logging_level=logging_level)
+            self.remotes = []
+            self.processes = []
+            return
+
+        # Split games as evenly as possible between workers
+        sizes = [len(s) for s in np.array_split(np.arange(num_envs), self.num_workers)]
+        self.shard_bounds = np.cumsum([0, *sizes])
+
+        ctx = mp.get_context(start_method)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_workers)])
+        self.processes = []
+        for w, (remote, work_remote) in enumerate(zip(self.remotes, work_remotes)):
+            args = (
+                work_remote,
+                remote,
+                sizes[w],
+                2 * self.shard_bounds[w],
+                None if seed is None else seed + w,
+                logging_level
+            )
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+    def get_players(self, env_index):
+        ''' Return the two Players of a game, in seat order.
+        '''
+        offset = 2 * env_index
+        return Player(offset), Player(offset + 1)
+
+    def reset(self):
+        '''
+        Start a new game in every environment.
+        Returns:
+            next_seats (int8, num_envs), legal_masks (bool, num_envs x actions), observations (float32, num_envs x 339)
+        '''
+        if self.num_workers == 0:
+            return self.shard.reset()
+
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        return self._gather([remote.recv() for remote in self.remotes])
+
+    def step(self, actions):
+        '''
+        Play actions[i] for the next player of game i.
+        Returns:
+            rewards (float32), dones (int8), next_seats (int8), legal_masks (bool), observations (float32)
+        '''
+        actions = np.asarray(actions)
+        if self.num_workers == 0:
+            return self.shard.step(actions)
+
+        for w, remote in enumerate(self.remotes):
+            remote.send(('step', actions[self.shard_bounds[w]:self.shard_bounds[w + 1]]))
+        return self._gather([remote.recv() for remote in self.remotes])
+
+    def _gather(self, results):
+        return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -1,16 +1,5 @@
 import numpy as np
-    
-
-def is_valid_wager_state(all_states, current_state, action):
-    raw_state = np.append([call for player, call in current_state], action)
-    
-    for state, score in all_states:
-        zipped = list(zip(state, raw_state))
-        if len(zipped) != len(raw_state):
-            continue
-        if np.all([True if a == b else False for a, b in zipped]):
-            return True
-    return False
+
 
 def is_wager_finished(current_state):
     return len(current_state) > 0 and (current_state[-1][1] == 'quiero' or current_state[-1][1] ==  'no quiero')
@@ -21,10 +10,69 @@ def is_wager_started(current_state):
 def is_wager_active(current_state):
     return is_wager_started(current_state) and not is_wager_finished(current_state)
 
-def get_wager_reward(all_states, current_state):
-    raw_state = [call for player, call in current_state]
-    for state, score in all_states:
-        if len(state) == len(raw_state) and np.all(state == raw_state):
-            return score
-    raise Exception(f"Can't get wager reward. No wager matching {raw_state}")
-    
\ No newline at end of file
+
+class WagerMachine:
+    '''
+    The call sequences of a wager (e.g. envido_states) compiled into a DFA.
+
+    States are the prefixes of the sequences, with 0 the empty sequence and dead_state the sink for
+    sequences that are not part of the wager. Each state's transitions, legal calls and reward are
+    stored in arrays indexed by state, so they can also be looked up for many games at once.
+    '''
+
+    def __init__(self, all_states, actions):
+        self.actions = list(actions)
+        self.action_index = {a: i for i, a in enumerate(self.actions)}
+
+        sequences = [()]
+        state_index = {(): 0}
+        for state, score in all_states:
+            for i in range(1, len(state) + 1):
+                prefix = tuple(state[:i])
+                if prefix not in state_index:
+                    state_index[prefix] = len(sequences)
+                    sequences.append(prefix)
+
+        self.dead_state = len(sequences)
+        self.sequences = sequences + [None]
+        self.state_index = state_index
+
+        num_states = self.dead_state + 1
+        self.transitions = np.full((num_states, len(self.actions)), self.dead_state, dtype=np.int8)
+        self.rewards = np.zeros(num_states, dtype=np.int8)
+        self.has_reward = np.zeros(num_states, dtype=bool)
+        self.legal_actions = [[] for _ in range(num_states)]
+
+        # Legal calls are kept in order of first appearance in all_states
+        for state, score in all_states:
+            for i in range(len(state)):
+                current = state_index[tuple(state[:i])]
+                self.transitions[current, self.action_index[state[i]]] = state_index[tuple(state[:i + 1])]
+                if state[i] not in self.legal_actions[current]:
+                    self.legal_actions[current].append(state[i])
+            final = state_index[tuple(state)]
+            self.rewards[final] = score
+            self.has_reward[final] = True
+
+        self.legal_mask = self.transitions != self.dead_state
+
+    def get_state(self, current_state):
+        ''' DFA state of a list of (player, call) pairs.
+        '''
+        state = 0
+        for player, call in current_state:
+            state = self.step(state, call)
+        return state
+
+    def step(self, state, action):
+        index = self.action_index.get(action)
+        return self.dead_state if index is None else int(self.transitions[state, index])
+
+    def is_valid(self, state, action):
+        index = self.action_index.get(action)
+        return index is not None and self.legal_mask[state, index]
+
+    def get_reward(self, state):
+        if not self.has_reward[state]:
+            raise Exception(f"Can't get wager reward. No wager matching {self.sequences[state]}")
+        return int(self.rewards[state])